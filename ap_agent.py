@@ -1,20 +1,83 @@
+import os
 import subprocess
-import redis
 import threading
 import time
-import pickle
+import heapq
+import queue
+import signal
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import host_exec
+import nl80211
+import regions
+import registry
+import tracing
+import transport
+import wire_format
 
 #APs
 # aps = ['ap1', 'ap2']
 aps = ['ap1', 'ap2', 'ap3', 'ap4']
+# dpid of every AP, its position in aps unless the APs are given on the
+# command line
+ap_dpids = {}
+# started with AP names the agent runs for those APs only, registers them and
+# reports every AP on its own, see registry.py
+per_ap_mode = False
+# stations in the latest sample of each AP of a per-AP agent
+local_stations = {}
 
 stations_mapping = {}
+# last scan of every station: {'aps': {ssid: signal}, 'scanned_at': monotonic time}
 stations_aps = {}
-stations_traffic = {}
-ap_metrics = []
+# last signal every AP reported for its stations
+stations_signal = {}
+# completed reports waiting to be published, only the newest ones matter
+ap_reports = queue.Queue(maxsize=2)
 
 mappings_path = "mappings.txt"
 AP_METRICS_PERIOD_IN_SECONDS = 10
+# 'nl80211' talks to the kernel directly, 'iw' forks the iw binary
+COLLECTOR_BACKEND = 'nl80211'
+# how many APs are sampled at the same time and how long each one may take
+AP_SAMPLING_CONCURRENCY = 8
+AP_SAMPLING_TIMEOUT_IN_SECONDS = 3
+# for a killed iw to be reaped after the sampling deadline
+AP_SAMPLING_GRACE_IN_SECONDS = 0.5
+
+# netlink sockets are not thread safe, each sampling thread gets its own
+collectors = threading.local()
+# built in main once the APs of this agent are known, with as many workers
+# as the rounds of sample_aps() assume
+sampling_pool = None
+sampling_workers = AP_SAMPLING_CONCURRENCY
+
+# counters are 64 bits, or 32 bits on kernels without the 64 bit
+# nl80211 attributes. Only 32 bit counters wrap during an experiment.
+COUNTER_WRAP = 2**32
+
+# every station is scanned once per period, at most SCAN_CONCURRENCY at a time
+SCAN_PERIOD_IN_SECONDS = 60
+SCAN_CONCURRENCY = 2
+SCAN_TIMEOUT_IN_SECONDS = 10
+# scans older than this are not reported
+SCAN_TTL_IN_SECONDS = 180
+# rescan early when the AP sees the station signal drop this much
+SIGNAL_DROP_DB = 10
+# give the station time to associate before rescanning after a migration
+SCAN_AFTER_MIGRATION_IN_SECONDS = 2
+# migrations of different stations run in parallel on this many workers
+MIGRATION_WORKERS = 4
+MIGRATION_TIMEOUT_IN_SECONDS = 10
+# how long a station may take to associate after the connect command
+ASSOCIATION_TIMEOUT_IN_SECONDS = 5
+
+scan_scheduler = None
+host_executor = host_exec.HostExecutor()
+# migration phase latencies, printed on SIGUSR1
+tracer = tracing.PhaseTracer()
 
 # Utility functions
 
@@ -23,23 +86,45 @@ def read_mappings():
         for line in f:
             data = line.split(' ')
             stations_mapping[data[1]] = data[0]
-            stations_aps[data[0]] = {}
 
     print('mapping', stations_mapping)
     print('aps', stations_aps)
 
 # execute the command
-def run_cmd(cmd):
+def run_cmd(cmd, timeout=None):
     try:
-        output = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+        output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, timeout=timeout)
         return output.decode('UTF-8','ignore')
 
+    except subprocess.TimeoutExpired:
+        raise RuntimeError('cmd execution timed out after %s seconds: %s' % (timeout, cmd))
+
     except subprocess.CalledProcessError as ex:
         if ex.returncode == 255:
             raise RuntimeWarning(ex.output.strip())
         raise RuntimeError('cmd execution returned exit status %d:\n%s'
                 % (ex.returncode, ex.output.strip()))
 
+    # the command could not be started
+    except (OSError, subprocess.SubprocessError) as ex:
+        raise RuntimeError('cmd execution failed: %s: %s' % (cmd, ex))
+
+# execute the command inside a Mininet host, like ./m host cmd
+def run_in_host(host, cmd, timeout=None):
+    return run_cmd(host_executor.prepare(host, cmd), timeout)
+
+# execute several commands in the same host one after the other, the host
+# is looked up once for all of them. The time each command finished is
+# appended to finished when given.
+def run_all_in_host(host, cmds, timeout=None, finished=None):
+    prefix = host_executor.prefix(host)
+    outputs = []
+    for cmd in cmds:
+        outputs.append(run_cmd(prefix + list(cmd), timeout))
+        if finished is not None:
+            finished.append(time.time())
+    return outputs
+
 # Parse SSID
 def get_ssid(output):
     result = output.split("\n")
@@ -59,13 +144,18 @@ def get_stations(output):
         if "Station" in data:
             station = data.split(' ')[1]
             curr_station = station
-            stations[station] = {}
+            # iw prints the 64 bit counters when the kernel has them, which
+            # every kernel Mininet-WiFi runs on does
+            stations[station] = {"counter_bits": 64}
         elif "rx bytes" in data:
             rx_bytes = data.split('\t')[2]
-            stations[curr_station]["rx_bytes"] = rx_bytes
+            stations[curr_station]["rx_bytes"] = int(rx_bytes)
         elif "tx bytes" in data:
             tx_bytes = data.split('\t')[2]
-            stations[curr_station]["tx_bytes"] = tx_bytes
+            stations[curr_station]["tx_bytes"] = int(tx_bytes)
+        elif data.strip().startswith("signal:"):
+            signal = data.split('\t')[2].split(' ')[0]
+            stations[curr_station]["signal"] = int(signal)
     return stations
 
 def get_signal_strengths(output):
@@ -82,144 +172,546 @@ def get_signal_strengths(output):
 
     return signal_strengths
 
-def measures_ap_metrics():
-    dpid = 1
-    report = []    
-    for ap in aps:
-        result = {}
-        result["name"] = ap
-        result["dpid"] = dpid
-        apifname = ap + "-wlan1"
-        result["if_name"] = apifname
-
-        #iw dev ap1-wlan1 info
-        cmd = ['iw', 'dev', apifname, 'info']
-        output = run_cmd(cmd)
-        result["ssid"] = get_ssid(str(output))
-       
-        #get the stations associated
-        cmd = ['iw', 'dev', apifname, 'station', 'dump']
-        output = run_cmd(cmd)
-        stations_associated = get_stations(str(output))
+# timeout of one query of a sample, all the queries of a sample share its
+# deadline
+def step_timeout(timeout, deadline):
+    if deadline is None:
+        return timeout
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise RuntimeError('sampling deadline passed')
+    return left if timeout is None else min(timeout, left)
+
+def collect_with_iw(apifname, timeout=None, deadline=None):
+    #iw dev ap1-wlan1 info
+    cmd = ['iw', 'dev', apifname, 'info']
+    output = run_cmd(cmd, step_timeout(timeout, deadline))
+    ssid = get_ssid(str(output))
+
+    #get the stations associated
+    cmd = ['iw', 'dev', apifname, 'station', 'dump']
+    output = run_cmd(cmd, step_timeout(timeout, deadline))
+    return ssid, get_stations(str(output))
+
+def collect_with_nl80211(apifname, timeout=None, deadline=None):
+    collector = getattr(collectors, 'nl80211', None)
+    if collector is None:
+        collector = nl80211.Nl80211()
+        collectors.nl80211 = collector
+    collector.sock.settimeout(step_timeout(timeout, deadline))
+    ssid = collector.get_ssid(apifname)
+    collector.sock.settimeout(step_timeout(timeout, deadline))
+    return ssid, collector.get_stations(apifname)
+
+# returns the ssid and the stations associated to the AP interface
+def collect_ap_info(apifname, timeout=None, deadline=None):
+    global COLLECTOR_BACKEND
+    if COLLECTOR_BACKEND == 'nl80211':
+        try:
+            return collect_with_nl80211(apifname, timeout, deadline)
+        except OSError as ex:
+            if getattr(collectors, 'nl80211', None) is None:
+                print('nl80211 not available, using iw:', ex)
+                COLLECTOR_BACKEND = 'iw'
+            else:
+                print('nl80211 query failed for', apifname, 'falling back to iw:', ex)
+    return collect_with_iw(apifname, timeout, deadline)
+
+def sample_ap(ap, dpid, deadline=None):
+    result = {}
+    result["name"] = ap
+    result["dpid"] = dpid
+    apifname = ap + "-wlan1"
+    result["if_name"] = apifname
+
+    result["ssid"], stations_associated = collect_ap_info(apifname, AP_SAMPLING_TIMEOUT_IN_SECONDS, deadline)
+    return result, stations_associated, time.monotonic()
+
+# sample every AP at the same time so the rates in one report are comparable,
+# APs that fail or do not answer in time are left out of this cycle. Every
+# query of every AP ends by the cycle's deadline, so no sampling thread
+# outlives the cycle.
+def sample_aps():
+    rounds = -(-len(aps) // sampling_workers)
+    deadline = time.monotonic() + AP_SAMPLING_TIMEOUT_IN_SECONDS * rounds
+    futures = [sampling_pool.submit(sample_ap, ap, ap_dpids[ap], deadline) for ap in aps]
+    wait(futures, timeout=deadline - time.monotonic() + AP_SAMPLING_GRACE_IN_SECONDS)
+
+    samples = []
+    for ap, future in zip(aps, futures):
+        if not future.done():
+            future.cancel()
+            print('sampling', ap, 'timed out, skipping it')
+            continue
+        if future.exception() is not None:
+            print('sampling', ap, 'failed, skipping it:', future.exception())
+            continue
+        samples.append(future.result())
+    return samples
+
+# bytes transferred between two readings of the same counter
+def counter_delta(prev, curr, reassociated, bits=64):
+    if reassociated:
+        # the counters restart at association, everything was sent since then
+        return curr
+    if curr >= prev:
+        return curr - prev
+    if bits == 32 and prev - curr > COUNTER_WRAP // 2:
+        return curr + COUNTER_WRAP - prev
+    # the counter went back without wrapping: the station reassociated
+    return curr
+
+# keeps the last counters of every station, with the monotonic time they
+# were read and the AP that reported them, and turns them into rates
+class CounterTracker:
+    def __init__(self):
+        self.samples = {}
+        # stations in the last sample of every AP
+        self.stations = {}
+
+    def update(self, station, ap, timestamp, rx_bytes, tx_bytes, bits=64):
+        prev = self.samples.get(station)
+        self.samples[station] = (ap, timestamp, rx_bytes, tx_bytes)
+        # no rate yet, rather than a rate of 0 the controller would average in
+        if prev is None:
+            return None
+
+        prev_ap, prev_timestamp, prev_rx_bytes, prev_tx_bytes = prev
+        elapsed = timestamp - prev_timestamp
+        if elapsed <= 0:
+            return None
+
+        reassociated = prev_ap != ap
+        rx_bw = counter_delta(prev_rx_bytes, rx_bytes, reassociated, bits) / elapsed
+        tx_bw = counter_delta(prev_tx_bytes, tx_bytes, reassociated, bits) / elapsed
+        return rx_bw*8/1000000, tx_bw*8/1000000 #convert to Mbps
+
+    # forgets the stations that left the AP since its last sample, unless
+    # another AP reported them since. APs that could not be sampled keep
+    # their stations.
+    def retain(self, ap, stations):
+        stations = set(stations)
+        for station in self.stations.get(ap, set()) - stations:
+            if self.samples.get(station, (None,))[0] == ap:
+                del self.samples[station]
+        self.stations[ap] = stations
+
+station_counters = CounterTracker()
+
+# the datapath id of the AP bridge, Mininet derives it from the digits of
+# the name unless told otherwise
+def get_dpid(ap):
+    try:
+        output = run_cmd(['ovs-vsctl', 'get', 'Bridge', ap, 'datapath-id'], AP_SAMPLING_TIMEOUT_IN_SECONDS)
+        return int(output.strip().strip('"'), 16)
+    except (RuntimeError, RuntimeWarning, OSError, ValueError) as ex:
+        print('no datapath id for', ap, 'from ovs-vsctl, using its name:', ex)
+        return int(''.join(c for c in ap if c.isdigit()))
+
+def request_scan(station_name, delay=0):
+    if scan_scheduler is not None:
+        scan_scheduler.request_scan(station_name, delay)
+
+# RSSI table of the station and how old it is, expired scans are not reported
+def station_scan(station_name):
+    scan = stations_aps.get(station_name)
+    if scan is None:
+        return {'aps': {}, 'rssi_age': None}
+    age = time.monotonic() - scan['scanned_at']
+    if age > SCAN_TTL_IN_SECONDS:
+        request_scan(station_name)
+        return {'aps': {}, 'rssi_age': age}
+    return {'aps': dict(scan['aps']), 'rssi_age': age}
+
+def check_signal_drop(station_name, signal):
+    if signal is None:
+        return
+    prev_signal = stations_signal.get(station_name)
+    stations_signal[station_name] = signal
+    if prev_signal is not None and prev_signal - signal >= SIGNAL_DROP_DB:
+        print(station_name, 'signal dropped from', prev_signal, 'to', signal, 'rescanning')
+        request_scan(station_name)
+
+# per-AP agents scan the stations of their own APs from the first time they
+# see them. An AP that could not be sampled keeps its last stations.
+def track_stations(ap, station_names):
+    new = [name for name in station_names if not is_local_station(name)]
+    local_stations[ap] = set(station_names)
+    for station_name in new:
+        request_scan(station_name)
+
+# a station in the latest sample of one of the APs of this agent, per-AP
+# agents only scan and migrate those
+def is_local_station(station_name):
+    return any(station_name in stations for stations in list(local_stations.values()))
+
+# every per-AP agent gets every instruction, the one whose AP the controller
+# saw the station on runs it, if the station is still there
+def owns_instruction(data):
+    if data.get('ap') is not None and data['ap'] not in aps:
+        return False
+    return is_local_station(data['station_name'])
 
+def measures_ap_metrics():
+    report = []
+    for result, stations_associated, timestamp in sample_aps():
         result['stations_associated'] = {}
         for station in stations_associated:
-            prev_rx_bytes = stations_traffic.get(station, {}).get("rx_bytes", 0)
-            prev_tx_bytes = stations_traffic.get(station, {}).get("tx_bytes", 0)
+            curr_rx_bytes = int(stations_associated[station].get("rx_bytes", 0))
+            curr_tx_bytes = int(stations_associated[station].get("tx_bytes", 0))
 
-            curr_rx_bytes = stations_associated[station].get("rx_bytes", 0)
-            curr_tx_bytes = stations_associated[station].get("tx_bytes", 0)
-
-            if int(curr_rx_bytes) < int(prev_rx_bytes):
-                prev_rx_bytes = 0
-            if int(curr_tx_bytes) < int(prev_tx_bytes):
-                prev_tx_bytes = 0
-
-            stations_traffic[station] = {
-                "rx_bytes": curr_rx_bytes,
-                "tx_bytes": curr_tx_bytes
-            }
-
-            rx_bw = (int(curr_rx_bytes) - int(prev_rx_bytes)) / AP_METRICS_PERIOD_IN_SECONDS
-            tx_bw = (int(curr_tx_bytes) - int(prev_tx_bytes)) / AP_METRICS_PERIOD_IN_SECONDS
+            rates = station_counters.update(station, result["name"], timestamp,
+                                            curr_rx_bytes, curr_tx_bytes,
+                                            stations_associated[station].get("counter_bits", 64))
 
             station_name = stations_mapping[station]
-            result['stations_associated'][station_name] = stations_aps[station_name]
+            check_signal_drop(station_name, stations_associated[station].get("signal"))
 
-            result['stations_associated'][station_name]['rx_rate'] = rx_bw*8/1000000 #convert to Mbps
-            result['stations_associated'][station_name]['tx_rate'] = tx_bw*8/1000000 #convert to Mbps
+            result['stations_associated'][station_name] = station_scan(station_name)
+            # the first sample of a station has no rate, it is left out
+            if rates is not None:
+                result['stations_associated'][station_name]['rx_rate'] = rates[0]
+                result['stations_associated'][station_name]['tx_rate'] = rates[1]
 
+        station_counters.retain(result['name'], stations_associated)
+        if per_ap_mode:
+            track_stations(result['name'], list(result['stations_associated']))
         report.append(result)
-        dpid +=1
 
     return report
 
+# wakes up every period on a fixed grid, so the time spent sampling does not
+# push the next sample back. Ticks missed by a slow cycle are skipped.
+class FixedRateTimer:
+    def __init__(self, period):
+        self.period = period
+        self.next_tick = time.monotonic()
+
+    def wait(self):
+        self.next_tick += self.period
+        now = time.monotonic()
+        if now > self.next_tick:
+            missed = int((now - self.next_tick) // self.period) + 1
+            print('sampling overran by', missed, 'period(s)')
+            self.next_tick += missed * self.period
+        time.sleep(self.next_tick - now)
+
 class ApMetrics(threading.Thread):
     def __init__(self):
         threading.Thread.__init__(self)
-        
+        self.timer = FixedRateTimer(AP_METRICS_PERIOD_IN_SECONDS)
+
+        self.seq = 0
+
+    # hand the report to the Sender right away, dropping the oldest one if
+    # the Sender fell behind
+    def publish(self, report):
+        self.seq += 1
+        item = (self.seq, time.time(), report)
+        while 1:
+            try:
+                ap_reports.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    ap_reports.get_nowait()
+                except queue.Empty:
+                    pass
+
     def run(self):
-        global ap_metrics
         while 1:
-            ap_metrics = measures_ap_metrics()
-            time.sleep(AP_METRICS_PERIOD_IN_SECONDS)
+            self.publish(measures_ap_metrics())
+            self.timer.wait()
 
 
-class StationMetrics(threading.Thread):
-    def __init__(self, station_name):
-        super().__init__()
+# rescans every station once per period. The first scans are spread over
+# the period and at most SCAN_CONCURRENCY run at once, since a scan takes
+# the station off its channel. request_scan() moves a station to the front.
+class ScanScheduler(threading.Thread):
+    def __init__(self, station_names):
         threading.Thread.__init__(self)
-        self.station_name = station_name
+        self.condition = threading.Condition()
+        self.scanning = set()
+        # stations asked for while their scan was running
+        self.rescan = set()
+        self.due = {}
+        self.queue = []
+        now = time.monotonic()
+        for i, station_name in enumerate(station_names):
+            self.schedule(station_name, now + i * SCAN_PERIOD_IN_SECONDS / len(station_names))
+
+    # the heap can hold outdated entries, self.due has the real due time
+    def schedule(self, station_name, due):
+        self.due[station_name] = due
+        heapq.heappush(self.queue, (due, station_name))
+
+    def request_scan(self, station_name, delay=0):
+        with self.condition:
+            if station_name in self.scanning:
+                self.rescan.add(station_name)
+                return
+            due = time.monotonic() + delay
+            if due < self.due.get(station_name, float('inf')):
+                self.schedule(station_name, due)
+                self.condition.notify()
 
     def get_ap_strengths(self, station_name):
         #iw dev sta1-wlan0 scan
         ssifname = station_name + "-wlan0"
-        cmd = ['./m', station_name, 'iw', 'dev', ssifname, 'scan']
-        output = run_cmd(cmd)
+        cmd = ['iw', 'dev', ssifname, 'scan']
+        output = run_in_host(station_name, cmd, SCAN_TIMEOUT_IN_SECONDS)
         stations_aps[station_name] = {
             'aps': get_signal_strengths(str(output)),
+            'scanned_at': time.monotonic(),
         }
-        exit(1)
-        
+
+    def scan(self, station_name):
+        try:
+            self.get_ap_strengths(station_name)
+        except (RuntimeError, RuntimeWarning) as ex:
+            print('scan of', station_name, 'failed:', ex)
+        finally:
+            # a failed scan must not keep its slot
+            self.finish(station_name)
+
+    def finish(self, station_name):
+        with self.condition:
+            self.scanning.discard(station_name)
+            if station_name in self.rescan:
+                self.rescan.discard(station_name)
+                self.schedule(station_name, time.monotonic() + SCAN_AFTER_MIGRATION_IN_SECONDS)
+            # a station that left the APs of this agent waits for
+            # track_stations() to bring it back
+            elif not per_ap_mode or is_local_station(station_name):
+                self.schedule(station_name, time.monotonic() + SCAN_PERIOD_IN_SECONDS)
+            self.condition.notify()
+
+    def next_station(self):
+        with self.condition:
+            while 1:
+                while self.queue and self.queue[0][0] != self.due.get(self.queue[0][1]):
+                    heapq.heappop(self.queue)
+                if not self.queue or len(self.scanning) >= SCAN_CONCURRENCY:
+                    self.condition.wait()
+                    continue
+                due, station_name = self.queue[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.queue)
+                del self.due[station_name]
+                self.scanning.add(station_name)
+                return station_name
+
     def run(self):
-        self.get_ap_strengths(self.station_name)
+        while 1:
+            station_name = self.next_station()
+            threading.Thread(target=self.scan, args=(station_name,), daemon=True).start()
+
+# every agent process reads every instruction and keeps the ones for its own
+# APs, so each needs a stream group of its own, e.g. agent:host1/ap1,ap2
+def transport_instance():
+    if per_ap_mode:
+        return '%s/%s' % (socket.gethostname(), ','.join(aps))
+    return socket.gethostname()
 
 class Sender(threading.Thread):
     def __init__(self):
         threading.Thread.__init__(self)
-        self.redis = redis.Redis('127.0.0.1')
-        self.pubsub = self.redis.pubsub()
+        self.transport = transport.connect('agent', transport_instance())
+        # deltas are against the last report on the same channel
+        self.encoders = {}
 
     def run(self):
-        global ap_metrics
         while 1:
-            print(ap_metrics)
+            seq, captured_at, report = ap_reports.get()
+            print(report)
             print()
-            
-            pvalue = pickle.dumps(ap_metrics)
-            self.redis.publish("statistics", pvalue)
- 
-            time.sleep(20)
+
+            if per_ap_mode:
+                # the controller decodes every AP on its own
+                for stat in report:
+                    encoder = self.encoders.setdefault(stat['name'], wire_format.Encoder())
+                    pvalue = registry.pack_report(stat['name'], encoder.encode([stat], seq, captured_at))
+                    self.transport.publish(registry.report_channel(regions.region_of(stat['dpid'])), pvalue)
+                continue
+
+            for region, part in regions.split_report(report).items():
+                encoder = self.encoders.setdefault(region, wire_format.Encoder())
+                pvalue = encoder.encode(part, seq, captured_at)
+                self.transport.publish(regions.statistics_channel(region), pvalue)
+
+
+# runs migrations on a pool of workers. Instructions for the same station
+# never run concurrently and keep their order; an instruction still waiting
+# when a newer one for the same station arrives is dropped, only the latest
+# target matters. Every instruction is answered on `sdn_ack`.
+class MigrationExecutor:
+    def __init__(self, transport, workers=MIGRATION_WORKERS):
+        self.transport = transport
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.running = set()
+        self.ready = queue.Queue()
+        for _ in range(workers):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def submit(self, data):
+        data.setdefault('trace_id', tracing.new_trace_id())
+        data['phases'] = []
+        self.mark(data, 'received')
+        station = data['station_name']
+        with self.lock:
+            superseded = self.pending.get(station)
+            self.pending[station] = data
+            if superseded is None and station not in self.running:
+                self.ready.put(station)
+        if superseded is not None:
+            self.acknowledge(superseded, False, 'superseded by ' + data['ssid'])
+
+    def mark(self, data, phase, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        data['phases'].append((phase, timestamp))
+        tracer.mark(data['trace_id'], phase, timestamp)
+
+    def acknowledge(self, data, ok, error=None):
+        self.mark(data, 'acked')
+        tracer.finish(data['trace_id'])
+        ack = {'station_name': data['station_name'], 'ssid': data['ssid'],
+               'trace_id': data['trace_id'], 'ok': ok, 'error': error,
+               'phases': data['phases']}
+        self.transport.publish("sdn_ack", transport.pack_message(ack))
+
+    def work(self):
+        while 1:
+            station = self.ready.get()
+            with self.lock:
+                data = self.pending.pop(station)
+                self.running.add(station)
+
+            self.mark(data, 'started')
+            try:
+                self.migrate(data)
+                self.acknowledge(data, True)
+            # anything that kills the worker would leave the station running
+            # for good, the controller gets a nack instead
+            except Exception as ex:
+                print('migration of', station, 'failed:', ex)
+                self.acknowledge(data, False, str(ex))
+            finally:
+                with self.lock:
+                    self.running.discard(station)
+                    if station in self.pending:
+                        self.ready.put(station)
+
+    def migrate(self, data):
+        #iw dev sta1-wlan0 disconnect
+        #iw dev sta1-wlan0 connect ssid-ap2
+
+        ifname = data['station_name'] + '-wlan0'
+
+        cmds = [['iw', 'dev', ifname, 'disconnect'],
+                ['iw', 'dev', ifname, 'connect', data['ssid']]]
+        print(data['station_name'], cmds)
+        finished = []
+        for output in run_all_in_host(data['station_name'], cmds, MIGRATION_TIMEOUT_IN_SECONDS, finished):
+            print(output)
+        self.mark(data, 'disconnected', finished[0])
+        self.mark(data, 'connected', finished[1])
+
+        self.wait_association(data['station_name'], ifname)
+        self.mark(data, 'associated')
+
+        # the RSSI table of the station is stale after it moved
+        request_scan(data['station_name'], SCAN_AFTER_MIGRATION_IN_SECONDS)
+        print()
+
+    def wait_association(self, station_name, ifname):
+        #iw dev sta1-wlan0 link
+        deadline = time.monotonic() + ASSOCIATION_TIMEOUT_IN_SECONDS
+        while time.monotonic() < deadline:
+            output = run_in_host(station_name, ['iw', 'dev', ifname, 'link'], MIGRATION_TIMEOUT_IN_SECONDS)
+            if output.startswith('Connected'):
+                return
+            time.sleep(0.05)
+        raise RuntimeError('%s did not associate within %s seconds' % (station_name, ASSOCIATION_TIMEOUT_IN_SECONDS))
 
 
 class Listener(threading.Thread):
     def __init__(self):
         threading.Thread.__init__(self)
-        self.redis = redis.Redis('127.0.0.1')
-        self.pubsub = self.redis.pubsub()
-        self.pubsub.subscribe(['sdn'])
+        self.transport = transport.connect('agent', transport_instance())
+        self.executor = MigrationExecutor(self.transport)
 
     def run(self):
-        for item in self.pubsub.listen():
-            tmp = item['data']
-            if tmp == 1:
+        for tmp in self.transport.listen('sdn'):
+            try:
+                data = transport.unpack_message(tmp)
+            except ValueError as ex:
+                print('dropping migration instruction:', ex)
+                continue
+            if per_ap_mode and not owns_instruction(data):
                 continue
-            data = pickle.loads(tmp)
             print("data received for migration ", data)
-            self.migrate(data)
+            self.executor.submit(data)
 
-    def migrate(self, data):
-        #./m sta1 iw dev sta1-wlan0 disconnect
-        #./m sta1 iw dev sta1-wlan1 connect ssid-ap2
-
-        ifname = data['station_name'] + '-wlan0'
-
-        cmd = ['./m', data['station_name'], 'iw', 'dev', ifname, 'disconnect']
-        print( cmd)
-        print( run_cmd(cmd))
-
-        cmd = ['./m', data['station_name'], 'iw', 'dev', ifname, 'connect', data['ssid']]
-        print( cmd)
-        print( run_cmd(cmd))
+# keeps the APs of a per-AP agent in the registry
+class Heartbeat(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self, daemon=True)
+        self.registry = registry.Registry()
+        self.entries = []
+        for ap in aps:
+            if_name = ap + "-wlan1"
+            try:
+                ssid, _ = collect_ap_info(if_name, AP_SAMPLING_TIMEOUT_IN_SECONDS)
+            except (RuntimeError, RuntimeWarning) as ex:
+                print('no ssid for', ap, ex)
+                ssid = None
+            self.entries.append((ap, ap_dpids[ap], if_name, ssid))
 
-        print()
+    def run(self):
+        while 1:
+            for entry in self.entries:
+                try:
+                    self.registry.register(*entry)
+                except registry.RegistryError as ex:
+                    print('registering', entry[0], 'failed:', ex)
+            time.sleep(registry.HEARTBEAT_PERIOD)
+
+    def deregister(self, signum, frame):
+        for entry in self.entries:
+            try:
+                self.registry.deregister(entry[0])
+            except registry.RegistryError as ex:
+                print('deregistering', entry[0], 'failed:', ex)
+        # sys.exit() from a signal handler races the interpreter shutdown
+        # waiting for the worker threads
+        os._exit(0)
 
 if __name__ == '__main__':
+    # python ap_agent.py [ap ...]
+    if len(sys.argv) > 1:
+        aps = sys.argv[1:]
+        per_ap_mode = True
+        ap_dpids = {ap: get_dpid(ap) for ap in aps}
+    else:
+        ap_dpids = {ap: dpid for dpid, ap in enumerate(aps, 1)}
     read_mappings()
-
-    for station in stations_mapping:
-        station_monitor = StationMetrics(stations_mapping[station])
-        station_monitor.start()
+    sampling_workers = max(1, min(AP_SAMPLING_CONCURRENCY, len(aps)))
+    sampling_pool = ThreadPoolExecutor(max_workers=sampling_workers)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: print(tracer.dump()))
+
+    if per_ap_mode:
+        heartbeat = Heartbeat()
+        heartbeat.start()
+        signal.signal(signal.SIGTERM, heartbeat.deregister)
+        signal.signal(signal.SIGINT, heartbeat.deregister)
+
+    # per-AP agents add their stations as they see them
+    scan_scheduler = ScanScheduler([] if per_ap_mode else list(stations_mapping.values()))
+    scan_scheduler.start()
     
     ap_monitor = ApMetrics()
     ap_monitor.start()
@@ -9,18 +9,53 @@ from ryu.lib.packet import ether_types
 from ryu.lib.packet import ipv4
 from ryu.lib import hub
 
-
-import redis
-import pickle
+import signal
+import socket
+import time
+
+import balancer
+import fast_parse
+import flows
+import mac_table
+import of_stats
+import packet_in_guard
+import regions
+import registry
+import tracing
+import transport
+import wire_format
 
 STATION_THRESHOLD = 6
 # STATION_THRESHOLD = 2
 SIGNAL_THRESHOLD = -90 # dBm
+# per ssid overrides of STATION_THRESHOLD
+AP_CAPACITY = {}
+# most stations migrated in one statistics cycle
+MIGRATION_BUDGET = 4
+# stations without an ack after this long can be planned again
+MIGRATION_ACK_TIMEOUT = 30 # seconds
+# flows installed on the target AP before a migration outrank the learned
+# ones and expire on their own if the move never happens
+PREINSTALL_PRIORITY = 2
+PREINSTALL_HARD_TIMEOUT = 10 # seconds
+# where station rates come from: 'agent' reports, 'openflow' flow counters
+# polled by the controller, or 'crosscheck' to use the agent's and log where
+# the flow counters disagree
+LOAD_SOURCE = 'agent'
+OPENFLOW_STATS_PERIOD = 0.5 # seconds
+CROSSCHECK_TOLERANCE = 1.0 # Mbps
+# 'single' for one ap_agent.py for every AP, 'per_ap' for an agent per AP or
+# host that registers its APs in Redis, see registry.py
+AGENTS = 'single'
 
 mappings_path = "mappings.txt"
 
 station_name_mappings = {}
 name_ip_mac_mappings = {}
+# station ids used in the flow cookies, and stations by ip and back
+station_ids = {}
+ip_station_mappings = {}
+station_ip_mappings = {}
 
 def read_mappings():
     with open(mappings_path) as f:
@@ -31,159 +66,452 @@ def read_mappings():
                 "ip": data[2].split('/')[0],
                 "mac": data[1]
             }
+            station_ids[data[0]] = len(station_ids) + 1
+            ip_station_mappings[data[2].split('/')[0]] = data[0]
+            station_ip_mappings[data[0]] = data[2].split('/')[0]
 
     print('mapping', name_ip_mac_mappings)
-class SimpleSwitch13(app_manager.RyuApp):
+
+# cookie of the flow from srcip to dstip, 0 when neither end is a station
+def flow_cookie(srcip, dstip, preinstalled=False):
+    src_id = station_ids.get(ip_station_mappings.get(srcip), 0)
+    dst_id = station_ids.get(ip_station_mappings.get(dstip), 0)
+    if not src_id and not dst_id:
+        return 0
+    return flows.flow_cookie(src_id, dst_id, preinstalled)
+
+class SimpleSwitch13(balancer.Balancer, app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    by_rate = False
+    default_capacity = STATION_THRESHOLD
+    ap_capacities = AP_CAPACITY
+    signal_threshold = SIGNAL_THRESHOLD
+    migration_budget = MIGRATION_BUDGET
+    migration_ack_timeout = MIGRATION_ACK_TIMEOUT
 
     def __init__(self, *args, **kwargs):
         read_mappings()
         super(SimpleSwitch13, self).__init__(*args, **kwargs)
-        self.mac_to_port = {}
-        self.statistics = []
+        self.mac_table = mac_table.MacLearningTable()
+        self.init_balancer()
         self.datapaths = {}
+        # flows tagged with a station's id: station -> {dpid: {(src ip, dst ip)}},
+        # emptied as the switches report the flows removed
+        self.station_datapaths = {}
+        # ips each station exchanged traffic with, and the macs behind them
+        self.station_peers = {}
+        self.ip_to_mac = {}
+        # port the stations of each AP are reached on, from the port descriptions
+        self.wlan_ports = {}
 
         # redis code
-        self.redis = redis.Redis('127.0.0.1')
-        self.pubsub = self.redis.pubsub()
-        self.pubsub.subscribe(['statistics'])        
-        self.monitor_thread = hub.spawn(self.monitor)
-
-    def monitor(self):
-        self.logger.info("start ap monitoring thread")
-        for item in self.pubsub.listen():
-            tmp = item['data']
-            # ignore the first/initial return
-            if tmp == 1:
+        # the regions balanced here, each with its own channel and last report
+        owned = regions.owned_regions()
+        # every controller reads every ack and summary
+        self.transport = transport.connect('controller', '%s/%s' % (
+            socket.gethostname(), ','.join(region or 'all' for region in owned)))
+        if AGENTS == 'per_ap':
+            ap_registry = registry.Registry()
+            decoders = {region: registry.ApView(ap_registry, region) for region in owned}
+        else:
+            decoders = {region: wire_format.Decoder() for region in owned}
+        self.init_regions(owned, decoders, self.transport.publish)
+        # migrated stations whose first packet-in from the new AP is awaited, by mac
+        self.awaiting_packet_in = {}
+        self.tracer = tracing.PhaseTracer()
+        self.guard = packet_in_guard.PacketInGuard()
+        signal.signal(signal.SIGUSR1, self.dump_stats)
+        self.rates = of_stats.RateTracker()
+        # flow stats replies split over several messages, by dpid
+        self.flow_stats_parts = {}
+        self.monitor_threads = [hub.spawn(self.monitor, region) for region in self.regions]
+        self.ack_thread = hub.spawn(self.listen_acks)
+        if self.broker is not None:
+            self.summary_thread = hub.spawn(self.listen_summaries)
+            self.handover_threads = [hub.spawn(self.listen_handovers, region) for region in self.regions]
+        if LOAD_SOURCE != 'agent':
+            self.stats_thread = hub.spawn(self.stats_monitor)
+
+    def monitor(self, region):
+        if AGENTS == 'per_ap':
+            channel = registry.report_channel(region)
+        else:
+            channel = regions.statistics_channel(region)
+        self.logger.info("start ap monitoring thread for %s", channel)
+        for tmp in self.transport.listen(channel):
+            if not self.on_statistics(region, tmp):
                 continue
-            self.statistics = pickle.loads(tmp)
             print("---------------------------")
             print("received the statistics ", self.statistics)
             print("---------------------------")
-            oaps =  self.get_overloaded_aps()
-            print("Overloaded aps", oaps)
-            print("---------------------------")
-            uaps = self.get_underloaded_aps()
-            print("Underloaded aps", uaps)
-            print("---------------------------")
-            
-            if oaps and len(oaps) > 0 and uaps and len(uaps) > 0:
-                self.get_possible_handover(oaps, uaps)
-
-                station, new_ap = self.get_possible_handover(oaps, uaps)
-
-                if station and new_ap:
-                    migration_instruction = {'station_name': station, 'ssid': new_ap}
-                    print("station to be migrated ", migration_instruction)
-                    print("---------------------------")
-
-                    pvalue = pickle.dumps(migration_instruction)
-                    self.delete_flows_with_ip_and_mac(name_ip_mac_mappings[station])
-                    self.redis.publish("sdn", pvalue)
-
-    def get_overloaded_aps(self):
-        overloaded_aps = []
-        for stat in self.statistics:
-            if len(stat['stations_associated']) > STATION_THRESHOLD:
-                overloaded_aps.append(stat)
-
-        return overloaded_aps
-
-    def get_underloaded_aps(self):
-        underloaded_aps = []
-        for stat in self.statistics:
-            if len(stat['stations_associated']) < STATION_THRESHOLD:
-                underloaded_aps.append(stat)
-        
-        return underloaded_aps
-    
-    def get_possible_handover(self, oaps, uaps):
-        uap_ssids = set([sta['ssid'] for sta in uaps])
-
-        for oap in oaps:
-            for station in oap['stations_associated']:
-                station_aps = oap['stations_associated'][station]['aps']
-
-                strong_ssids = set([ap for ap in station_aps if float(station_aps[ap]) > SIGNAL_THRESHOLD and ap != oap['ssid']])
-                possible_uaps = strong_ssids & uap_ssids
-                if len(possible_uaps) > 0:
-                    new_ap = next(iter(possible_uaps))
-                    print("possible handover", station, new_ap)
-                    return station, new_ap
-
-        return None, None
-        
-        
+            self.balance()
+
+    def balance(self):
+        if LOAD_SOURCE == 'openflow':
+            self.statistics = of_stats.with_openflow_rates(self.statistics, self.rates, station_ip_mappings)
+        elif LOAD_SOURCE == 'crosscheck':
+            self.crosscheck_rates()
+        oaps, uaps, moves, prevented = self.decide()
+        print("Overloaded aps", oaps)
+        print("---------------------------")
+        print("Underloaded aps", uaps)
+        print("---------------------------")
+        trend = self.smoother.ap_trend()
+        for stat in oaps:
+            self.logger.info("%s load trend %s per s", stat['ssid'], trend[self.model.ap_index[stat['ssid']]])
+        if prevented:
+            self.logger.info("smoothing prevented %d migration(s)", prevented)
+
+        for station, new_ap in moves:
+            print("possible handover", station, new_ap)
+            self.migrate_station(station, new_ap)
+        if self.broker is not None:
+            self.balance_across_regions(oaps, moves)
+
+    def listen_summaries(self):
+        for tmp in self.transport.listen(regions.SUMMARY_CHANNEL):
+            try:
+                self.on_summary(transport.unpack_message(tmp))
+            except ValueError as ex:
+                self.logger.warning("dropping region summary: %s", ex)
+
+    # requests for room on the APs of a region, and replies to its requests
+    def listen_handovers(self, region):
+        for tmp in self.transport.listen(regions.handover_channel(region)):
+            try:
+                self.on_handover(transport.unpack_message(tmp))
+            except ValueError as ex:
+                self.logger.warning("dropping handover message: %s", ex)
+
+    # polls the counters of every datapath, one request each: the station
+    # flows, and the ports only for the crosscheck. With the openflow load
+    # source it balances again on the fresh rates.
+    def stats_monitor(self):
+        self.logger.info("start openflow stats thread")
+        while True:
+            for datapath in list(self.datapaths.values()):
+                parser = datapath.ofproto_parser
+                datapath.send_msg(parser.OFPFlowStatsRequest(datapath, cookie=flows.STATION_COOKIE,
+                                                             cookie_mask=flows.STATION_COOKIE_MASK))
+                if LOAD_SOURCE == 'crosscheck':
+                    datapath.send_msg(parser.OFPPortStatsRequest(datapath, 0, datapath.ofproto.OFPP_ANY))
+            hub.sleep(OPENFLOW_STATS_PERIOD)
+            # which AP a station is on still comes from the agent report, a
+            # station that moved since is counted on its old AP and its
+            # target keeps showing room. Wait for the report that has it.
+            if LOAD_SOURCE == 'openflow' and self.statistics and not self.stations_in_handover():
+                self.balance()
+
+    def crosscheck_rates(self):
+        for station, agent, openflow in of_stats.compare_rates(self.statistics, self.rates,
+                                                               station_ip_mappings, CROSSCHECK_TOLERANCE):
+            self.logger.warning("%s rates differ: agent rx %.2f tx %.2f, flows rx %.2f tx %.2f Mbps",
+                                station, agent[0], agent[1], openflow[0], openflow[1])
+        model = self.get_load_model()
+        for i, stat in enumerate(self.statistics):
+            port_rate = self.rates.port_rate(stat['dpid'], self.wlan_ports.get(stat['dpid']))
+            if port_rate is not None:
+                self.logger.info("%s agent rx %.2f tx %.2f, wlan port rx %.2f tx %.2f Mbps", stat['ssid'],
+                                 model.total_rx_rate[i], model.total_tx_rate[i], port_rate[0], port_rate[1])
+
+    def migrate_station(self, station, new_ap):
+        trace_id = tracing.new_trace_id()
+        self.tracer.mark(trace_id, 'captured', self.captured_at())
+        self.tracer.mark(trace_id, 'decision', time.time())
+
+        # the AP the station is on, for the per-AP agents
+        model = self.get_load_model()
+        s = model.station_index.get(station)
+        ap = self.statistics[model.station_ap[s]]['name'] if s is not None else None
+        migration_instruction = {'station_name': station, 'ssid': new_ap, 'trace_id': trace_id, 'ap': ap}
+        print("station to be migrated ", migration_instruction)
+        print("---------------------------")
+
+        pvalue = transport.pack_message(migration_instruction)
+        # the old flows stay until the move is confirmed, only the target AP
+        # gets flows before the station is there
+        preinstalled = self.preinstall_flows(station, new_ap)
+        self.tracer.mark(trace_id, 'flows_installed', time.time())
+        # the port it was learned on is about to be wrong everywhere
+        self.mac_table.invalidate(name_ip_mac_mappings[station]['mac'])
+
+        index = model.ap_index.get(new_ap)
+        self.start_migration(station, new_ap, trace_id)
+        self.awaiting_packet_in[name_ip_mac_mappings[station]['mac']] = {
+            'trace_id': trace_id, 'issued_at': time.monotonic(), 'acked': False, 'seen_at': None,
+            'dpid': self.statistics[index]['dpid'] if index is not None else self.broker.foreign_dpid(new_ap),
+            'station': station, 'preinstalled': preinstalled, 'confirmed': False,
+            'neighbours': self.neighbours(station, new_ap),
+            # the first packet-in from an AP of another region goes to its controller
+            'remote': index is None,
+        }
+        self.transport.publish("sdn", pvalue)
+        self.tracer.mark(trace_id, 'published', time.time())
+
+    def dump_stats(self, signum, frame):
+        print(self.tracer.dump())
+        print(self.guard.report())
+        print(self.mac_table.report())
+        print(self.smoother.report())
+
+    def listen_acks(self):
+        for tmp in self.transport.listen('sdn_ack'):
+            try:
+                ack = transport.unpack_message(tmp)
+            except ValueError as ex:
+                self.logger.warning("dropping ack: %s", ex)
+                continue
+            station = ack['station_name']
+            trace_id = ack['trace_id']
+            # every controller gets every ack, this one only traced its own
+            # migrations
+            if not self.tracer.is_open(trace_id):
+                continue
+            self.finish_migration(station, trace_id, ack['ok'])
+
+            # the first packet-in can arrive before the ack, keep phases in time order
+            mac = name_ip_mac_mappings[station]['mac']
+            awaiting = self.awaiting_packet_in.get(mac)
+            phases = list(ack['phases'])
+            if awaiting is not None and awaiting['trace_id'] == trace_id and awaiting['seen_at']:
+                phases.append(('first_packet_in', awaiting['seen_at']))
+            for phase, timestamp in sorted(phases, key=lambda item: item[1]):
+                self.tracer.mark(trace_id, phase, timestamp)
+
+            if awaiting is not None and awaiting['trace_id'] == trace_id:
+                if ack['ok']:
+                    self.confirm_handover(awaiting)
+                else:
+                    self.abort_handover(awaiting)
+
+            took = ack['phases'][-1][1] - ack['phases'][0][1]
+            if ack['ok']:
+                self.logger.info("%s migrated to %s in %.3f s", station, ack['ssid'], took)
+            else:
+                self.logger.warning("%s migration to %s failed after %.3f s: %s",
+                                    station, ack['ssid'], took, ack['error'])
+
+            if awaiting is None or awaiting['trace_id'] != trace_id:
+                self.tracer.finish(trace_id)
+            elif not ack['ok'] or awaiting['seen_at'] or awaiting['remote']:
+                del self.awaiting_packet_in[mac]
+                self.tracer.finish(trace_id)
+            else:
+                awaiting['acked'] = True
+
+    # the station is back: its first packet-in came from the AP it moved to
+    def handover_packet_in(self, mac, dpid):
+        awaiting = self.awaiting_packet_in[mac]
+        if dpid != awaiting['dpid'] or awaiting['seen_at']:
+            return
+        awaiting['seen_at'] = time.time()
+        self.confirm_handover(awaiting)
+        if awaiting['acked']:
+            self.tracer.mark(awaiting['trace_id'], 'first_packet_in', awaiting['seen_at'])
+            self.tracer.finish(awaiting['trace_id'])
+            del self.awaiting_packet_in[mac]
+
+    # make before break: the flows of the station through the AP it moves
+    # to are in place before it gets there. The target AP sends its peers'
+    # traffic to the wlan port and the station's to its peers. Nothing else
+    # changes until the move is confirmed, so downlink keeps going to the
+    # old AP meanwhile. Returns the datapaths used.
+    def preinstall_flows(self, station, new_ap):
+        model = self.get_load_model()
+        # the flows on an AP of another region are its controller's
+        if new_ap not in model.ap_index:
+            return []
+        target_stat = self.statistics[model.ap_index[new_ap]]
+        target = self.datapaths.get(target_stat['dpid'])
+        wlan_port = self.wlan_ports.get(target_stat['dpid'])
+        if target is None or wlan_port is None:
+            return []
+
+        ip = name_ip_mac_mappings[station]['ip']
+        peers = self.station_peers.get(station, ())
+        now = time.monotonic()
+        for peer_ip in peers:
+            peer_port = self.mac_table.lookup(target.id, self.ip_to_mac.get(peer_ip), now)
+            if peer_port is not None:
+                self.add_preinstalled_flow(target, ip, peer_ip, peer_port)
+            self.add_preinstalled_flow(target, peer_ip, ip, wlan_port)
+        return [target.id] if peers else []
+
+    # macs of the other stations on the target AP, the switches reach the
+    # target AP over the ports they learned for them
+    def neighbours(self, station, new_ap):
+        model = self.get_load_model()
+        if new_ap not in model.ap_index:
+            return []
+        target_stat = self.statistics[model.ap_index[new_ap]]
+        return [name_ip_mac_mappings[name]['mac'] for name in target_stat['stations_associated']
+                if name in name_ip_mac_mappings and name != station]
+
+    # once the station is on the target AP, the switches that carried its
+    # traffic send its peers' traffic towards the target AP until they
+    # learn the new path. Returns the datapaths used.
+    def redirect_flows(self, awaiting):
+        if awaiting['remote']:
+            return []
+        station = awaiting['station']
+        ip = name_ip_mac_mappings[station]['ip']
+        installed = set()
+        now = time.monotonic()
+        for dpid in self.station_datapaths.get(station, ()):
+            datapath = self.datapaths.get(dpid)
+            ports = (self.mac_table.lookup(dpid, mac, now) for mac in awaiting['neighbours'])
+            towards = next((port for port in ports if port is not None), None)
+            if dpid == awaiting['dpid'] or datapath is None or towards is None:
+                continue
+            for peer_ip in self.station_peers.get(station, ()):
+                self.add_preinstalled_flow(datapath, peer_ip, ip, towards)
+            installed.add(dpid)
+        return sorted(installed)
 
+    def add_preinstalled_flow(self, datapath, srcip, dstip, out_port):
+        parser = datapath.ofproto_parser
+        match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_src=srcip, ipv4_dst=dstip)
+        self.add_flow(datapath, PREINSTALL_PRIORITY, match, [parser.OFPActionOutput(out_port)],
+                      hard=PREINSTALL_HARD_TIMEOUT, cookie=flow_cookie(srcip, dstip, preinstalled=True))
+
+    # the station reached the new AP: its traffic is redirected on the old
+    # path, then its old flows can go
+    def confirm_handover(self, awaiting, redirect=True):
+        if not awaiting['confirmed']:
+            awaiting['confirmed'] = True
+            if redirect:
+                awaiting['preinstalled'] = sorted(set(awaiting['preinstalled']) | set(self.redirect_flows(awaiting)))
+            self.delete_station_flows(awaiting['station'])
+
+    # the station stayed where it was, its traffic must not go to the target AP
+    def abort_handover(self, awaiting):
+        for dpid in awaiting['preinstalled']:
+            datapath = self.datapaths.get(dpid)
+            if datapath is not None:
+                flows.delete_station(datapath, station_ids[awaiting['station']], preinstalled=True)
+        awaiting['preinstalled'] = []
+
+    # stations still moving are left out of the next plans
+    def stations_in_handover(self):
+        now = time.monotonic()
+        for mac, awaiting in list(self.awaiting_packet_in.items()):
+            if now - awaiting['issued_at'] > MIGRATION_ACK_TIMEOUT:
+                # unknown outcome, drop the old flows as before make-before-break
+                self.confirm_handover(awaiting, redirect=False)
+                self.tracer.finish(awaiting['trace_id'])
+                del self.awaiting_packet_in[mac]
+        return super(SimpleSwitch13, self).stations_in_handover()
+
+    # openflow rates are fresher than the report they are merged into
+    def load_timestamp(self):
+        if LOAD_SOURCE == 'openflow':
+            return time.time()
+        return self.captured_at()
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
+        if regions.region_of(datapath.id) not in self.regions:
+            self.logger.warning("datapath %s is not in the regions of this controller", datapath.id)
+            return
         self.datapaths[datapath.id] = datapath
         match = parser.OFPMatch()
         actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
                                           ofproto.OFPCML_NO_BUFFER)]
         self.add_flow(datapath, 0, match, actions)
+        # find the wlan port for make-before-break
+        datapath.send_msg(parser.OFPPortDescStatsRequest(datapath, 0))
 
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None, idle=0):
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        parts = self.flow_stats_parts.setdefault(dpid, [])
+        parts.extend(msg.body)
+        if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            return
+        del self.flow_stats_parts[dpid]
+        self.rates.update_flows(dpid, [
+            (stat.cookie, stat.match['ipv4_src'], stat.match['ipv4_dst'], stat.byte_count,
+             stat.duration_sec + stat.duration_nsec / 1e9)
+            for stat in parts if 'ipv4_src' in stat.match and 'ipv4_dst' in stat.match], time.monotonic())
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def port_stats_reply_handler(self, ev):
+        self.rates.update_ports(ev.msg.datapath.id, [
+            (stat.port_no, stat.rx_bytes, stat.tx_bytes) for stat in ev.msg.body], time.monotonic())
+
+    @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
+    def port_desc_stats_reply_handler(self, ev):
+        for port in ev.msg.body:
+            name = port.name.decode() if isinstance(port.name, bytes) else port.name
+            if '-wlan' in name:
+                self.wlan_ports[ev.msg.datapath.id] = port.port_no
+
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None, idle=0, cookie=0, hard=0, flags=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
                                              actions)]
         if buffer_id:
-            mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
+            mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id, cookie=cookie,
                                     priority=priority, match=match,
-                                    idle_timeout=idle,
+                                    idle_timeout=idle, hard_timeout=hard, flags=flags,
                                     instructions=inst)
         else:
             mod = parser.OFPFlowMod(datapath=datapath, priority=priority,idle_timeout=idle,
-                                    match=match, instructions=inst)
+                                    hard_timeout=hard, flags=flags, cookie=cookie, match=match,
+                                    instructions=inst)
         datapath.send_msg(mod)
 
-    def delete_flows_with_ip_and_mac(self, ip_and_mac):
-        ip = ip_and_mac['ip']
-        mac = ip_and_mac['mac']
-        for dp in self.datapaths.values():
-            # IP as destination
-            parser = dp.ofproto_parser
-            match = parser.OFPMatch(ipv4_dst=ip, eth_type=0x0800)
-            mod = parser.OFPFlowMod(datapath=dp, 
-                                    command=dp.ofproto.OFPFC_DELETE,
-                                    out_port=dp.ofproto.OFPP_ANY, out_group=dp.ofproto.OFPG_ANY,
-                                    priority=1, match=match)
-            print(f'Deleting flows with ip {ip} as destination')
-            dp.send_msg(mod)
-
-            # IP as source
-            match = parser.OFPMatch(ipv4_src=ip, eth_type=0x0800)
-            mod = parser.OFPFlowMod(datapath=dp, 
-                                    command=dp.ofproto.OFPFC_DELETE,
-                                    out_port=dp.ofproto.OFPP_ANY, out_group=dp.ofproto.OFPG_ANY,
-                                    priority=1, match=match)
-            dp.send_msg(mod)
-            print(f'Deleting flows with ip {ip} as source')
-
-            # MAC as destination
-            match = parser.OFPMatch(eth_dst=mac)
-            mod = parser.OFPFlowMod(datapath=dp,
-                                    command=dp.ofproto.OFPFC_DELETE,
-                                    out_port=dp.ofproto.OFPP_ANY, out_group=dp.ofproto.OFPG_ANY,
-                                    priority=1, match=match)
-            
-            dp.send_msg(mod)
-            print(f'Deleting flows with mac {mac} as destination')
-
-            # MAC as source
-            match = parser.OFPMatch(eth_src=mac)
-            mod = parser.OFPFlowMod(datapath=dp, 
-                                    command=dp.ofproto.OFPFC_DELETE,
-                                    out_port=dp.ofproto.OFPP_ANY, out_group=dp.ofproto.OFPG_ANY,
-                                    priority=1, match=match)
-            dp.send_msg(mod)
-            print(f'Deleting flows with mac {mac} as source')
+    # cookie-masked deletes on the datapaths the station's flows were installed on
+    def delete_station_flows(self, station):
+        dpids = self.station_datapaths.pop(station, {})
+        self.guard.forget(name_ip_mac_mappings[station]['ip'])
+        for dpid in dpids:
+            datapath = self.datapaths.get(dpid)
+            if datapath is not None:
+                flows.delete_station(datapath, station_ids[station])
+        print(f'Deleting flows of {station} (id {station_ids[station]}) on datapaths {sorted(dpids)}')
+
+    # learned flows of the stations, for the deletes
+    def remember_flow(self, dpid, srcip, dstip):
+        for ip in (srcip, dstip):
+            station = ip_station_mappings.get(ip)
+            if station is not None:
+                self.station_datapaths.setdefault(station, {}).setdefault(dpid, set()).add((srcip, dstip))
+
+    def forget_flow(self, dpid, srcip, dstip):
+        for ip in (srcip, dstip):
+            datapaths = self.station_datapaths.get(ip_station_mappings.get(ip))
+            if datapaths is None or dpid not in datapaths:
+                continue
+            datapaths[dpid].discard((srcip, dstip))
+            if not datapaths[dpid]:
+                del datapaths[dpid]
+            if not datapaths:
+                del self.station_datapaths[ip_station_mappings[ip]]
+
+    # the learned flows are installed with OFPFF_SEND_FLOW_REM
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        match = ev.msg.match
+        if 'ipv4_src' in match and 'ipv4_dst' in match:
+            self.forget_flow(ev.msg.datapath.id, match['ipv4_src'], match['ipv4_dst'])
+
+    # full parse for the frames fast_parse leaves out, same fields
+    def parse_headers(self, data):
+        pkt = packet.Packet(data)
+        eth = pkt.get_protocols(ethernet.ethernet)[0]
+        srcip = dstip = None
+        if eth.ethertype == ether_types.ETH_TYPE_IP:
+            ip = pkt.get_protocol(ipv4.ipv4)
+            srcip = ip.src
+            dstip = ip.dst
+        return eth.dst, eth.src, eth.ethertype, srcip, dstip
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
@@ -198,27 +526,31 @@ class SimpleSwitch13(app_manager.RyuApp):
         parser = datapath.ofproto_parser
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
+        headers = fast_parse.parse(msg.data)
+        if headers is None:
+            headers = self.parse_headers(msg.data)
+        dst, src, ethertype, srcip, dstip = headers
 
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+        if ethertype == ether_types.ETH_TYPE_LLDP:
             # ignore lldp packet
             return
-        dst = eth.dst
-        src = eth.src
 
         dpid = datapath.id
-        self.mac_to_port.setdefault(dpid, {})
+        now = time.monotonic()
+
+        if src in self.awaiting_packet_in:
+            self.handover_packet_in(src, dpid)
 
         # self.logger.info("packet in %s %s %s %s", dpid, src, dst, in_port)
 
         # learn a mac address to avoid FLOOD next time.
-        self.mac_to_port[dpid][src] = in_port
+        self.mac_table.learn(dpid, src, in_port, now)
 
-        if dst in self.mac_to_port[dpid]:
-            out_port = self.mac_to_port[dpid][dst]
-        else:
+        out_port = self.mac_table.lookup(dpid, dst, now)
+        if out_port is None:
             out_port = ofproto.OFPP_FLOOD
+            if not self.guard.allow_flood(src, now):
+                return
 
         actions = [parser.OFPActionOutput(out_port)]
 
@@ -226,21 +558,30 @@ class SimpleSwitch13(app_manager.RyuApp):
         if out_port != ofproto.OFPP_FLOOD:
 
             # check IP Protocol and create a match for IP
-            if eth.ethertype == ether_types.ETH_TYPE_IP:
-                ip = pkt.get_protocol(ipv4.ipv4)
-                srcip = ip.src
-                dstip = ip.dst
+            if ethertype == ether_types.ETH_TYPE_IP:
+                self.ip_to_mac[srcip] = src
+                for station_ip, peer_ip in ((srcip, dstip), (dstip, srcip)):
+                    if station_ip in ip_station_mappings:
+                        self.station_peers.setdefault(ip_station_mappings[station_ip], set()).add(peer_ip)
                 match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
                                         ipv4_src=srcip,
                                         ipv4_dst=dstip
                                         )
-                # verify if we have a valid buffer_id, if yes avoid to send both
-                # flow_mod & packet_out
-                if msg.buffer_id != ofproto.OFP_NO_BUFFER:
-                    self.add_flow(datapath, 1, match, actions, msg.buffer_id, idle=30)
-                    return
-                else:
-                    self.add_flow(datapath, 1, match, actions,idle=30)
+                cookie = flow_cookie(srcip, dstip)
+                flags = 0
+                if cookie:
+                    self.remember_flow(dpid, srcip, dstip)
+                    flags = ofproto.OFPFF_SEND_FLOW_REM
+                # a flow that went out moments ago is not in the switch yet,
+                # then only this packet is forwarded
+                if not self.guard.duplicate_flow(dpid, (srcip, dstip), now):
+                    # verify if we have a valid buffer_id, if yes avoid to send both
+                    # flow_mod & packet_out
+                    if msg.buffer_id != ofproto.OFP_NO_BUFFER:
+                        self.add_flow(datapath, 1, match, actions, msg.buffer_id, idle=30, cookie=cookie, flags=flags)
+                        return
+                    else:
+                        self.add_flow(datapath, 1, match, actions,idle=30, cookie=cookie, flags=flags)
         data = None
         if msg.buffer_id == ofproto.OFP_NO_BUFFER:
             data = msg.data
@@ -0,0 +1,237 @@
+import logging
+import time
+
+import numpy as np
+
+import load_model
+import planner
+import regions
+import smoothing
+import wire_format
+
+# Balancing decisions, kept apart from Ryu.
+#
+# Both controllers mix this in, simulator.py runs it on simulated time and
+# replay.py on recorded reports. It holds the current statistics report, the
+# load models built from it and the smoothing state, and decides which APs
+# are over or underloaded and which stations to move. It also keeps the
+# migrations in flight, the last report of every region and the handshakes
+# with the controllers of other regions. The controllers set the class
+# attributes from their settings and override the hooks at the top.
+
+
+class Balancer:
+    # load of a station: (rx_rate, tx_rate) or a count of one
+    by_rate = False
+    # per AP limit, stations or Mbps, and per ssid overrides
+    default_capacity = 6
+    ap_capacities = {}
+    signal_threshold = -90 # dBm
+    migration_budget = 4
+    # stations without an ack after this long can be planned again
+    migration_ack_timeout = 30 # seconds
+    # the Ryu apps have their own
+    logger = logging.getLogger('balancer')
+
+    def init_balancer(self):
+        self.statistics = []
+        self.model = None
+        self.raw_model = None
+        self.smoother = smoothing.LoadSmoother()
+        # stations with a migration in progress: name -> (ssid, issued at, trace id)
+        self.migrating = {}
+        # when each station was last confirmed on its new AP
+        self.moved_at = {}
+        self.init_regions([None], {None: wire_format.Decoder()})
+
+    # the regions balanced, each with its own decoder and last report. The
+    # handshakes with the other regions go out through publish.
+    def init_regions(self, owned, decoders, publish=None):
+        self.regions = owned
+        self.decoders = decoders
+        self.region_reports = {}
+        self.last_statistics_seq = {}
+        self.broker = None
+        if regions.REGIONS and publish is not None:
+            self.broker = regions.HandoverBroker(owned, publish)
+
+    # time the cooldowns and migration timeouts run on
+    def clock(self):
+        return time.monotonic()
+
+    # time acks are stamped with, on the clock of the report capture times
+    def ack_timestamp(self):
+        return time.time()
+
+    # time the current report was sampled at, for the averages
+    def load_timestamp(self):
+        return time.time()
+
+    # the view merges the last report of every region, it is as old as the
+    # oldest of them. None before the first report.
+    def captured_at(self):
+        if not self.region_reports:
+            return None
+        return min(self.decoders[region].captured_at for region in self.region_reports)
+
+    # moves a station, the controllers send the instruction
+    def migrate_station(self, station, new_ap):
+        pass
+
+    # a migration got no ack in time
+    def migration_expired(self, station, ssid):
+        self.logger.warning("no ack for %s migration to %s", station, ssid)
+
+    def start_migration(self, station, ssid, trace_id):
+        self.migrating[station] = (ssid, self.clock(), trace_id)
+
+    # returns whether the ack ended the current migration of the station,
+    # acks of superseded instructions do not
+    def finish_migration(self, station, trace_id, ok):
+        if self.migrating.get(station, (None, None, None))[2] != trace_id:
+            return False
+        del self.migrating[station]
+        if ok:
+            self.moved_at[station] = self.ack_timestamp()
+        return True
+
+    # stations left out of the plans while they move
+    def stations_in_handover(self):
+        now = self.clock()
+        for station, (ssid, issued_at, trace_id) in list(self.migrating.items()):
+            if now - issued_at > self.migration_ack_timeout:
+                self.migration_expired(station, ssid)
+                del self.migrating[station]
+        # the report still shows stations that moved after it was captured
+        # on their old AP
+        captured_at = self.captured_at()
+        if captured_at is not None:
+            for station, moved_at in list(self.moved_at.items()):
+                if moved_at < captured_at:
+                    del self.moved_at[station]
+        return set(self.migrating) | set(self.moved_at)
+
+    # decodes a report of one region, the view balanced is the last report
+    # of every region. Returns whether there is a new view.
+    def on_statistics(self, region, payload):
+        decoder = self.decoders[region]
+        try:
+            statistics = decoder.decode(payload)
+        except ValueError as ex:
+            self.logger.warning("dropping statistics: %s", ex)
+            return False
+        # delta for a keyframe we missed, wait for the next keyframe
+        if statistics is None:
+            return False
+        self.region_reports[region] = statistics
+        self.statistics = [stat for name in self.regions for stat in self.region_reports.get(name, ())]
+        self.log_staleness(region)
+        return True
+
+    # how old the report is and whether reports were lost on the way
+    def log_staleness(self, region):
+        decoder = self.decoders[region]
+        seq = decoder.seq
+        staleness = time.time() - decoder.captured_at
+        last_seq = self.last_statistics_seq.get(region)
+        if last_seq is not None and seq > last_seq + 1:
+            self.logger.warning("statistics #%d arrived after #%d, %d report(s) missed",
+                                seq, last_seq, seq - last_seq - 1)
+        self.last_statistics_seq[region] = seq
+        self.logger.info("statistics #%d is %.3f s old", seq, staleness)
+
+    def ap_capacity(self, stat):
+        capacity = self.ap_capacities.get(stat['ssid'], self.default_capacity)
+        if self.by_rate:
+            return (capacity, capacity)
+        return (capacity,)
+
+    # arrays built once per report and shared by the decision methods.
+    # decisions use the smoothed model, raw_model is the report as is
+    def get_load_model(self):
+        if self.model is None or self.model.statistics is not self.statistics:
+            self.raw_model = load_model.LoadModel(self.statistics, by_rate=self.by_rate,
+                                                  capacity=self.ap_capacity)
+            self.model = self.smoother.smooth(self.raw_model, self.load_timestamp())
+        return self.model
+
+    def get_overloaded_aps(self):
+        model = self.get_load_model()
+        return [self.statistics[i] for i in np.flatnonzero(model.overloaded())]
+
+    def get_underloaded_aps(self):
+        model = self.get_load_model()
+        return [self.statistics[i] for i in np.flatnonzero(model.underloaded(smoothing.LOW_WATERMARK))]
+
+    # stations neither plan may move: moving or cooling down
+    def excluded_stations(self):
+        return self.stations_in_handover() | self.smoother.cooling(self.clock())
+
+    def get_possible_handover(self, oaps, uaps, excluded):
+        return planner.plan_handovers(self.get_load_model(), oaps, uaps,
+                                      signal_threshold=self.signal_threshold,
+                                      budget=self.migration_budget,
+                                      excluded=excluded)
+
+    # migrations a decision on the raw samples alone would have made, with
+    # the same stations left out so cooldowns do not count as prevented
+    def count_prevented(self, moves, excluded):
+        raw = self.raw_model
+        oaps = [self.statistics[i] for i in np.flatnonzero(raw.overloaded())]
+        uaps = [self.statistics[i] for i in np.flatnonzero(raw.underloaded())]
+        raw_moves = planner.plan_handovers(raw, oaps, uaps,
+                                           signal_threshold=self.signal_threshold,
+                                           budget=self.migration_budget,
+                                           excluded=excluded)
+        return self.smoother.count_prevented(raw_moves, moves)
+
+    # one decision cycle on the current report: the overloaded and
+    # underloaded APs, the (station, new ssid) moves and how many moves the
+    # smoothing held back. The moved stations start their cooldown.
+    def decide(self):
+        oaps = self.get_overloaded_aps()
+        uaps = self.get_underloaded_aps()
+        # expires the migrations in flight, once per cycle
+        excluded = self.excluded_stations()
+        moves = []
+        if oaps and uaps:
+            moves = self.get_possible_handover(oaps, uaps, excluded)
+        prevented = self.count_prevented(moves, excluded)
+        for station, _ in moves:
+            self.smoother.moved(station, self.clock())
+        return oaps, uaps, moves, prevented
+
+    # tells the neighbours what room the APs here have, and asks them for
+    # room for the stations no AP here could take
+    def balance_across_regions(self, oaps, moves):
+        now = self.clock()
+        model = self.get_load_model()
+        for region in self.regions:
+            self.broker.publish_summary(region, model, now)
+        excluded = set(self.migrating) | set(self.moved_at) | self.smoother.cooling(now)
+        for station, ssid in self.broker.request_handovers(model, oaps, moves, self.signal_threshold,
+                                                           self.migration_budget - len(moves), excluded, now):
+            self.logger.info("asked for room for %s on %s", station, ssid)
+
+    def on_summary(self, message):
+        self.broker.on_summary(message, self.clock())
+
+    # a request for room on the APs here, the reply to one of ours, or the
+    # release of a room granted too late
+    def on_handover(self, message):
+        now = self.clock()
+        if message['type'] == 'release':
+            self.broker.on_release(message)
+            return
+        if message['type'] == 'request':
+            ok = self.broker.on_request(message, self.model, now)
+            self.logger.info("%s room for %s on %s", "granted" if ok else "refused",
+                             message['station'], message['ssid'])
+            return
+        accepted = self.broker.on_reply(message, now)
+        if accepted is None:
+            return
+        station, new_ap = accepted
+        print("possible handover", station, new_ap)
+        self.smoother.moved(station, now)
+        self.migrate_station(station, new_ap)
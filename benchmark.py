@@ -0,0 +1,385 @@
+import pickle
+import random
+import struct
+import sys
+import time
+
+import fast_parse
+import flows
+import packet_in_guard
+import load_model
+import mac_table
+import planner
+import replay
+import synthetic
+import wire_format
+
+# Micro benchmarks for the agent/controller hot paths.
+# usage: python benchmark.py [name ...]
+
+random.seed(2)
+
+def timeit(func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# changes the rates of a fraction of the stations, like a new sampling cycle
+def next_report(report, fraction):
+    report = pickle.loads(pickle.dumps(report))
+    for ap in report:
+        for station in ap['stations_associated'].values():
+            if random.random() < fraction:
+                station['rx_rate'] = random.random() * 5
+    return report
+
+def bench_wire_format():
+    print('%-8s %-10s %12s %12s %12s' % ('stations', 'format', 'bytes', 'encode ms', 'decode ms'))
+    for n_stations in (20, 1000, 10000):
+        n_aps = max(4, n_stations // 20)
+        report = synthetic.make_report(n_stations, n_aps)
+        update = next_report(report, 0.1)
+
+        data = pickle.dumps(report)
+        print('%-8d %-10s %12d %12.3f %12.3f' % (
+            n_stations, 'pickle', len(data),
+            timeit(lambda: pickle.dumps(report)) * 1000,
+            timeit(lambda: pickle.loads(data)) * 1000))
+
+        encoder = wire_format.Encoder()
+        keyframe = encoder.encode(report)
+        print('%-8d %-10s %12d %12.3f %12.3f' % (
+            n_stations, 'keyframe', len(keyframe),
+            timeit(lambda: wire_format.Encoder().encode(report)) * 1000,
+            timeit(lambda: wire_format.Decoder().decode(keyframe)) * 1000))
+
+        delta = encoder.encode(update)
+        decoder = wire_format.Decoder()
+        decoder.decode(keyframe)
+
+        def encode_delta():
+            encoder.since_keyframe = 1
+            encoder.encode(update)
+
+        print('%-8d %-10s %12d %12.3f %12.3f' % (
+            n_stations, 'delta 10%', len(delta),
+            timeit(encode_delta) * 1000,
+            timeit(lambda: decoder.decode(delta)) * 1000))
+
+def bench_planner():
+    print('%-6s %-8s %-8s %10s %10s %8s' % ('aps', 'stations', 'budget', 'model ms', 'plan ms', 'moves'))
+    for n_aps, n_stations in ((4, 20), (100, 2000), (1000, 20000)):
+        report = synthetic.make_report(n_stations, n_aps)
+        threshold = n_stations / n_aps
+        model = load_model.LoadModel(report, False, lambda ap: (threshold,))
+        oaps = [report[i] for i in model.overloaded().nonzero()[0]]
+        uaps = [report[i] for i in model.underloaded().nonzero()[0]]
+        build = timeit(lambda: load_model.LoadModel(report, False, lambda ap: (threshold,)))
+        for budget in (1, 50, 1000):
+            moves = []
+
+            def plan():
+                moves[:] = planner.plan_handovers(model, oaps, uaps, -90, budget)
+
+            print('%-6d %-8d %-8d %10.3f %10.3f %8d' % (n_aps, n_stations, budget, build * 1000,
+                                                        timeit(plan) * 1000, len(moves)))
+
+# the per-report work app-vazao.py did before the load model: both
+# classifications walk every station and the RSSI strings are parsed for
+# every candidate
+def dict_walk(statistics, threshold, signal_threshold):
+    overloaded = []
+    underloaded = []
+    for stat in statistics:
+        total_rx_rate = 0
+        total_tx_rate = 0
+        for station in stat['stations_associated']:
+            total_rx_rate += stat['stations_associated'][station]['rx_rate']
+            total_tx_rate += stat['stations_associated'][station]['tx_rate']
+        if total_rx_rate > threshold or total_tx_rate > threshold:
+            overloaded.append(stat)
+    for stat in statistics:
+        total_rx_rate = 0
+        total_tx_rate = 0
+        for station in stat['stations_associated']:
+            total_rx_rate += stat['stations_associated'][station]['rx_rate']
+            total_tx_rate += stat['stations_associated'][station]['tx_rate']
+        if total_rx_rate < threshold and total_tx_rate < threshold:
+            stat['total_rx_rate'] = total_rx_rate
+            stat['total_tx_rate'] = total_tx_rate
+            underloaded.append(stat)
+    candidates = 0
+    for oap in overloaded:
+        for station in oap['stations_associated']:
+            station_aps = oap['stations_associated'][station]['aps']
+            station_rx = oap['stations_associated'][station]['rx_rate']
+            station_tx = oap['stations_associated'][station]['tx_rate']
+            available = set([ap['ssid'] for ap in underloaded if ap['total_rx_rate'] + station_rx < threshold and ap['total_tx_rate'] + station_tx < threshold])
+            strong = set([ap for ap in station_aps if float(station_aps[ap]) > signal_threshold and ap != oap['ssid']])
+            candidates += len(strong & available)
+    return candidates
+
+def array_walk(statistics, threshold, signal_threshold):
+    model = load_model.LoadModel(statistics, True, lambda ap: (threshold, threshold))
+    station, _, _ = model.candidates(model.overloaded(), model.underloaded(), signal_threshold)
+    return len(station)
+
+def bench_load_model():
+    print('%-6s %-8s %12s %12s %10s' % ('aps', 'stations', 'dicts ms', 'arrays ms', 'candidates'))
+    for n_aps, n_stations in ((4, 20), (100, 2000), (1000, 20000)):
+        report = synthetic.make_report(n_stations, n_aps)
+        # half of the APs above the threshold
+        threshold = sorted(sum(s['rx_rate'] for s in ap['stations_associated'].values())
+                           for ap in report)[n_aps // 2]
+        candidates = (dict_walk(report, threshold, -90), array_walk(report, threshold, -90))
+        print('%-6d %-8d %12.3f %12.3f %10s' % (
+            n_aps, n_stations,
+            timeit(lambda: dict_walk(report, threshold, -90)) * 1000,
+            timeit(lambda: array_walk(report, threshold, -90)) * 1000,
+            '%d/%d' % candidates))
+
+# stand-in for a ryu datapath that only counts what it is sent
+class CountingDatapath:
+    class ofproto:
+        OFPFC_DELETE = 3
+        OFPP_ANY = 0xffffffff
+        OFPG_ANY = 0xffffffff
+        OFPTT_ALL = 0xff
+
+    class ofproto_parser:
+        OFPMatch = dict
+
+        @staticmethod
+        def OFPFlowMod(**fields):
+            return ('flow_mod', fields)
+
+        @staticmethod
+        def OFPBarrierRequest(datapath):
+            return ('barrier',)
+
+    def __init__(self):
+        self.sent = 0
+
+    def send_msg(self, msg):
+        self.sent += 1
+
+# what delete_flows_with_ip_and_mac sent: four deletes to every datapath
+def delete_by_fields(datapaths, ip, mac):
+    for dp in datapaths:
+        parser = dp.ofproto_parser
+        for match in (parser.OFPMatch(ipv4_dst=ip, eth_type=0x0800), parser.OFPMatch(ipv4_src=ip, eth_type=0x0800),
+                      parser.OFPMatch(eth_dst=mac), parser.OFPMatch(eth_src=mac)):
+            dp.send_msg(parser.OFPFlowMod(datapath=dp, command=dp.ofproto.OFPFC_DELETE,
+                                          out_port=dp.ofproto.OFPP_ANY, out_group=dp.ofproto.OFPG_ANY,
+                                          priority=1, match=match))
+
+def bench_flow_delete():
+    # a station's flows sit on its AP and the few switches on the way to its peers
+    holding = 3
+    print('%-10s %-8s %12s %12s' % ('datapaths', 'method', 'messages', 'us'))
+    for n_datapaths in (4, 100, 1000):
+        datapaths = [CountingDatapath() for _ in range(n_datapaths)]
+        delete_by_fields(datapaths, '10.0.0.1', '00:00:00:00:00:01')
+        sent = sum(dp.sent for dp in datapaths)
+        print('%-10d %-8s %12d %12.1f' % (n_datapaths, 'fields', sent,
+              timeit(lambda: delete_by_fields(datapaths, '10.0.0.1', '00:00:00:00:00:01')) * 1e6))
+
+        datapaths = [CountingDatapath() for _ in range(n_datapaths)]
+
+        def delete_cookie():
+            for dp in datapaths[:holding]:
+                flows.delete_station(dp, 1)
+
+        delete_cookie()
+        sent = sum(dp.sent for dp in datapaths)
+        print('%-10d %-8s %12d %12.1f' % (n_datapaths, 'cookie', sent, timeit(delete_cookie) * 1e6))
+
+# frames like the ones reaching the controller: mostly IPv4/UDP from iperf,
+# some ARP and an occasional VLAN tagged frame for the slow path
+def make_frames(n):
+    frames = []
+    for i in range(n):
+        src = bytes([0, 0, 0, 0, i >> 8 & 0xff, i & 0xff])
+        dst = bytes([0, 0, 0, 0, 0, 1])
+        kind = random.random()
+        if kind < 0.01:
+            frames.append(dst + src + struct.pack('!HHH', 0x8100, 10, 0x0800) + bytes(40))
+        elif kind < 0.1:
+            frames.append(b'\xff' * 6 + src + struct.pack('!HHHBBH', 0x0806, 1, 0x0800, 6, 4, 1) + bytes(20))
+        else:
+            ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 28, i & 0xffff, 0, 64, 17, 0,
+                             bytes([10, 0, i >> 8 & 0xff, i & 0xff]), bytes([10, 0, 0, 1]))
+            frames.append(dst + src + struct.pack('!H', 0x0800) + ip + bytes(8))
+    return frames
+
+def bench_packet_in():
+    try:
+        from ryu.lib.packet import packet, ethernet, ipv4
+    except ImportError:
+        packet = None
+
+    def full(data):
+        pkt = packet.Packet(data)
+        eth = pkt.get_protocols(ethernet.ethernet)[0]
+        if eth.ethertype == 0x0800:
+            ip = pkt.get_protocol(ipv4.ipv4)
+            return eth.dst, eth.src, eth.ethertype, ip.src, ip.dst
+        return eth.dst, eth.src, eth.ethertype, None, None
+
+    frames = make_frames(10000)
+
+    def fast():
+        for data in frames:
+            if fast_parse.parse(data) is None and packet is not None:
+                full(data)
+
+    print('%-8s %12s %14s' % ('parser', 'ms', 'packet-in/s'))
+    elapsed = timeit(fast)
+    print('%-8s %12.3f %14.0f' % ('fast', elapsed * 1000, len(frames) / elapsed))
+    if packet is None:
+        print('ryu not installed, full parser not measured')
+        return
+    elapsed = timeit(lambda: [full(data) for data in frames])
+    print('%-8s %12.3f %14.0f' % ('ryu', elapsed * 1000, len(frames) / elapsed))
+
+# control messages the packet-in handler sends during an association burst:
+# every station starts a flow to the server, and its packets keep coming
+# back as packet-ins until the FlowMod is in the switch, while its ARPs for
+# unknown destinations are flooded
+def storm_messages(guard, n_stations, install_delay=0.02, pps=1000, floods=50):
+    flow_mods = packet_outs = 0
+    events = []
+    for i in range(n_stations):
+        start = random.random()
+        events += [(start + k / pps, 'ip', i) for k in range(int(install_delay * pps))]
+        events += [(start + k * 0.01, 'flood', i) for k in range(floods)]
+    for now, kind, i in sorted(events):
+        if kind == 'flood':
+            if guard is None or guard.allow_flood(i, now):
+                packet_outs += 1
+        elif guard is None or not guard.duplicate_flow(1, ('10.0.%d.%d' % (i >> 8, i & 0xff), '10.0.0.1'), now):
+            flow_mods += 1
+        else:
+            packet_outs += 1
+    return flow_mods, packet_outs
+
+def bench_packet_in_storm():
+    print('%-8s %-8s %10s %12s %12s' % ('stations', 'guard', 'flow mods', 'packet outs', 'suppressed'))
+    for n_stations in (20, 1000):
+        flow_mods, packet_outs = storm_messages(None, n_stations)
+        print('%-8d %-8s %10d %12d %12d' % (n_stations, 'off', flow_mods, packet_outs, 0))
+        guard = packet_in_guard.PacketInGuard()
+        flow_mods, packet_outs = storm_messages(guard, n_stations)
+        print('%-8d %-8s %10d %12d %12d' % (n_stations, 'on', flow_mods, packet_outs,
+                                           sum(guard.counters.values())))
+    print(guard.report())
+
+def bench_mac_table():
+    n_macs = 100000
+    n_datapaths = 10
+    macs = ['%02x:%02x:%02x:%02x:%02x:%02x' % (0, 0, i >> 24 & 0xff, i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff)
+            for i in range(n_macs)]
+    entries = [(i % n_datapaths + 1, mac, i % 48 + 1) for i, mac in enumerate(macs)]
+
+    def dict_insert():
+        mac_to_port = {}
+        for dpid, mac, port in entries:
+            mac_to_port.setdefault(dpid, {})
+            mac_to_port[dpid][mac] = port
+        return mac_to_port
+
+    mac_to_port = dict_insert()
+
+    def dict_lookup():
+        for dpid, mac, _ in entries:
+            if mac in mac_to_port[dpid]:
+                mac_to_port[dpid][mac]
+
+    size = sys.getsizeof(mac_to_port) + sum(sys.getsizeof(table) + sum(sys.getsizeof(mac) for mac in table)
+                                            for table in mac_to_port.values())
+    print('%-22s %10s %10s %10s %10s' % ('table', 'insert ms', 'lookup ms', 'entries', 'KiB'))
+    print('%-22s %10.1f %10.1f %10d %10.0f' % ('dict of dicts', timeit(dict_insert, 3) * 1000,
+                                               timeit(dict_lookup, 3) * 1000, n_macs, size / 1024))
+
+    for max_entries in (n_macs, mac_table.MAC_TABLE_SIZE):
+        # every run learns into a new table, like dict_insert
+        def insert():
+            table = mac_table.MacLearningTable(max_entries=max_entries)
+            for dpid, mac, port in entries:
+                table.learn(dpid, mac, port, 0.0)
+            return table
+
+        insert_time = timeit(insert, 3)
+        table = insert()
+
+        def lookup():
+            for dpid, mac, _ in entries:
+                table.lookup(dpid, mac, 0.0)
+
+        print('%-22s %10.1f %10.1f %10d %10.0f' % ('MacLearningTable %d' % max_entries, insert_time * 1000,
+                                                   timeit(lookup, 3) * 1000, len(table), table.memory_usage() / 1024))
+    print(table.report())
+
+# the controller's work per report as the network grows: decoding the
+# report, classifying the APs, planning the moves and building the flow
+# deletes of the moves, old field deletes to every datapath against cookie
+# deletes to the datapaths holding flows
+def bench_scale():
+    print('%-6s %-8s %10s %11s %9s %6s %14s %14s' % (
+        'aps', 'stations', 'decode ms', 'classify ms', 'plan ms', 'moves', 'fields del us', 'cookie del us'))
+    for n_aps in (10, 100, 1000, 10000):
+        report = synthetic.make_report(5 * n_aps, n_aps)
+        keyframe = wire_format.Encoder().encode(report)
+        decode = timeit(lambda: wire_format.Decoder().decode(keyframe), 3)
+
+        replayer = replay.ReplayBalancer(True, 13)
+        aps = []
+
+        def classify():
+            replayer.statistics = wire_format.Decoder().decode(keyframe)
+            aps[:] = [replayer.get_overloaded_aps(), replayer.get_underloaded_aps()]
+
+        classify_time = timeit(classify, 3) - decode
+        moves = []
+
+        def plan():
+            moves[:] = replayer.get_possible_handover(*aps, replayer.excluded_stations())
+
+        plan_time = timeit(plan, 3)
+
+        datapaths = [CountingDatapath() for _ in range(n_aps)]
+
+        def delete_fields():
+            for i, _ in enumerate(moves):
+                delete_by_fields(datapaths, '10.0.0.%d' % i, '00:00:00:00:00:%02x' % i)
+
+        def delete_cookies():
+            for i, _ in enumerate(moves):
+                for dp in datapaths[:3]:
+                    flows.delete_station(dp, i)
+
+        print('%-6d %-8d %10.3f %11.3f %9.3f %6d %14.1f %14.1f' % (
+            n_aps, 5 * n_aps, decode * 1000, classify_time * 1000, plan_time * 1000, len(moves),
+            timeit(delete_fields, 3) * 1e6, timeit(delete_cookies, 3) * 1e6))
+
+BENCHMARKS = {
+    'wire_format': bench_wire_format,
+    'planner': bench_planner,
+    'load_model': bench_load_model,
+    'flow_delete': bench_flow_delete,
+    'packet_in': bench_packet_in,
+    'packet_in_storm': bench_packet_in_storm,
+    'mac_table': bench_mac_table,
+    'scale': bench_scale,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print('==', name)
+        BENCHMARKS[name]()
+        print()
@@ -0,0 +1,39 @@
+import socket
+import struct
+
+# Header extraction for the packet-in fast path.
+#
+# The controllers only look at the Ethernet addresses and type and, for
+# IPv4, at the source and destination address. Those sit at fixed offsets
+# in an untagged frame, so they are sliced out of the raw bytes instead of
+# decoding every layer with ryu's packet library. Frames this does not
+# handle (VLAN tags, truncated headers) return None and go to the full
+# parser.
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_8021Q = 0x8100
+ETH_TYPE_8021AD = 0x88a8
+
+ETH_HEADER_LEN = 14
+# ethernet header plus the IPv4 header up to the destination address
+IPV4_MIN_LEN = ETH_HEADER_LEN + 20
+
+ETHERTYPE = struct.Struct('!H')
+
+
+# (dst, src, ethertype, srcip, dstip) with the ips None for non IPv4
+# frames, or None when the frame needs the full parser
+def parse(data):
+    if len(data) < ETH_HEADER_LEN:
+        return None
+    ethertype, = ETHERTYPE.unpack_from(data, 12)
+    if ethertype == ETH_TYPE_8021Q or ethertype == ETH_TYPE_8021AD:
+        return None
+    dst = data[0:6].hex(':')
+    src = data[6:12].hex(':')
+    if ethertype != ETH_TYPE_IP:
+        return dst, src, ethertype, None, None
+    if len(data) < IPV4_MIN_LEN or data[ETH_HEADER_LEN] >> 4 != 4:
+        return None
+    return (dst, src, ethertype,
+            socket.inet_ntoa(data[26:30]), socket.inet_ntoa(data[30:34]))
@@ -0,0 +1,48 @@
+# Per-station flow cookies.
+#
+# The IP flows the controllers install are tagged with a cookie holding the
+# ids of the stations at both ends of the flow, 0 for an end that is not a
+# station. All flows of a station can then be removed from a switch with two
+# cookie-masked deletes, one for the flows it sends and one for the flows it
+# receives, whatever fields they match on, and only the switches the flows
+# were installed on need to get them.
+
+# high byte marks the cookie as a station cookie
+STATION_COOKIE = 0x53 << 56
+STATION_COOKIE_MASK = 0xff << 56
+# set on flows installed ahead of a migration, which a delete of the
+# station's learned flows leaves alone
+PREINSTALLED = 1 << 48
+# the source station id is in the bits above the destination one
+ID_BITS = 24
+ID_MASK = (1 << ID_BITS) - 1
+COOKIE_MASK = 0xffffffffffffffff
+
+
+def flow_cookie(src_id, dst_id, preinstalled=False):
+    cookie = STATION_COOKIE | src_id << ID_BITS | dst_id
+    if preinstalled:
+        cookie |= PREINSTALLED
+    return cookie
+
+# (cookie, mask) of the flows the station sends and of the flows it receives
+def station_matches(station_id, preinstalled=False):
+    cookie = STATION_COOKIE | (PREINSTALLED if preinstalled else 0)
+    mask = STATION_COOKIE_MASK | PREINSTALLED
+    return [(cookie | station_id << ID_BITS, mask | ID_MASK << ID_BITS),
+            (cookie | station_id, mask | ID_MASK)]
+
+def send_delete(datapath, cookie, mask=COOKIE_MASK):
+    ofproto = datapath.ofproto
+    parser = datapath.ofproto_parser
+    mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie, cookie_mask=mask,
+                            table_id=ofproto.OFPTT_ALL, command=ofproto.OFPFC_DELETE,
+                            out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY)
+    datapath.send_msg(mod)
+
+# the deletes for every flow with the station at one end, then a barrier so
+# the switch has dropped them before anything sent after is processed
+def delete_station(datapath, station_id, preinstalled=False):
+    for cookie, mask in station_matches(station_id, preinstalled):
+        send_delete(datapath, cookie, mask)
+    datapath.send_msg(datapath.ofproto_parser.OFPBarrierRequest(datapath))
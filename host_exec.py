@@ -0,0 +1,88 @@
+import os
+import threading
+
+# Runs commands inside Mininet hosts without going through the `m` script.
+#
+# `m` looks the host shell up with `ps ax | grep`, then goes through sudo
+# and mnexec for every single command. Here the PIDs of all host shells are
+# found with one pass over /proc and cached, and commands are started with
+# nsenter, which enters the network and mount namespaces of the host shell
+# and execs the command, so no shell or ps is forked. Entering the
+# namespaces is left to nsenter rather than done in a preexec_fn: the agent
+# starts commands from several threads and preexec_fn is not safe to use in
+# a threaded process. Without root nsenter goes through `sudo -n`.
+
+def read_cmdline(pid):
+    try:
+        with open('/proc/%s/cmdline' % pid, 'rb') as f:
+            return f.read().split(b'\0')
+    except OSError:
+        return []
+
+# the shell Mininet started for the host, as `m` finds it
+def is_host_shell(args, host=None):
+    if not args or b'mnexec' in args[0] or b'bash' not in args[0]:
+        return False
+    names = [arg for arg in args if arg.startswith(b'mininet:')]
+    if not names:
+        return False
+    return host is None or names[-1] == b'mininet:' + host.encode()
+
+
+class Host:
+    def __init__(self, name, pid):
+        self.name = name
+        self.pid = pid
+
+    def alive(self):
+        return is_host_shell(read_cmdline(self.pid), self.name)
+
+
+class HostExecutor:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def scan_pids(self):
+        pids = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            args = read_cmdline(entry)
+            if is_host_shell(args):
+                name = [arg for arg in args if arg.startswith(b'mininet:')][-1]
+                pids.setdefault(name[len(b'mininet:'):].decode(), []).append(int(entry))
+        return pids
+
+    def resolve(self, name):
+        with self.lock:
+            host = self.hosts.get(name)
+            if host is not None and host.alive():
+                return host
+            # the host went away or its PID was reused
+            self.hosts.pop(name, None)
+
+            pids = self.scan_pids().get(name, [])
+            if len(pids) > 1:
+                raise RuntimeError('found multiple mininet:%s processes' % name)
+            if not pids:
+                raise RuntimeError('Could not find Mininet host %s' % name)
+            host = self.hosts[name] = Host(name, pids[0])
+            return host
+
+    def invalidate(self, name):
+        with self.lock:
+            self.hosts.pop(name, None)
+
+    # argv prefix that runs a command inside the host, resolve it once to
+    # run several commands in the same host
+    def prefix(self, name):
+        host = self.resolve(name)
+        prefix = ['nsenter', '-t', str(host.pid), '-n', '-m']
+        if os.geteuid() != 0:
+            prefix = ['sudo', '-n'] + prefix
+        return prefix
+
+    # argv that runs cmd inside the host
+    def prepare(self, name, cmd):
+        return self.prefix(name) + list(cmd)
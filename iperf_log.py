@@ -0,0 +1,341 @@
+import argparse
+import os
+import re
+import struct
+
+import numpy as np
+
+import replay
+
+# Streaming analyzer for the iperf UDP server logs in results/.
+#
+# server_output.txt interleaves the per-second reports of every flow. It is
+# read line by line: the "connected with" lines give every [ id] the IP of
+# the station sending, and the interval lines become rows of fixed-size
+# column chunks, so memory stays flat whatever the size of the log. The 0-end
+# total iperf prints when a flow closes is flagged as final and kept out of
+# the series. Chunks can be written to a columnar file and read back one at
+# a time. The per-flow, per-station and per-AP totals are bincounts over the
+# chunks.
+#
+# Stations are placed on APs with the agent's reports in ap_output.txt, one
+# every replay.REPORT_PERIOD from the start of the run. iperf times are
+# relative to each flow's start, and the clients start with the agent.
+#
+# usage: python iperf_log.py convert results/large/load/server_output.txt load.cols
+#        python iperf_log.py summary results/large/load results/large/no_lb [--detail]
+
+# rows per chunk
+CHUNK_ROWS = 1 << 16
+# iperf -i of the server
+REPORT_INTERVAL = 1.0 # seconds
+
+COLUMNS = np.dtype([
+    ('time', '<f8'),
+    ('duration', '<f4'),
+    ('flow', '<u4'),
+    ('bytes', '<u8'),
+    ('mbps', '<f4'),
+    ('jitter', '<f4'),
+    ('lost', '<u4'),
+    ('total', '<u4'),
+    ('final', 'u1'),
+])
+
+COLUMNS_MAGIC = b'IC'
+COLUMNS_VERSION = 1
+RECORD = struct.Struct('<BI')
+CHUNK = 1
+FLOWS = 2
+
+CONNECTED = re.compile(rb'\[\s*(\d+)\] local \S+ port \d+ connected with (\S+) port (\d+)')
+INTERVAL = re.compile(rb'\[\s*(\d+)\]\s+([\d.]+)-\s*([\d.]+) sec\s+([\d.]+) (\w?)Bytes\s+([\d.]+) (\w?)bits/sec'
+                      rb'\s+([\d.]+) ms\s+(\d+)/\s*(\d+)')
+# iperf transfers are in powers of 1024, bandwidths in powers of 1000
+BYTE_UNITS = {b'': 1, b'K': 1024, b'M': 1024 ** 2, b'G': 1024 ** 3}
+BIT_UNITS = {b'': 1e-6, b'K': 1e-3, b'M': 1.0, b'G': 1e3}
+
+
+class IperfLogParser:
+    def __init__(self, chunk_rows=CHUNK_ROWS, interval=REPORT_INTERVAL):
+        self.chunk_rows = chunk_rows
+        self.interval = interval
+        # (connection id, ip, port) of every flow, in the order they connected
+        self.flows = []
+        # connection id -> its current flow, iperf reuses the ids
+        self.current = {}
+        self.rows = []
+
+    def flow(self, connection, ip='', port=0):
+        index = len(self.flows)
+        self.flows.append((connection, ip, port))
+        self.current[connection] = index
+        return index
+
+    # column chunks of the lines, the last one may be shorter
+    def parse(self, lines):
+        for line in lines:
+            if b'connected with' in line:
+                match = CONNECTED.search(line)
+                if match:
+                    self.flow(int(match.group(1)), match.group(2).decode(), int(match.group(3)))
+                continue
+            # headers and out-of-order notices
+            if b'Bytes' not in line:
+                continue
+            match = INTERVAL.match(line)
+            if match is None:
+                continue
+            connection = int(match.group(1))
+            flow = self.current.get(connection)
+            if flow is None:
+                # the log started after the flow connected
+                flow = self.flow(connection)
+            start = float(match.group(2))
+            duration = float(match.group(3)) - start
+            final = start == 0 and abs(duration - self.interval) > 1e-3
+            self.rows.append((start, duration, flow,
+                              int(float(match.group(4)) * BYTE_UNITS[match.group(5)]),
+                              float(match.group(6)) * BIT_UNITS[match.group(7)],
+                              float(match.group(8)), int(match.group(9)), int(match.group(10)), final))
+            if len(self.rows) >= self.chunk_rows:
+                yield self.flush()
+        if self.rows:
+            yield self.flush()
+
+    def flush(self):
+        chunk = np.array(self.rows, dtype=COLUMNS)
+        self.rows = []
+        return chunk
+
+    def parse_file(self, path):
+        with open(path, 'rb') as f:
+            yield from self.parse(f)
+
+
+def write_columns(path, parser, chunks):
+    rows = 0
+    with open(path, 'wb') as f:
+        f.write(COLUMNS_MAGIC + bytes([COLUMNS_VERSION]))
+        for chunk in chunks:
+            # column after column, each contiguous
+            payload = struct.pack('<I', len(chunk)) + b''.join(chunk[name].tobytes() for name in COLUMNS.names)
+            f.write(RECORD.pack(CHUNK, len(payload)))
+            f.write(payload)
+            rows += len(chunk)
+        flows = '\n'.join('%d %s %d' % flow for flow in parser.flows).encode()
+        f.write(RECORD.pack(FLOWS, len(flows)))
+        f.write(flows)
+    return rows
+
+def read_records(f):
+    header = f.read(3)
+    if header[:2] != COLUMNS_MAGIC or header[2] != COLUMNS_VERSION:
+        raise ValueError('not a version %d columns file' % COLUMNS_VERSION)
+    while 1:
+        record = f.read(RECORD.size)
+        if len(record) < RECORD.size:
+            return
+        kind, length = RECORD.unpack(record)
+        yield kind, f.read(length)
+
+def unpack_chunk(payload):
+    rows, = struct.unpack_from('<I', payload)
+    chunk = np.empty(rows, dtype=COLUMNS)
+    offset = 4
+    for name in COLUMNS.names:
+        size = rows * COLUMNS[name].itemsize
+        chunk[name] = np.frombuffer(payload, dtype=COLUMNS[name], count=rows, offset=offset)
+        offset += size
+    return chunk
+
+# flows and a generator of the chunks of a columns file, the flows are read first
+def read_columns(path):
+    flows = []
+    with open(path, 'rb') as f:
+        for kind, payload in read_records(f):
+            if kind == FLOWS:
+                for line in payload.decode().splitlines():
+                    connection, ip, port = line.split(' ')
+                    flows.append((int(connection), ip, int(port)))
+
+    def chunks():
+        with open(path, 'rb') as f:
+            for kind, payload in read_records(f):
+                if kind == CHUNK:
+                    yield unpack_chunk(payload)
+    return flows, chunks()
+
+# every row of a log or columns file at once, for logs that fit in memory
+def load_columns(path):
+    if path.endswith('.txt'):
+        parser = IperfLogParser()
+        chunks = list(parser.parse_file(path))
+        flows = parser.flows
+    else:
+        flows, chunks = read_columns(path)
+        chunks = list(chunks)
+    return flows, np.concatenate(chunks) if chunks else np.empty(0, dtype=COLUMNS)
+
+
+# stations are sta1 = 10.0.0.2, sta2 = 10.0.0.3 ... in the topologies
+def station_ips(path=None):
+    ips = {}
+    if path is not None:
+        with open(path) as f:
+            for line in f:
+                name, mac, ip = line.split(' ')
+                ips[name] = ip.strip().split('/')[0]
+        return ips
+    return {'sta%d' % n: '10.0.0.%d' % (n + 1) for n in range(1, 255)}
+
+# AP of every station ip in every agent report of a run
+class Association:
+    def __init__(self, run_dir, ips_by_station):
+        cycles = replay.parse_logs(run_dir, agent=True)
+        self.ssids = sorted({stat['ssid'] for report, _ in cycles for stat in report})
+        ap_index = {ssid: i for i, ssid in enumerate(self.ssids)}
+        self.ips = sorted(set(ips_by_station.values()))
+        column = {ip: i for i, ip in enumerate(self.ips)}
+        self.times = np.arange(len(cycles)) * float(replay.REPORT_PERIOD)
+        self.matrix = np.full((max(len(cycles), 1), len(self.ips) + 1), -1, dtype=np.int32)
+        for cycle, (report, _) in enumerate(cycles):
+            for stat in report:
+                for station in stat['stations_associated']:
+                    ip = ips_by_station.get(station)
+                    if ip is not None:
+                        self.matrix[cycle, column[ip]] = ap_index[stat['ssid']]
+        self.column = column
+
+    # AP of every row, -1 if unknown
+    def aps(self, ip_columns, times):
+        cycle = np.clip(np.searchsorted(self.times, times, side='right') - 1, 0, len(self.matrix) - 1)
+        return self.matrix[cycle, ip_columns]
+
+
+def grow(array, n):
+    if len(array) >= n:
+        return array
+    grown = np.zeros(n, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+# running totals of the series rows, per flow and per AP
+class Totals:
+    def __init__(self, association=None):
+        self.association = association
+        self.flow_bytes = np.zeros(0)
+        self.flow_lost = np.zeros(0)
+        self.flow_total = np.zeros(0)
+        self.flow_seconds = np.zeros(0)
+        # jitter weighted by the datagrams of the interval
+        self.flow_jitter = np.zeros(0)
+        n_aps = len(association.ssids) + 1 if association else 1
+        self.ap_bytes = np.zeros(n_aps)
+        self.ap_lost = np.zeros(n_aps)
+        self.ap_total = np.zeros(n_aps)
+        self.rows = 0
+        self.end = 0.0
+
+    def add(self, chunk, flows):
+        chunk = chunk[chunk['final'] == 0]
+        if not len(chunk):
+            return
+        n = len(flows)
+        flow = chunk['flow']
+        total = chunk['total'].astype(np.float64)
+        for name, weights in (('flow_bytes', chunk['bytes']), ('flow_lost', chunk['lost']),
+                              ('flow_total', total), ('flow_seconds', chunk['duration']),
+                              ('flow_jitter', chunk['jitter'] * total)):
+            setattr(self, name, grow(getattr(self, name), n) + np.bincount(flow, weights=weights, minlength=n))
+        self.rows += len(chunk)
+        self.end = max(self.end, float((chunk['time'] + chunk['duration']).max()))
+
+        if self.association is not None:
+            unknown = len(self.association.ips)
+            columns = np.array([self.association.column.get(ip, unknown) for _, ip, _ in flows], dtype=np.int64)
+            ap = self.association.aps(columns[flow], chunk['time'])
+            # unknown APs go in the last slot
+            ap = np.where(ap < 0, len(self.ap_bytes) - 1, ap)
+            m = len(self.ap_bytes)
+            self.ap_bytes += np.bincount(ap, weights=chunk['bytes'], minlength=m)
+            self.ap_lost += np.bincount(ap, weights=chunk['lost'], minlength=m)
+            self.ap_total += np.bincount(ap, weights=total, minlength=m)
+
+
+def ratio(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(b > 0, a / b, 0.0)
+
+def summarize_run(run_dir, mappings=None, detail=False):
+    ips_by_station = station_ips(mappings)
+    association = Association(run_dir, ips_by_station)
+    parser = IperfLogParser()
+    totals = Totals(association)
+    for chunk in parser.parse_file(os.path.join(run_dir, 'server_output.txt')):
+        totals.add(chunk, parser.flows)
+
+    n = len(parser.flows)
+    flow_bytes = grow(totals.flow_bytes, n)
+    flow_lost = grow(totals.flow_lost, n)
+    flow_total = grow(totals.flow_total, n)
+    # flows of the same station, iperf reconnects under new ids
+    ips, station = np.unique([ip for _, ip, _ in parser.flows] or [''], return_inverse=True)
+    station = station[:n]
+    station_bytes = np.bincount(station, weights=flow_bytes, minlength=len(ips))
+    station_lost = np.bincount(station, weights=flow_lost, minlength=len(ips))
+    station_total = np.bincount(station, weights=flow_total, minlength=len(ips))
+    station_loss = ratio(station_lost, station_total)
+    sending = station_total > 0
+
+    seconds = totals.end or 1.0
+    goodput = flow_bytes.sum() * 8 / seconds / 1e6
+    loss = ratio(flow_lost.sum(), flow_total.sum())
+    summary = (run_dir, n, sending.sum(), totals.rows, goodput, 100 * loss,
+               100 * station_loss[sending].max() if sending.any() else 0.0)
+    if not detail:
+        return summary
+
+    names = {ip: name for name, ip in ips_by_station.items()}
+    print(run_dir)
+    print('  %-10s %-8s %10s %8s %10s' % ('ip', 'station', 'Mbps', 'loss %', 'jitter ms'))
+    jitter = ratio(np.bincount(station, weights=grow(totals.flow_jitter, n), minlength=len(ips)), station_total)
+    for i in np.flatnonzero(sending):
+        print('  %-10s %-8s %10.3f %8.2f %10.3f' % (
+            ips[i], names.get(ips[i], '-'), station_bytes[i] * 8 / seconds / 1e6,
+            100 * station_loss[i], jitter[i]))
+    print('  %-10s %10s %8s' % ('ap', 'Mbps', 'loss %'))
+    ap_loss = ratio(totals.ap_lost, totals.ap_total)
+    for i, ssid in enumerate(association.ssids + ['unknown']):
+        if totals.ap_total[i]:
+            print('  %-10s %10.3f %8.2f' % (ssid, totals.ap_bytes[i] * 8 / seconds / 1e6, 100 * ap_loss[i]))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='iperf UDP server logs to columns and per flow and AP totals')
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help='write the rows of a log to a columns file')
+    convert.add_argument('log')
+    convert.add_argument('columns')
+    convert.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    summary = commands.add_parser('summary', help='compare the goodput and loss of results/ runs')
+    summary.add_argument('run_dirs', nargs='+')
+    summary.add_argument('--mappings', help='mappings.txt of the topology, by default sta1 is 10.0.0.2')
+    summary.add_argument('--detail', action='store_true', help='per station and per AP tables')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        log_parser = IperfLogParser(args.chunk_rows)
+        rows = write_columns(args.columns, log_parser, log_parser.parse_file(args.log))
+        print('wrote %s, %d rows of %d flows, %d bytes' % (
+            args.columns, rows, len(log_parser.flows), os.path.getsize(args.columns)))
+        return
+
+    summaries = [summarize_run(run_dir, args.mappings, args.detail) for run_dir in args.run_dirs]
+    print('%-28s %6s %9s %7s %10s %8s %12s' % ('run', 'flows', 'stations', 'rows', 'Mbps', 'loss %', 'worst loss %'))
+    for row in summaries:
+        print('%-28s %6d %9d %7d %10.3f %8.2f %12.2f' % row)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import copy
+
+import numpy as np
+
+# Array view of one statistics report.
+#
+# The report is walked once: stations get an index, their rates and the AP
+# they are associated to go into vectors, and the RSSI every station hears
+# from every AP goes into a sparse AP x station matrix kept in coordinate
+# form (rssi_ap, rssi_station, rssi). Per-AP totals, overload
+# classification and handover candidate filtering are array operations on
+# top of that.
+
+
+class LoadModel:
+    # by_rate selects the load of a station: its (rx_rate, tx_rate) or a
+    # count of one. capacity(stat) returns the matching per-AP limits.
+    def __init__(self, statistics, by_rate, capacity):
+        self.statistics = statistics
+        self.ssids = [stat['ssid'] for stat in statistics]
+        self.ap_index = {ssid: i for i, ssid in enumerate(self.ssids)}
+
+        self.stations = []
+        station_ap = []
+        rx_rate = []
+        tx_rate = []
+        rssi_ap = []
+        rssi_station = []
+        rssi = []
+        for ap_index, stat in enumerate(statistics):
+            for name, station in stat['stations_associated'].items():
+                station_index = len(self.stations)
+                self.stations.append(name)
+                station_ap.append(ap_index)
+                rx_rate.append(station.get('rx_rate', np.nan))
+                tx_rate.append(station.get('tx_rate', np.nan))
+                for ssid, signal in station.get('aps', {}).items():
+                    index = self.ap_index.get(ssid)
+                    if index is None:
+                        continue
+                    rssi_ap.append(index)
+                    rssi_station.append(station_index)
+                    rssi.append(float(signal))
+
+        n_aps = len(statistics)
+        self.station_index = {name: i for i, name in enumerate(self.stations)}
+        self.station_ap = np.array(station_ap, dtype=np.int32)
+        self.rx_rate = np.array(rx_rate, dtype=np.float64)
+        self.tx_rate = np.array(tx_rate, dtype=np.float64)
+        # the agent leaves the rates out until it has two samples of a
+        # station, they count as 0 here and are not averaged in
+        measured = ~(np.isnan(self.rx_rate) | np.isnan(self.tx_rate))
+        self.rx_rate = np.nan_to_num(self.rx_rate)
+        self.tx_rate = np.nan_to_num(self.tx_rate)
+        self.rssi_ap = np.array(rssi_ap, dtype=np.int32)
+        self.rssi_station = np.array(rssi_station, dtype=np.int32)
+        self.rssi = np.array(rssi, dtype=np.float32)
+
+        self.station_count = np.bincount(self.station_ap, minlength=n_aps)
+        self.total_rx_rate = np.bincount(self.station_ap, weights=self.rx_rate, minlength=n_aps)
+        self.total_tx_rate = np.bincount(self.station_ap, weights=self.tx_rate, minlength=n_aps)
+
+        if by_rate:
+            self.weight = np.column_stack((self.rx_rate, self.tx_rate))
+            self.load = np.column_stack((self.total_rx_rate, self.total_tx_rate))
+            self.measured = measured
+        else:
+            self.weight = np.ones((len(self.stations), 1))
+            self.measured = np.ones(len(self.stations), dtype=bool)
+            self.load = self.station_count.astype(np.float64).reshape(-1, 1)
+        self.capacity = np.array([capacity(stat) for stat in statistics],
+                                 dtype=np.float64).reshape(self.load.shape)
+
+    def overloaded(self):
+        return (self.load > self.capacity).any(axis=1)
+
+    # watermark is the fraction of the capacity the load must stay under
+    def underloaded(self, watermark=1.0):
+        return (self.load < watermark * self.capacity).all(axis=1)
+
+    # same report with other per station weights and per AP loads
+    def with_load(self, weight, load):
+        model = copy.copy(self)
+        model.weight = weight.reshape(self.weight.shape)
+        model.load = load.reshape(self.load.shape)
+        return model
+
+    def mask(self, aps):
+        selected = np.zeros(len(self.ssids), dtype=bool)
+        selected[[self.ap_index[ap['ssid']] for ap in aps]] = True
+        return selected
+
+    # every (station, target AP) pair that could be a handover: the station
+    # is on one of the sources, hears one of the targets above the signal
+    # threshold and fits in it. Returns station, target and score arrays.
+    def candidates(self, sources, targets, signal_threshold, excluded=(), headroom_weight=0.0):
+        source = self.station_ap[self.rssi_station]
+        keep = (sources[source] & targets[self.rssi_ap]
+                & (self.rssi_ap != source) & (self.rssi > signal_threshold))
+        if excluded:
+            skip = np.zeros(len(self.stations), dtype=bool)
+            skip[[self.station_index[name] for name in excluded if name in self.station_index]] = True
+            keep &= ~skip[self.rssi_station]
+
+        station = self.rssi_station[keep]
+        target = self.rssi_ap[keep]
+        capacity = self.capacity[target]
+        left = capacity - self.load[target] - self.weight[station]
+        fits = (left >= 0).all(axis=1)
+        station, target = station[fits], target[fits]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            free = np.where(capacity[fits] > 0, left[fits] / capacity[fits], 0.0).min(axis=1)
+        score = (self.rssi[keep][fits] - signal_threshold) + headroom_weight * free
+        return station, target, score
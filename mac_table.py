@@ -0,0 +1,111 @@
+import itertools
+import sys
+
+# MAC learning for the controllers.
+#
+# One plain dict per datapath maps a MAC to its port and the second it was
+# last seen, packed in a single int. Dicts keep insertion order, and
+# learning a MAC removes and re-inserts it, so each table is ordered by last
+# activity. Entries learned in the same second on the same port share one
+# packed int, so an entry costs about as much as in a dict of ports. Once
+# per second the idle entries are dropped from the front of every table.
+# A full table drops its least recently seen MACs, a batch at a time. A
+# migrating station's entries are removed from every datapath, so the old
+# port is not used while it moves.
+
+# entries per datapath
+MAC_TABLE_SIZE = 4096
+# forget a MAC not seen as a source for this long, like a switch would
+MAC_IDLE_TIMEOUT = 300 # seconds
+# fraction of a full table evicted at once, removing from the front of a
+# dict one key at a time rescans the deleted slots every time
+EVICT_FRACTION = 1 / 16
+
+
+class MacLearningTable:
+    def __init__(self, max_entries=MAC_TABLE_SIZE, idle_timeout=MAC_IDLE_TIMEOUT):
+        self.max_entries = max_entries
+        self.idle_timeout = idle_timeout
+        self.evict_batch = max(1, int(max_entries * EVICT_FRACTION))
+        self.tables = {}
+        # packed entries of the current second, shared by the MACs learned on
+        # the same port
+        self.second = None
+        self.shared = {}
+        self.evicted = 0
+        self.expired = 0
+
+    def learn(self, dpid, mac, port, now):
+        second = int(now)
+        if second != self.second:
+            self.second = second
+            self.shared = {}
+            self.expire(now)
+
+        table = self.tables.get(dpid)
+        if table is None:
+            table = self.tables[dpid] = {}
+        entry = second << 32 | port
+        old = table.get(mac)
+        if old == entry:
+            # seen already this second, the order within a second does not matter
+            return
+        if old is not None:
+            # re-inserted at the end
+            del table[mac]
+        table[mac] = self.shared.setdefault(entry, entry)
+
+        if len(table) > self.max_entries:
+            n = len(table) - self.max_entries + self.evict_batch - 1
+            for mac in list(itertools.islice(table, n)):
+                del table[mac]
+            self.evicted += n
+
+    # drops the entries idle for too long, they are at the front
+    def expire(self, now):
+        oldest = int(now - self.idle_timeout) << 32
+        for table in self.tables.values():
+            idle = []
+            for mac, entry in table.items():
+                if entry >= oldest:
+                    break
+                idle.append(mac)
+            for mac in idle:
+                del table[mac]
+            self.expired += len(idle)
+
+    # port the MAC was learned on, None if unknown or idle too long
+    def lookup(self, dpid, mac, now):
+        table = self.tables.get(dpid)
+        if table is None:
+            return None
+        entry = table.get(mac)
+        if entry is None:
+            return None
+        if now - (entry >> 32) > self.idle_timeout:
+            del table[mac]
+            self.expired += 1
+            return None
+        return entry & 0xffffffff
+
+    def invalidate(self, mac):
+        for table in self.tables.values():
+            table.pop(mac, None)
+
+    def __len__(self):
+        return sum(len(table) for table in self.tables.values())
+
+    # approximate bytes held, keys shared with the packets are counted too
+    def memory_usage(self):
+        size = sys.getsizeof(self.tables)
+        entries = {}
+        for table in self.tables.values():
+            size += sys.getsizeof(table)
+            for mac, entry in table.items():
+                size += sys.getsizeof(mac)
+                entries[id(entry)] = entry
+        return size + sum(sys.getsizeof(entry) for entry in entries.values())
+
+    def report(self):
+        return 'mac table: %d entries on %d datapaths, %.1f KiB, %d evicted, %d expired' % (
+            len(self), len(self.tables), self.memory_usage() / 1024, self.evicted, self.expired)
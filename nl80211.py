@@ -0,0 +1,165 @@
+import os
+import socket
+import struct
+
+# Minimal nl80211 client over a generic netlink socket. It only implements
+# the two queries the agent needs (interface info and station dump) so the
+# AP metrics can be collected without forking `iw` for every AP.
+
+NETLINK_GENERIC = 16
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_DUMP = 0x300
+
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+NL80211_CMD_GET_INTERFACE = 5
+NL80211_CMD_GET_STATION = 17
+
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_MAC = 6
+NL80211_ATTR_STA_INFO = 21
+NL80211_ATTR_SSID = 52
+
+NL80211_STA_INFO_RX_BYTES = 2
+NL80211_STA_INFO_TX_BYTES = 3
+NL80211_STA_INFO_SIGNAL = 7
+NL80211_STA_INFO_RX_BYTES64 = 23
+NL80211_STA_INFO_TX_BYTES64 = 24
+
+NLA_F_NESTED = 0x8000
+NLA_F_NET_BYTEORDER = 0x4000
+NLA_TYPE_MASK = ~(NLA_F_NESTED | NLA_F_NET_BYTEORDER)
+
+NLMSGHDR = struct.Struct('=IHHII')
+GENLMSGHDR = struct.Struct('=BBH')
+NLATTR = struct.Struct('=HH')
+
+
+def align(length):
+    return (length + 3) & ~3
+
+def pack_attr(attr_type, payload):
+    attr = NLATTR.pack(NLATTR.size + len(payload), attr_type) + payload
+    return attr + b'\0' * (align(len(attr)) - len(attr))
+
+def parse_attrs(data, offset=0):
+    attrs = {}
+    while offset + NLATTR.size <= len(data):
+        length, attr_type = NLATTR.unpack_from(data, offset)
+        if length < NLATTR.size:
+            break
+        attrs[attr_type & NLA_TYPE_MASK] = data[offset + NLATTR.size:offset + length]
+        offset += align(length)
+    return attrs
+
+def format_mac(raw):
+    return ':'.join('%02x' % b for b in raw)
+
+def get_counter(info, attr64, attr32):
+    # prefer the 64-bit counters, older kernels only report the 32-bit ones
+    if attr64 in info:
+        return struct.unpack('=Q', info[attr64][:8])[0]
+    if attr32 in info:
+        return struct.unpack('=I', info[attr32][:4])[0]
+    return 0
+
+
+class Nl80211:
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+        self.sock.bind((0, 0))
+        self.seq = 0
+        self.family_id = self.resolve_family('nl80211')
+
+    def close(self):
+        self.sock.close()
+
+    def request(self, msg_type, flags, cmd, attrs):
+        self.seq += 1
+        payload = GENLMSGHDR.pack(cmd, 1, 0) + b''.join(pack_attr(t, v) for t, v in attrs)
+        header = NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type,
+                               NLM_F_REQUEST | flags, self.seq, 0)
+        self.sock.send(header + payload)
+        return self.receive(self.seq)
+
+    # collect every genetlink payload answering the given sequence number
+    def receive(self, seq):
+        messages = []
+        while True:
+            data = self.sock.recv(65536)
+            offset = 0
+            while offset + NLMSGHDR.size <= len(data):
+                length, msg_type, flags, msg_seq, _ = NLMSGHDR.unpack_from(data, offset)
+                if length < NLMSGHDR.size:
+                    raise OSError('malformed netlink message')
+                body = data[offset + NLMSGHDR.size:offset + length]
+                offset += align(length)
+                if msg_seq != seq:
+                    continue
+                if msg_type == NLMSG_DONE:
+                    return messages
+                if msg_type == NLMSG_ERROR:
+                    error = struct.unpack_from('=i', body)[0]
+                    if error:
+                        raise OSError(-error, os.strerror(-error))
+                    return messages
+                messages.append(body[GENLMSGHDR.size:])
+                if not flags & NLM_F_MULTI:
+                    return messages
+
+    def resolve_family(self, name):
+        replies = self.request(GENL_ID_CTRL, 0, CTRL_CMD_GETFAMILY,
+                               [(CTRL_ATTR_FAMILY_NAME, name.encode() + b'\0')])
+        for reply in replies:
+            attrs = parse_attrs(reply)
+            if CTRL_ATTR_FAMILY_ID in attrs:
+                return struct.unpack('=H', attrs[CTRL_ATTR_FAMILY_ID][:2])[0]
+        raise OSError('generic netlink family %s not found' % name)
+
+    def get_ssid(self, ifname):
+        ifindex = struct.pack('=I', socket.if_nametoindex(ifname))
+        replies = self.request(self.family_id, 0, NL80211_CMD_GET_INTERFACE,
+                               [(NL80211_ATTR_IFINDEX, ifindex)])
+        return parse_ssid(replies)
+
+    def get_stations(self, ifname):
+        ifindex = struct.pack('=I', socket.if_nametoindex(ifname))
+        replies = self.request(self.family_id, NLM_F_DUMP, NL80211_CMD_GET_STATION,
+                               [(NL80211_ATTR_IFINDEX, ifindex)])
+        return parse_stations(replies)
+
+
+# the ssid in the genetlink payloads answering NL80211_CMD_GET_INTERFACE
+def parse_ssid(replies):
+    for reply in replies:
+        attrs = parse_attrs(reply)
+        if NL80211_ATTR_SSID in attrs:
+            return attrs[NL80211_ATTR_SSID].decode('UTF-8', 'ignore')
+    return None
+
+# same shape as ap_agent.get_stations: {mac: {"rx_bytes", "tx_bytes", "signal"}}
+def parse_stations(replies):
+    stations = {}
+    for reply in replies:
+        attrs = parse_attrs(reply)
+        if NL80211_ATTR_MAC not in attrs:
+            continue
+        info = parse_attrs(attrs.get(NL80211_ATTR_STA_INFO, b''))
+        station = stations[format_mac(attrs[NL80211_ATTR_MAC])] = {
+            "rx_bytes": get_counter(info, NL80211_STA_INFO_RX_BYTES64, NL80211_STA_INFO_RX_BYTES),
+            "tx_bytes": get_counter(info, NL80211_STA_INFO_TX_BYTES64, NL80211_STA_INFO_TX_BYTES),
+            # whether the counters can wrap during an experiment
+            "counter_bits": 64 if NL80211_STA_INFO_RX_BYTES64 in info else 32,
+        }
+        if NL80211_STA_INFO_SIGNAL in info:
+            # dBm as a signed byte
+            station["signal"] = struct.unpack('=b', info[NL80211_STA_INFO_SIGNAL][:1])[0]
+    return stations
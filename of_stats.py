@@ -0,0 +1,101 @@
+# Load from OpenFlow counters.
+#
+# The controllers can poll every datapath for its flow and port statistics
+# instead of waiting for the agent's iw samples. The (src ip, dst ip) flows
+# the packet-in handler installs give the traffic of each station on the AP
+# it is associated to, the wlan port counters the traffic of the whole AP.
+# Rates are the byte difference between two polls, in Mbps like the agent's:
+# rx is what the AP received from the station, tx what it sent to it.
+
+
+def mbps(byte_count, seconds):
+    if seconds <= 0:
+        return 0.0
+    return byte_count * 8 / seconds / 1e6
+
+
+class RateTracker:
+    def __init__(self):
+        # (dpid, cookie, src, dst) -> (bytes, duration, polled at)
+        self.flows = {}
+        # dpid -> {ip: [rx, tx]}
+        self.ip_rates = {}
+        # (dpid, port) -> (rx bytes, tx bytes, polled at)
+        self.ports = {}
+        # dpid -> {port: (rx, tx)}
+        self.port_rates = {}
+
+    # flows is every (cookie, src ip, dst ip, bytes, duration) flow of the datapath
+    def update_flows(self, dpid, flows, now):
+        ip_rates = {}
+        seen = set()
+        for cookie, src, dst, byte_count, duration in flows:
+            key = (dpid, cookie, src, dst)
+            seen.add(key)
+            prev = self.flows.get(key)
+            self.flows[key] = (byte_count, duration, now)
+            if prev is not None and duration >= prev[1] and byte_count >= prev[0]:
+                rate = mbps(byte_count - prev[0], now - prev[2])
+            else:
+                # new or reinstalled flow, its counters start with it
+                rate = mbps(byte_count, duration)
+            ip_rates.setdefault(src, [0.0, 0.0])[0] += rate
+            ip_rates.setdefault(dst, [0.0, 0.0])[1] += rate
+
+        for key in [key for key in self.flows if key[0] == dpid and key not in seen]:
+            del self.flows[key]
+        self.ip_rates[dpid] = ip_rates
+
+    # ports is every (port, rx bytes, tx bytes) of the datapath
+    def update_ports(self, dpid, ports, now):
+        port_rates = {}
+        for port, rx_bytes, tx_bytes in ports:
+            prev = self.ports.get((dpid, port))
+            self.ports[(dpid, port)] = (rx_bytes, tx_bytes, now)
+            if prev is None or rx_bytes < prev[0] or tx_bytes < prev[1]:
+                continue
+            port_rates[port] = (mbps(rx_bytes - prev[0], now - prev[2]),
+                                mbps(tx_bytes - prev[1], now - prev[2]))
+        self.port_rates[dpid] = port_rates
+
+    # (rx, tx) of the station on its AP, None until the AP was polled
+    def station_rates(self, dpid, ip):
+        ip_rates = self.ip_rates.get(dpid)
+        if ip_rates is None:
+            return None
+        rx, tx = ip_rates.get(ip, (0.0, 0.0))
+        return rx, tx
+
+    def port_rate(self, dpid, port):
+        return self.port_rates.get(dpid, {}).get(port)
+
+
+# copy of the report with the station rates taken from the flow counters,
+# stations of APs not polled yet keep the agent's
+def with_openflow_rates(statistics, tracker, station_ips):
+    report = []
+    for stat in statistics:
+        stat = dict(stat)
+        stations = {}
+        for name, station in stat['stations_associated'].items():
+            rates = tracker.station_rates(stat['dpid'], station_ips.get(name))
+            if rates is not None:
+                station = dict(station, rx_rate=rates[0], tx_rate=rates[1])
+            stations[name] = station
+        stat['stations_associated'] = stations
+        report.append(stat)
+    return report
+
+# (station, agent rates, openflow rates) for the stations where the two
+# sources differ by more than tolerance Mbps
+def compare_rates(statistics, tracker, station_ips, tolerance):
+    mismatches = []
+    for stat in statistics:
+        for name, station in stat['stations_associated'].items():
+            rates = tracker.station_rates(stat['dpid'], station_ips.get(name))
+            if rates is None:
+                continue
+            agent = (station.get('rx_rate', 0.0), station.get('tx_rate', 0.0))
+            if abs(agent[0] - rates[0]) > tolerance or abs(agent[1] - rates[1]) > tolerance:
+                mismatches.append((name, agent, rates))
+    return mismatches
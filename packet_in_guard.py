@@ -0,0 +1,82 @@
+import collections
+
+# Packet-in storm suppression for the controllers.
+#
+# Until a FlowMod is in the switch, every packet of the flow comes back as a
+# packet-in, and each one used to install the same flow again. The guard
+# remembers, per datapath, the matches installed in the last RECENT_FLOW_TTL
+# seconds so the duplicates only get a packet-out. Floods for unknown
+# destinations go through a token bucket per source MAC. What was held back
+# is counted.
+
+# longer than a FlowMod takes to apply, much shorter than the idle timeout
+RECENT_FLOW_TTL = 1.0 # seconds
+# flood packet-outs per second a single source gets, and its burst
+FLOOD_RATE = 10
+FLOOD_BURST = 20
+
+
+class PacketInGuard:
+    def __init__(self, ttl=RECENT_FLOW_TTL, rate=FLOOD_RATE, burst=FLOOD_BURST):
+        self.ttl = ttl
+        self.rate = rate
+        self.burst = burst
+        # dpid -> {match key: expiry}
+        self.recent = {}
+        self.recent_size = 0
+        self.next_prune = 1024
+        # source mac -> [tokens, last refill]
+        self.buckets = {}
+        self.counters = collections.Counter()
+
+    # True if the flow was installed on the datapath moments ago, otherwise
+    # it is recorded as installed now
+    def duplicate_flow(self, dpid, key, now):
+        table = self.recent.setdefault(dpid, {})
+        expiry = table.get(key)
+        if expiry is not None and expiry > now:
+            self.counters['duplicate_flow'] += 1
+            return True
+        if expiry is None:
+            self.recent_size += 1
+        table[key] = now + self.ttl
+        if self.recent_size + len(self.buckets) > self.next_prune:
+            self.prune(now)
+        return False
+
+    # the flows with the ip were deleted, the next packet-in must install them
+    def forget(self, ip):
+        for table in self.recent.values():
+            for key in [key for key in table if ip in key]:
+                del table[key]
+                self.recent_size -= 1
+
+    def allow_flood(self, src, now):
+        bucket = self.buckets.get(src)
+        if bucket is None:
+            bucket = self.buckets[src] = [self.burst, now]
+            if self.recent_size + len(self.buckets) > self.next_prune:
+                self.prune(now)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            self.counters['flood'] += 1
+            return False
+        bucket[0] -= 1
+        return True
+
+    def prune(self, now):
+        for table in self.recent.values():
+            for key in [key for key, expiry in table.items() if expiry <= now]:
+                del table[key]
+                self.recent_size -= 1
+        # a bucket left alone this long is full again
+        idle = self.burst / self.rate
+        for src in [src for src, bucket in self.buckets.items() if now - bucket[1] > idle]:
+            del self.buckets[src]
+        self.next_prune = max(1024, 2 * (self.recent_size + len(self.buckets)))
+
+    def report(self):
+        return 'suppressed packet-ins: %d duplicate flows, %d floods' % (
+            self.counters['duplicate_flow'], self.counters['flood'])
@@ -0,0 +1,42 @@
+import numpy as np
+
+# Handover planning shared by both controllers.
+#
+# Every station on an overloaded AP that hears an underloaded AP above the
+# signal threshold and fits in it is a candidate move; the candidates come
+# out of the LoadModel arrays in one pass. They are then taken greedily, best
+# score first, as long as the source AP is still overloaded, the target still
+# has room for the station and the per-cycle migration budget is not spent.
+
+# weight of the target headroom (0..1) against the RSSI margin (dB)
+HEADROOM_WEIGHT = 10
+
+
+# returns a list of (station, new ssid) pairs
+def plan_handovers(model, oaps, uaps, signal_threshold, budget, excluded=()):
+    if budget <= 0 or not oaps or not uaps:
+        return []
+
+    station, target, score = model.candidates(model.mask(oaps), model.mask(uaps),
+                                              signal_threshold, excluded, HEADROOM_WEIGHT)
+    load = model.load.copy()
+    moves = []
+    moved = set()
+    for i in np.argsort(-score, kind='stable'):
+        if len(moves) >= budget:
+            break
+        s = station[i]
+        t = target[i]
+        source = model.station_ap[s]
+        weight = model.weight[s]
+        # loads changed since the candidate was scored, check it again
+        if s in moved or not (load[source] > model.capacity[source]).any():
+            continue
+        if not (load[t] + weight <= model.capacity[t]).all():
+            continue
+        load[source] -= weight
+        load[t] += weight
+        moved.add(s)
+        moves.append((model.stations[s], model.ssids[t]))
+
+    return moves
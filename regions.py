@@ -0,0 +1,229 @@
+import os
+
+import numpy as np
+
+import smoothing
+import tracing
+import transport
+
+# Region sharding.
+#
+# With REGIONS set, the agent splits its report by region and publishes every
+# part on statistics.<region>. Each controller balances only the regions it
+# owns, with the datapaths of their APs, so a decision cycle is as large as
+# its regions and not the whole network. Without REGIONS there is a single
+# region, None, on the plain 'statistics' channel.
+#
+# A station on the edge of a region can still move to an AP of a neighbour
+# region, with a handshake between the two controllers:
+#   - after every report each controller publishes a summary of its
+#     underloaded APs and the room they have left on 'regions'
+#   - a controller whose own APs could not take a station sends a request to
+#     the owner of a foreign AP the station hears, on handover.<region>
+#   - the owner accepts if the AP still has room, counting the stations it
+#     already accepted, keeps that room reserved until the station shows up
+#     in its reports and replies on handover.<requesting region>
+#   - on an accept the requester migrates the station as usual
+# A request without a reply is given up after HANDSHAKE_TIMEOUT. An accept
+# that arrives after that is answered with a release, so the owner does not
+# hold the room for nothing until RESERVATION_TTL.
+
+# region -> dpids of its APs
+REGIONS = {}
+# REGIONS = {'west': [1, 2], 'east': [3, 4]}
+
+# regions this controller balances, comma separated. Several controllers run
+# from the same file, so it comes from the environment; all by default.
+CONTROLLER_REGIONS = os.environ.get('CONTROLLER_REGIONS', '')
+
+SUMMARY_CHANNEL = 'regions'
+# summaries older than this are not used
+SUMMARY_TTL = 30 # seconds
+HANDSHAKE_TIMEOUT = 2 # seconds
+# how long an accepted station holds its room on the target AP
+RESERVATION_TTL = 30 # seconds
+
+
+def region_of(dpid):
+    for region, dpids in REGIONS.items():
+        if dpid in dpids:
+            return region
+    return None
+
+def statistics_channel(region):
+    if region is None:
+        return 'statistics'
+    return 'statistics.' + region
+
+def handover_channel(region):
+    return 'handover.%s' % region
+
+def owned_regions():
+    if CONTROLLER_REGIONS:
+        return [region.strip() for region in CONTROLLER_REGIONS.split(',') if region.strip()]
+    return list(REGIONS) or [None]
+
+# {region: the APs of the report in it}, every region gets a part even when
+# none of its APs were sampled. APs outside REGIONS go to None.
+def split_report(report):
+    if not REGIONS:
+        return {None: report}
+    parts = {region: [] for region in REGIONS}
+    for stat in report:
+        parts.setdefault(region_of(stat['dpid']), []).append(stat)
+    return parts
+
+
+class HandoverBroker:
+    def __init__(self, regions, publish):
+        # the regions of this controller
+        self.regions = set(regions)
+        self.publish = publish
+        # region -> (received at, {ssid: (dpid, free room)})
+        self.summaries = {}
+        # request id -> (station, ssid, weight, sent at)
+        self.requests = {}
+        # ssid -> {station: (weight, until)}, stations accepted and not seen yet
+        self.reserved = {}
+
+    def reserved_load(self, ssid, now):
+        reservations = self.reserved.get(ssid, {})
+        for station in [station for station, (_, until) in reservations.items() if until <= now]:
+            del reservations[station]
+        return sum((weight for weight, _ in reservations.values()), 0.0)
+
+    # accepted stations in the report count in the AP load from now on
+    def settle(self, model):
+        for ssid, reservations in self.reserved.items():
+            for station in list(reservations):
+                index = model.station_index.get(station)
+                if index is not None and model.ssids[model.station_ap[index]] == ssid:
+                    del reservations[station]
+
+    def publish_summary(self, region, model, now):
+        self.settle(model)
+        aps = {}
+        for i in np.flatnonzero(model.underloaded(smoothing.LOW_WATERMARK)):
+            stat = model.statistics[i]
+            if region_of(stat['dpid']) != region:
+                continue
+            free = model.capacity[i] - model.load[i] - self.reserved_load(stat['ssid'], now)
+            if (free > 0).all():
+                aps[stat['ssid']] = (stat['dpid'], tuple(float(value) for value in free))
+        self.publish(SUMMARY_CHANNEL, transport.pack_message({'region': region, 'aps': aps}))
+
+    def on_summary(self, message, now):
+        if message['region'] not in self.regions:
+            self.summaries[message['region']] = (now, message['aps'])
+
+    # {ssid: (region, dpid, free room)} of the foreign APs that take stations
+    def foreign_aps(self, now):
+        aps = {}
+        for region, (received_at, summary) in list(self.summaries.items()):
+            if now - received_at > SUMMARY_TTL:
+                del self.summaries[region]
+                continue
+            for ssid, (dpid, free) in summary.items():
+                aps[ssid] = (region, dpid, np.array(free, dtype=np.float64))
+        return aps
+
+    def foreign_dpid(self, ssid):
+        for _, summary in self.summaries.values():
+            if ssid in summary:
+                return summary[ssid][0]
+        return None
+
+    # stations with a request in flight
+    def requested(self, now):
+        for request_id in [request_id for request_id, (_, _, _, sent_at) in self.requests.items()
+                           if now - sent_at > HANDSHAKE_TIMEOUT]:
+            del self.requests[request_id]
+        return set(station for station, _, _, _ in self.requests.values())
+
+    # asks the neighbours for room for the stations the local moves left on
+    # overloaded APs, best signal first. Returns the (station, ssid) asked for.
+    def request_handovers(self, model, oaps, moves, signal_threshold, budget, excluded, now):
+        if budget <= 0 or not oaps:
+            return []
+        foreign = self.foreign_aps(now)
+        if not foreign:
+            return []
+
+        # the stations already moving or asked for are off their APs
+        load = model.load.copy()
+        for station, ssid in moves:
+            s = model.station_index[station]
+            load[model.station_ap[s]] -= model.weight[s]
+        excluded = set(excluded) | self.requested(now) | set(station for station, _ in moves)
+        for station, ssid, weight, _ in self.requests.values():
+            s = model.station_index.get(station)
+            if s is not None and weight.shape == model.weight[s].shape:
+                load[model.station_ap[s]] -= weight
+            if ssid in foreign and weight.shape == foreign[ssid][2].shape:
+                foreign[ssid][2][:] -= weight
+
+        candidates = []
+        for stat in oaps:
+            source = model.ap_index[stat['ssid']]
+            for name, station in stat['stations_associated'].items():
+                if name in excluded:
+                    continue
+                for ssid, signal in station.get('aps', {}).items():
+                    if ssid in foreign and float(signal) > signal_threshold:
+                        candidates.append((-float(signal), name, source, ssid, region_of(stat['dpid'])))
+
+        sent = []
+        asked = set()
+        for _, name, source, ssid, from_region in sorted(candidates):
+            if len(sent) >= budget:
+                break
+            weight = model.weight[model.station_index[name]]
+            region, _, free = foreign[ssid]
+            if name in asked or not (load[source] > model.capacity[source]).any():
+                continue
+            if weight.shape != free.shape or not (weight <= free).all():
+                continue
+            free -= weight
+            load[source] -= weight
+            asked.add(name)
+            request_id = tracing.new_trace_id()
+            self.requests[request_id] = (name, ssid, weight.copy(), now)
+            self.publish(handover_channel(region), transport.pack_message({
+                'type': 'request', 'id': request_id, 'station': name, 'ssid': ssid,
+                'weight': tuple(float(value) for value in weight), 'from': from_region}))
+            sent.append((name, ssid))
+        return sent
+
+    # a neighbour asks for room on one of our APs, returns whether it got it
+    def on_request(self, message, model, now):
+        ssid = message['ssid']
+        weight = np.array(message['weight'], dtype=np.float64)
+        ok = False
+        i = model.ap_index.get(ssid) if model is not None else None
+        if i is not None and region_of(model.statistics[i]['dpid']) in self.regions:
+            # both controllers must weigh stations the same way
+            if weight.shape == model.load[i].shape:
+                ok = bool((model.load[i] + self.reserved_load(ssid, now) + weight <= model.capacity[i]).all())
+        if ok:
+            self.reserved.setdefault(ssid, {})[message['station']] = (weight, now + RESERVATION_TTL)
+        region = region_of(model.statistics[i]['dpid']) if i is not None else None
+        self.publish(handover_channel(message['from']), transport.pack_message({
+            'type': 'reply', 'id': message['id'], 'station': message['station'], 'ssid': ssid,
+            'ok': ok, 'region': region}))
+        return ok
+
+    # the (station, ssid) to migrate for an accepted request, None otherwise
+    def on_reply(self, message, now):
+        request = self.requests.pop(message['id'], None)
+        if not message['ok']:
+            return None
+        if request is None or now - request[3] > HANDSHAKE_TIMEOUT:
+            # given up already, the owner reserved the room for nothing
+            self.publish(handover_channel(message['region']), transport.pack_message({
+                'type': 'release', 'station': message['station'], 'ssid': message['ssid']}))
+            return None
+        return request[0], request[1]
+
+    # the requester gave up on a room it was granted
+    def on_release(self, message):
+        self.reserved.get(message['ssid'], {}).pop(message['station'], None)
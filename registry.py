@@ -0,0 +1,170 @@
+import socket
+import struct
+import time
+
+import redis
+
+import regions
+import transport
+import wire_format
+
+# Registry of the per-AP agents and the view the controller builds from them.
+#
+# ap_agent.py started with AP names runs for those APs only, so there can be
+# one agent per AP or per host. It registers each of its APs in Redis: name,
+# dpid, interface and ssid in the hash ap:<name>, which expires after
+# REGISTRY_TTL, and the name in the set 'aps'. A heartbeat renews the hash
+# every HEARTBEAT_PERIOD, so the APs of an agent that died drop out on their
+# own. Each AP's report goes out on its own on ap_statistics[.<region>],
+# prefixed with the AP name.
+#
+# The controller decodes every AP's messages with a decoder of its own and
+# keeps the last report of every AP. A new view is handed to the balancer
+# once every registered AP reported since the previous one, or ROUND_WAIT
+# after the first report of the round when some did not.
+
+AP_SET = 'aps'
+AP_KEY = 'ap:%s'
+HEARTBEAT_PERIOD = 5 # seconds
+REGISTRY_TTL = 15 # seconds
+# how often the controller reads the registry
+REGISTRY_POLL = 5 # seconds
+ROUND_WAIT = 5 # seconds
+
+NAME_LENGTH = struct.Struct('<B')
+
+RegistryError = redis.RedisError
+
+
+def report_channel(region):
+    return 'ap_' + regions.statistics_channel(region)
+
+def pack_report(name, payload):
+    data = name.encode('UTF-8')
+    return NAME_LENGTH.pack(len(data)) + data + payload
+
+def unpack_report(data):
+    length, = NAME_LENGTH.unpack_from(data)
+    offset = NAME_LENGTH.size + length
+    return data[NAME_LENGTH.size:offset].decode('UTF-8'), data[offset:]
+
+
+class Registry:
+    def __init__(self, host=transport.REDIS_HOST):
+        self.redis = redis.Redis(host)
+
+    # also the heartbeat: every call renews the TTL
+    def register(self, name, dpid, if_name, ssid, ttl=REGISTRY_TTL):
+        key = AP_KEY % name
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(key, mapping={'name': name, 'dpid': dpid, 'if_name': if_name,
+                                'ssid': ssid or '', 'host': socket.gethostname()})
+        pipe.expire(key, ttl)
+        pipe.sadd(AP_SET, name)
+        pipe.execute()
+
+    def deregister(self, name):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.delete(AP_KEY % name)
+        pipe.srem(AP_SET, name)
+        pipe.execute()
+
+    # {name: entry} of the APs whose heartbeat has not expired
+    def live_aps(self):
+        names = [name.decode() for name in self.redis.smembers(AP_SET)]
+        pipe = self.redis.pipeline(transaction=False)
+        for name in names:
+            pipe.hgetall(AP_KEY % name)
+        aps = {}
+        expired = []
+        for name, entry in zip(names, pipe.execute()):
+            if not entry:
+                expired.append(name)
+                continue
+            entry = {key.decode(): value.decode() for key, value in entry.items()}
+            entry['dpid'] = int(entry['dpid'])
+            aps[name] = entry
+        if expired:
+            self.redis.srem(AP_SET, *expired)
+        return aps
+
+
+# stands in for the wire_format.Decoder of a region: decode() takes the
+# per-AP messages and returns the whole view when a round is complete
+class ApView:
+    def __init__(self, registry=None, region=None):
+        self.registry = registry
+        self.region = region
+        self.decoders = {}
+        # AP name -> (its last report entry, captured at)
+        self.aps = {}
+        self.live = None
+        self.live_read_at = None
+        # APs reported since the last view and when the round started
+        self.reported = set()
+        self.round_started = None
+        # like Decoder: number and capture time of the last view, the oldest
+        # report in it
+        self.seq = 0
+        self.captured_at = None
+
+    # names of the registered APs of the region, None without a registry
+    def live_aps(self, now):
+        if self.registry is None:
+            return None
+        if self.live_read_at is None or now - self.live_read_at >= REGISTRY_POLL:
+            try:
+                aps = self.registry.live_aps()
+            except RegistryError as ex:
+                print('registry not available, keeping the last AP list:', ex)
+                return self.live
+            self.live = set(name for name, entry in aps.items()
+                            if regions.region_of(entry['dpid']) == self.region)
+            self.live_read_at = now
+        return self.live
+
+    def decode(self, data):
+        try:
+            name, payload = unpack_report(data)
+        except (struct.error, UnicodeDecodeError) as ex:
+            raise ValueError('malformed AP report: %s' % ex)
+        decoder = self.decoders.setdefault(name, wire_format.Decoder())
+        report = decoder.decode(payload)
+        if report is None:
+            return None
+        for stat in report:
+            self.aps[stat['name']] = (stat, decoder.captured_at)
+            self.reported.add(stat['name'])
+
+        now = time.monotonic()
+        if self.round_started is None:
+            self.round_started = now
+        live = self.live_aps(now)
+        waiting = set()
+        if live is not None:
+            for ap in [ap for ap in self.aps if ap not in live]:
+                del self.aps[ap]
+                self.decoders.pop(ap, None)
+            waiting = live - self.reported
+        if not self.aps or waiting and now - self.round_started < ROUND_WAIT:
+            return None
+        self.reported = set()
+        self.round_started = None
+        return self.build()
+
+    # the report of every AP, by dpid. A station that moved between the
+    # samples of two APs is on both, the newest sample wins.
+    def build(self):
+        newest = {}
+        for name, (stat, captured_at) in self.aps.items():
+            for station in stat['stations_associated']:
+                if station not in newest or captured_at > newest[station][1]:
+                    newest[station] = (name, captured_at)
+        report = []
+        for name, (stat, captured_at) in sorted(self.aps.items(), key=lambda item: item[1][0]['dpid']):
+            stations = {station: values for station, values in stat['stations_associated'].items()
+                        if newest[station][0] == name}
+            report.append(dict(stat, stations_associated=stations))
+        self.seq += 1
+        self.captured_at = min(captured_at for _, captured_at in self.aps.values())
+        return report
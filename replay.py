@@ -0,0 +1,183 @@
+import argparse
+import ast
+import os
+import struct
+import time
+
+import balancer
+import wire_format
+
+# Offline replay of the balancing decisions.
+#
+# The statistics reports in the results/ logs are converted into a trace:
+# the reports encoded with wire_format, keyframes and deltas, and the
+# migrations logged after each of them. The trace is then fed through the
+# same Balancer the controllers use, without Ryu, Redis or Mininet, with the
+# report period as the clock.
+#
+# usage: python replay.py convert results/small/load small-load.trace [--agent]
+#        python replay.py run small-load.trace|results/small/load [--policy rate]
+
+TRACE_MAGIC = b'WT'
+TRACE_VERSION = 1
+RECORD = struct.Struct('<BI')
+REPORT = 1
+MIGRATION = 2
+
+# the agent reports every AP_METRICS_PERIOD_IN_SECONDS, the logs carry no time
+REPORT_PERIOD = 10 # seconds
+
+# by_rate and capacity of app.py and app-vazao.py
+POLICIES = {
+    'count': (False, 6),
+    'rate': (True, 13),
+}
+
+
+# reports and the migrations decided on each, from the controller log or
+# from what the agent sent
+def parse_logs(run_dir, agent=False):
+    controller_path = os.path.join(run_dir, 'controller_output.txt')
+    if agent or not os.path.exists(controller_path):
+        cycles = []
+        with open(os.path.join(run_dir, 'ap_output.txt')) as f:
+            for line in f:
+                if line.startswith('[{'):
+                    cycles.append((ast.literal_eval(line), []))
+                elif line.startswith('data received for migration') and cycles:
+                    instruction = ast.literal_eval(line[len('data received for migration'):].strip())
+                    cycles[-1][1].append((instruction['station_name'], instruction['ssid']))
+        return cycles
+
+    cycles = []
+    with open(controller_path) as f:
+        for line in f:
+            if line.startswith('received the statistics'):
+                cycles.append((ast.literal_eval(line[len('received the statistics'):].strip()), []))
+            elif line.startswith('station to be migrated') and cycles:
+                instruction = ast.literal_eval(line[len('station to be migrated'):].strip())
+                cycles[-1][1].append((instruction['station_name'], instruction['ssid']))
+    return cycles
+
+def encode_trace(cycles):
+    encoder = wire_format.Encoder()
+    chunks = [TRACE_MAGIC, bytes([TRACE_VERSION])]
+    for seq, (report, migrations) in enumerate(cycles):
+        payload = encoder.encode(report, seq, seq * REPORT_PERIOD)
+        chunks += [RECORD.pack(REPORT, len(payload)), payload]
+        for station, ssid in migrations:
+            payload = ('%s %s' % (station, ssid)).encode()
+            chunks += [RECORD.pack(MIGRATION, len(payload)), payload]
+    return b''.join(chunks)
+
+# (kind, payload) records of a trace
+def read_records(data):
+    if data[:2] != TRACE_MAGIC or data[2] != TRACE_VERSION:
+        raise ValueError('not a version %d trace' % TRACE_VERSION)
+    offset = 3
+    while offset < len(data):
+        kind, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        yield kind, data[offset:offset + length]
+        offset += length
+
+
+class ReplayBalancer(balancer.Balancer):
+    def __init__(self, by_rate, capacity):
+        self.by_rate = by_rate
+        self.default_capacity = capacity
+        self.init_balancer()
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def load_timestamp(self):
+        return self.now
+
+
+def replay(data, by_rate, capacity, verbose=True):
+    replayer = ReplayBalancer(by_rate, capacity)
+    decoder = wire_format.Decoder()
+    cycles = []
+    for kind, payload in read_records(data):
+        if kind == MIGRATION:
+            cycles[-1]['recorded'].append(tuple(payload.decode().split(' ')))
+            continue
+        cpu = time.process_time()
+        report = decoder.decode(payload)
+        start = time.perf_counter()
+        replayer.statistics = report
+        replayer.now = decoder.captured_at
+        oaps, uaps, moves, prevented = replayer.decide()
+        latency = time.perf_counter() - start
+        cycles.append({'seq': decoder.seq, 'overloaded': [ap['ssid'] for ap in oaps],
+                       'underloaded': [ap['ssid'] for ap in uaps], 'moves': moves,
+                       'prevented': prevented, 'recorded': [],
+                       'latency': latency, 'cpu': time.process_time() - cpu})
+
+    if verbose:
+        for cycle in cycles:
+            print('#%-3d over %-24s under %-24s moves %s recorded %s %.3f ms' % (
+                cycle['seq'], ','.join(cycle['overloaded']) or '-', ','.join(cycle['underloaded']) or '-',
+                cycle['moves'], cycle['recorded'], cycle['latency'] * 1000))
+    return cycles
+
+def summarize(cycles, wall):
+    latencies = sorted(cycle['latency'] for cycle in cycles)
+    n = len(cycles)
+    moves = sum(len(cycle['moves']) for cycle in cycles)
+    recorded = [cycle for cycle in cycles if cycle['recorded']]
+    same = sum(1 for cycle in recorded if set(cycle['moves']) == set(cycle['recorded']))
+    print('cycles %d, moves %d, prevented by smoothing %d' % (
+        n, moves, sum(cycle['prevented'] for cycle in cycles)))
+    if recorded:
+        print('recorded decisions reproduced in %d of %d cycles' % (same, len(recorded)))
+    if n:
+        print('decision latency mean %.3f ms, p99 %.3f ms, max %.3f ms' % (
+            sum(latencies) / n * 1000, latencies[min(n - 1, int(n * 0.99))] * 1000, latencies[-1] * 1000))
+        print('cpu per cycle %.3f ms, total %.3f ms' % (
+            sum(cycle['cpu'] for cycle in cycles) / n * 1000, sum(cycle['cpu'] for cycle in cycles) * 1000))
+        print('replayed %d s of reports in %.3f s, %.0fx real time' % (
+            n * REPORT_PERIOD, wall, n * REPORT_PERIOD / wall if wall else float('inf')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay recorded statistics through the balancer')
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help='convert a results/ run into a trace')
+    convert.add_argument('run_dir')
+    convert.add_argument('trace')
+    convert.add_argument('--agent', action='store_true', help='use the reports in ap_output.txt')
+    run = commands.add_parser('run', help='replay a trace or a results/ run')
+    run.add_argument('trace')
+    run.add_argument('--agent', action='store_true', help='use the reports in ap_output.txt')
+    run.add_argument('--policy', choices=sorted(POLICIES),
+                     help='count (app.py) or rate (app-vazao.py), by default from the run name')
+    run.add_argument('--capacity', type=float, help='override the capacity of the policy')
+    run.add_argument('--quiet', action='store_true', help='only print the summary')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        data = encode_trace(parse_logs(args.run_dir, args.agent))
+        with open(args.trace, 'wb') as f:
+            f.write(data)
+        print('wrote %s, %d bytes' % (args.trace, len(data)))
+        return
+
+    if os.path.isdir(args.trace):
+        data = encode_trace(parse_logs(args.trace, args.agent))
+    else:
+        with open(args.trace, 'rb') as f:
+            data = f.read()
+    policy = args.policy or ('rate' if 'load' in os.path.basename(os.path.normpath(args.trace)) else 'count')
+    by_rate, capacity = POLICIES[policy]
+    if args.capacity is not None:
+        capacity = args.capacity
+    print('policy %s, capacity %s' % (policy, capacity))
+    start = time.perf_counter()
+    cycles = replay(data, by_rate, capacity, verbose=not args.quiet)
+    summarize(cycles, time.perf_counter() - start)
+
+if __name__ == '__main__':
+    main()
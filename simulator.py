@@ -0,0 +1,346 @@
+import argparse
+import heapq
+import queue
+import random
+import threading
+import time
+
+import numpy as np
+
+import balancer
+import replay
+import synthetic
+import tracing
+import transport
+import wire_format
+
+# Discrete-event WLAN simulator, standing in for Mininet-WiFi and ap_agent.py.
+#
+# APs and stations are placed like synthetic.py does and hear each other
+# with the same logDistance exp=5.5 path loss. Every station sends UDP at a
+# constant offered rate, like the iperf clients of generate_traffic_large.py,
+# at the 802.11g rate its RSSI to its AP allows. An AP has one second of
+# airtime per second; when its stations need more, each gets the same
+# fraction of what it offers and the rest is lost. APs do not interfere.
+#
+# The simulator publishes the agent's reports on `statistics` every
+# REPORT_PERIOD, takes migration instructions from `sdn` and answers them on
+# `sdn_ack`. A migrating station is off the air until it associates to the
+# new AP. With the local transport the Balancer of the controllers runs in
+# the same process on simulated time, as fast as the events allow; over
+# Redis the simulator runs at wall clock pace against a controller started
+# on its own.
+#
+# usage: python simulator.py [--aps 4] [--stations 20] [--policy rate|count|none]
+#        python simulator.py --transport pubsub [--speed 1]
+
+# AP_METRICS_PERIOD_IN_SECONDS of the agent
+REPORT_PERIOD = 10 # seconds
+# iperf -t of generate_traffic_large.py
+DURATION = 120 # seconds
+# 802.11g rates in Mbps, by the lowest RSSI they need
+PHY_RATES = ((-65, 54), (-66, 48), (-70, 36), (-74, 24), (-77, 18), (-79, 12), (-81, 9), (-90, 6))
+# UDP goodput out of the PHY rate, after contention, headers and acks
+MAC_EFFICIENCY = 0.5
+# from the instruction to the disconnect, the agent runs iw in the station
+COMMAND_DELAY = 0.1 # seconds
+# association to the new AP takes up to twice this
+ASSOCIATION_DELAY = 0.5 # seconds
+# ASSOCIATION_TIMEOUT_IN_SECONDS of the agent
+ASSOCIATION_TIMEOUT = 5 # seconds
+# how often instructions from Redis are picked up
+POLL_PERIOD = 0.1 # seconds
+
+
+def phy_rate(rssi):
+    for threshold, rate in PHY_RATES:
+        if rssi >= threshold:
+            return rate
+    return 0
+
+# everything waiting in a queue, without blocking
+def drain(items):
+    drained = []
+    while 1:
+        try:
+            drained.append(items.get_nowait())
+        except queue.Empty:
+            return drained
+
+def forward(bus, channel, inbox):
+    for payload in bus.listen(channel):
+        inbox.put(payload)
+
+
+class Simulator:
+    def __init__(self, network, bus, inbox, start, seed=2):
+        self.network = network
+        self.bus = bus
+        self.inbox = inbox
+        self.random = random.Random(seed)
+        self.encoder = wire_format.Encoder()
+
+        n = len(network.stations)
+        self.names = ['sta%d' % (i + 1) for i in range(n)]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.ssids = ['ssid-ap%d' % (i + 1) for i in range(len(network.aps))]
+        self.ap_index = {ssid: i for i, ssid in enumerate(self.ssids)}
+        self.heard = [network.heard(x, y) for x, y in network.stations]
+        self.offered = np.array(network.rates, dtype=np.float64)
+        # AP of every station, -1 while it is off the air
+        self.ap = np.array([max(heard, key=heard.get) for heard in self.heard], dtype=np.int64)
+        self.phy = np.array([phy_rate(heard[ap]) for heard, ap in zip(self.heard, self.ap)], dtype=np.float64)
+        # the agent spreads the first scans over the scan period
+        self.scan_offset = [self.random.random() * synthetic.SCAN_PERIOD for _ in range(n)]
+
+        self.start = self.now = start
+        self.events = []
+        self.event_seq = 0
+        self.report_seq = 0
+        self.last_report = start
+        # instructions being carried out and waiting, by station
+        self.migrations = {}
+        self.pending = {}
+
+        self.period_mb = np.zeros(n)
+        self.station_mb = np.zeros(n)
+        self.offered_mb = 0.0
+        self.outage = 0.0
+        self.overloaded = 0.0
+        self.moved = 0
+        self.failed = 0
+        self.update_rates()
+
+    def schedule(self, t, handler, *args):
+        self.event_seq += 1
+        heapq.heappush(self.events, (t, self.event_seq, handler, args))
+
+    # delivered rate of every station from the airtime its AP has left
+    def update_rates(self):
+        on_air = self.ap >= 0
+        airtime = np.where(on_air, self.offered / (MAC_EFFICIENCY * np.maximum(self.phy, 1)), 0.0)
+        self.airtime = np.bincount(self.ap[on_air], weights=airtime[on_air], minlength=len(self.ssids))
+        share = np.minimum(1.0, 1.0 / np.maximum(self.airtime, 1e-9))
+        self.rates = np.where(on_air, self.offered * share[np.maximum(self.ap, 0)], 0.0)
+
+    # rates are constant between events
+    def advance(self, t):
+        dt = t - self.now
+        if dt > 0:
+            self.period_mb += self.rates * dt
+            self.station_mb += self.rates * dt
+            self.offered_mb += self.offered.sum() * dt
+            self.outage += (self.ap < 0).sum() * dt
+            self.overloaded += (self.airtime > 1).sum() * dt
+        self.now = t
+
+    # the report of measures_ap_metrics(), rates averaged since the last one
+    def report(self, verbose=True):
+        elapsed = self.now - self.last_report
+        rates = self.period_mb / elapsed if elapsed > 0 else self.period_mb
+        report = []
+        for i, ssid in enumerate(self.ssids):
+            report.append({'name': 'ap%d' % (i + 1), 'dpid': i + 1, 'if_name': 'ap%d-wlan1' % (i + 1),
+                           'ssid': ssid, 'stations_associated': {}})
+        for i in np.flatnonzero(self.ap >= 0):
+            since_start = self.now - self.start - self.scan_offset[i]
+            if since_start < 0:
+                scan = {'aps': {}, 'rssi_age': None}
+            else:
+                scan = {'aps': {self.ssids[ap]: '%.2f' % value for ap, value in self.heard[i].items()},
+                        'rssi_age': since_start % synthetic.SCAN_PERIOD}
+            scan['rx_rate'] = rates[i]
+            scan['tx_rate'] = 0.0
+            report[self.ap[i]]['stations_associated'][self.names[i]] = scan
+
+        self.period_mb[:] = 0
+        self.last_report = self.now
+        self.report_seq += 1
+        self.bus.publish('statistics', self.encoder.encode(report, self.report_seq, self.now))
+        if verbose:
+            print('%6.0f s  delivered %.1f of %.1f Mbps, %d of %d APs out of airtime' % (
+                self.now - self.start, self.rates.sum(), self.offered.sum(),
+                (self.airtime > 1).sum(), len(self.ssids)))
+        self.schedule(self.now + REPORT_PERIOD, self.report, verbose)
+
+    def tick(self):
+        self.schedule(self.now + POLL_PERIOD, self.tick)
+
+    # like the agent's MigrationExecutor: one migration per station at a
+    # time, only the latest waiting instruction is kept
+    def submit(self, data):
+        data['phases'] = [('received', self.now)]
+        station = data['station_name']
+        if station not in self.index:
+            self.acknowledge(data, False, 'unknown station %s' % station)
+            return
+        superseded = self.pending.get(station)
+        self.pending[station] = data
+        if superseded is not None:
+            self.acknowledge(superseded, False, 'superseded by ' + data['ssid'])
+        elif station not in self.migrations:
+            self.schedule(self.now + COMMAND_DELAY, self.disconnect, station)
+
+    def disconnect(self, station):
+        data = self.pending.pop(station)
+        self.migrations[station] = data
+        i = self.index[station]
+        old_ap = self.ap[i]
+        self.ap[i] = -1
+        self.update_rates()
+        data['phases'].append(('disconnected', self.now))
+
+        target = self.ap_index.get(data['ssid'])
+        if target is None or target not in self.heard[i]:
+            # the station gives up and goes back to its old AP
+            self.schedule(self.now + ASSOCIATION_TIMEOUT, self.associate, station, old_ap,
+                          '%s did not associate within %s seconds' % (station, ASSOCIATION_TIMEOUT))
+        else:
+            delay = self.random.uniform(0, 2 * ASSOCIATION_DELAY)
+            self.schedule(self.now + delay, self.associate, station, target, None)
+
+    def associate(self, station, ap, error):
+        i = self.index[station]
+        self.ap[i] = ap
+        self.phy[i] = phy_rate(self.heard[i][ap])
+        self.update_rates()
+        data = self.migrations.pop(station)
+        if error is None:
+            data['phases'].append(('associated', self.now))
+            self.moved += 1
+        else:
+            self.failed += 1
+        self.acknowledge(data, error is None, error)
+        if station in self.pending:
+            self.schedule(self.now + COMMAND_DELAY, self.disconnect, station)
+
+    def acknowledge(self, data, ok, error=None):
+        ack = {'station_name': data['station_name'], 'ssid': data['ssid'],
+               'trace_id': data.get('trace_id'), 'ok': ok, 'error': error,
+               'phases': data['phases'] + [('acked', self.now)]}
+        self.bus.publish('sdn_ack', transport.pack_message(ack))
+
+    # runs the events up to duration seconds after the start. The local
+    # controller gets a turn after every event; speed paces the events
+    # against the wall clock.
+    def run(self, duration, controller=None, speed=None, verbose=True):
+        wall = time.monotonic()
+        end = self.start + duration
+        self.schedule(self.start, self.report, verbose)
+        if speed:
+            self.schedule(self.start, self.tick)
+        while self.events and self.events[0][0] <= end:
+            t, _, handler, args = heapq.heappop(self.events)
+            if speed:
+                time.sleep(max(0, wall + (t - self.start) / speed - time.monotonic()))
+            self.advance(t)
+            handler(*args)
+            if controller is not None:
+                controller.step(self.now)
+            for payload in drain(self.inbox):
+                self.submit(transport.unpack_message(payload))
+        self.advance(end)
+
+    def summarize(self, wall):
+        duration = self.now - self.start
+        delivered_mb = self.station_mb.sum()
+        offered = self.offered * duration
+        loss = np.where(offered > 0, 1 - self.station_mb / np.maximum(offered, 1e-9), 0.0)
+        print('%d APs, %d stations, %d s simulated' % (len(self.ssids), len(self.names), duration))
+        if duration <= 0:
+            return
+        print('offered %.1f Mbps, delivered %.1f Mbps, loss %.2f%%, worst station loss %.2f%%' % (
+            self.offered_mb / duration, delivered_mb / duration,
+            100 * (1 - delivered_mb / self.offered_mb) if self.offered_mb else 0.0,
+            100 * loss.max() if len(loss) else 0.0))
+        print('migrations %d, failed %d, %.1f station-s off the air' % (self.moved, self.failed, self.outage))
+        print('APs out of airtime %.1f%% of the time' % (100 * self.overloaded / (duration * len(self.ssids))))
+        print('simulated %d s in %.3f s, %.0fx real time' % (
+            duration, wall, duration / wall if wall else float('inf')))
+
+
+# the decisions of the controllers, on simulated time: the Balancer fed from
+# `statistics`, migrations published on `sdn` and acks taken from `sdn_ack`
+class SimController(balancer.Balancer):
+    def __init__(self, bus, by_rate, capacity, verbose=True):
+        self.by_rate = by_rate
+        self.default_capacity = capacity
+        self.init_balancer()
+        self.bus = bus
+        self.reports = bus.subscribe('statistics')
+        self.acks = bus.subscribe('sdn_ack')
+        self.now = 0.0
+        self.verbose = verbose
+
+    def clock(self):
+        return self.now
+
+    # the reports are captured on simulated time too
+    def ack_timestamp(self):
+        return self.now
+
+    def load_timestamp(self):
+        return self.captured_at()
+
+    def migrate_station(self, station, new_ap):
+        trace_id = tracing.new_trace_id()
+        self.start_migration(station, new_ap, trace_id)
+        instruction = {'station_name': station, 'ssid': new_ap, 'trace_id': trace_id}
+        self.bus.publish('sdn', transport.pack_message(instruction))
+
+    def step(self, now):
+        self.now = now
+        for payload in drain(self.acks):
+            ack = transport.unpack_message(payload)
+            self.finish_migration(ack['station_name'], ack['trace_id'], ack['ok'])
+
+        for payload in drain(self.reports):
+            if not self.on_statistics(None, payload):
+                continue
+            oaps, uaps, moves, prevented = self.decide()
+            for station, ssid in moves:
+                self.migrate_station(station, ssid)
+            if self.verbose and (moves or prevented):
+                print('          moves %s, %d prevented by smoothing' % (moves, prevented))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='simulate the WLAN in place of Mininet-WiFi and the agent')
+    parser.add_argument('--aps', type=int, default=4)
+    parser.add_argument('--stations', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=DURATION, help='seconds of traffic')
+    parser.add_argument('--seed', type=int, default=2)
+    parser.add_argument('--transport', choices=('local', 'pubsub', 'streams'), default='local',
+                        help='local runs the balancer in process, the others talk to a controller over Redis')
+    parser.add_argument('--policy', choices=sorted(replay.POLICIES) + ['none'], default='rate',
+                        help='balancer of the local transport, none to never migrate')
+    parser.add_argument('--capacity', type=float, help='override the capacity of the policy')
+    parser.add_argument('--speed', type=float, default=1.0, help='simulated seconds per second over Redis')
+    parser.add_argument('--quiet', action='store_true', help='only print the summary')
+    args = parser.parse_args()
+
+    transport.TRANSPORT = args.transport
+    network = synthetic.Network(args.aps, args.stations, args.seed)
+    bus = transport.connect('agent')
+    controller = None
+    speed = None
+    if args.transport == 'local':
+        inbox = bus.subscribe('sdn')
+        if args.policy != 'none':
+            by_rate, capacity = replay.POLICIES[args.policy]
+            if args.capacity is not None:
+                capacity = args.capacity
+            controller = SimController(transport.connect('controller'), by_rate, capacity, not args.quiet)
+            print('policy %s, capacity %s' % (args.policy, capacity))
+    else:
+        inbox = queue.Queue()
+        threading.Thread(target=forward, args=(bus, 'sdn', inbox), daemon=True).start()
+        speed = args.speed
+
+    simulator = Simulator(network, bus, inbox, time.time(), args.seed)
+    start = time.perf_counter()
+    simulator.run(args.duration, controller, speed, not args.quiet)
+    simulator.summarize(time.perf_counter() - start)
+
+if __name__ == '__main__':
+    main()
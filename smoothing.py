@@ -0,0 +1,148 @@
+import numpy as np
+
+# Load smoothing against ping-pong handovers.
+#
+# Every report adds one sample per station and per AP to a fixed-size ring
+# buffer: one row per name in a (rows, HISTORY_LENGTH, width) array. Next to
+# it an exponentially weighted moving average is kept, with a time constant
+# instead of a per-sample weight so 10 s agent reports and 0.5 s OpenFlow
+# polls smooth over the same time. The trend is the least squares slope of
+# the samples still in the buffer. Decisions use the station averages, and
+# the load of an AP is the sum of the averages of its stations, so a
+# migration shows at once while a burst of one station is damped. An AP is
+# overloaded above its capacity (the high watermark) and can take stations
+# below LOW_WATERMARK of it. A station that was just moved stays put for
+# STATION_COOLDOWN seconds.
+
+HISTORY_LENGTH = 8
+EWMA_TIME_CONSTANT = 30 # seconds
+# fraction of the capacity under which an AP is underloaded
+LOW_WATERMARK = 0.8
+STATION_COOLDOWN = 60 # seconds
+
+
+class RingHistory:
+    def __init__(self, length=HISTORY_LENGTH, time_constant=EWMA_TIME_CONSTANT):
+        self.length = length
+        self.time_constant = time_constant
+        self.rows = {}
+        self.free = []
+        self.samples = None
+
+    def allocate(self, n_rows, width):
+        samples = np.zeros((n_rows, self.length, width))
+        times = np.zeros((n_rows, self.length))
+        count = np.zeros(n_rows, dtype=np.int64)
+        ewma = np.zeros((n_rows, width))
+        if self.samples is not None:
+            old = len(self.samples)
+            samples[:old] = self.samples
+            times[:old] = self.times
+            count[:old] = self.count
+            ewma[:old] = self.ewma
+            self.free.extend(range(n_rows - 1, old - 1, -1))
+        else:
+            self.free.extend(range(n_rows - 1, -1, -1))
+        self.samples, self.times, self.count, self.ewma = samples, times, count, ewma
+
+    # adds one sample per name, names missing from the list are forgotten.
+    # Names with measured False keep their row but get no sample, their
+    # average starts from their first real one. Returns the rows of the
+    # names, in order.
+    def record(self, names, values, timestamp, measured=None):
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values.reshape(-1, 1)
+        if self.samples is None:
+            self.allocate(max(16, len(names)), values.shape[1])
+
+        present = set(names)
+        for name in [name for name in self.rows if name not in present]:
+            row = self.rows.pop(name)
+            self.count[row] = 0
+            self.free.append(row)
+        new = [name for name in names if name not in self.rows]
+        if len(new) > len(self.free):
+            self.allocate(2 * (len(self.samples) + len(new)), values.shape[1])
+        for name in new:
+            self.rows[name] = self.free.pop()
+
+        all_rows = rows = np.array([self.rows[name] for name in names], dtype=np.int64)
+        if measured is not None:
+            rows = rows[measured]
+            values = values[measured]
+        count = self.count[rows]
+        last = self.times[rows, (count - 1) % self.length]
+        dt = np.where(count > 0, timestamp - last, np.inf)
+        alpha = 1 - np.exp(-np.maximum(dt, 0) / self.time_constant)
+        self.ewma[rows] += alpha[:, None] * (values - self.ewma[rows])
+
+        slot = count % self.length
+        self.samples[rows, slot] = values
+        self.times[rows, slot] = timestamp
+        self.count[rows] = count + 1
+        return all_rows
+
+    # whether the rows have an average yet
+    def seeded(self, rows):
+        return self.count[rows] > 0
+
+    # least squares slope per second over the buffered samples, 0 with less than two
+    def trend(self, rows):
+        n = np.minimum(self.count[rows], self.length)
+        valid = np.arange(self.length) < n[:, None]
+        times = np.where(valid, self.times[rows], 0.0)
+        samples = np.where(valid[:, :, None], self.samples[rows], 0.0)
+        counts = np.maximum(n, 1)
+        t = np.where(valid, times - (times.sum(axis=1) / counts)[:, None], 0.0)
+        v = np.where(valid[:, :, None], samples - (samples.sum(axis=1) / counts[:, None])[:, None, :], 0.0)
+        denominator = (t * t).sum(axis=1)
+        slope = (t[:, :, None] * v).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(denominator[:, None] > 0, slope / denominator[:, None], 0.0)
+
+
+class LoadSmoother:
+    def __init__(self, cooldown=STATION_COOLDOWN):
+        self.cooldown = cooldown
+        self.stations = RingHistory()
+        self.aps = RingHistory()
+        self.cooldown_until = {}
+        self.ap_rows = np.zeros(0, dtype=np.int64)
+        self.prevented = 0
+
+    # the model with the station weights replaced by their averages and the
+    # AP loads summed from them
+    def smooth(self, model, timestamp):
+        station_rows = self.stations.record(model.stations, model.weight, timestamp, model.measured)
+        self.ap_rows = self.aps.record(model.ssids, model.load, timestamp)
+        # a station without a rate yet weighs nothing, as in the raw model
+        weight = np.where(self.stations.seeded(station_rows)[:, None],
+                          self.stations.ewma[station_rows], model.weight)
+        load = np.column_stack([np.bincount(model.station_ap, weights=weight[:, k], minlength=len(model.ssids))
+                                for k in range(weight.shape[1])])
+        return model.with_load(weight, load)
+
+    # per AP load change per second, in the order of the last smoothed model
+    def ap_trend(self):
+        if not len(self.ap_rows):
+            return np.zeros((0, 1))
+        return self.aps.trend(self.ap_rows)
+
+    def moved(self, station, now):
+        self.cooldown_until[station] = now + self.cooldown
+
+    def cooling(self, now):
+        for station in [station for station, until in self.cooldown_until.items() if until <= now]:
+            del self.cooldown_until[station]
+        return set(self.cooldown_until)
+
+    # moves a plan on the raw samples would have made and the smoothed one did not
+    def count_prevented(self, raw_moves, moves):
+        prevented = len(set(station for station, _ in raw_moves) - set(station for station, _ in moves))
+        self.prevented += prevented
+        return prevented
+
+    def report(self):
+        return 'smoothing: %d migrations prevented, %d stations cooling down' % (
+            self.prevented, len(self.cooldown_until))
@@ -0,0 +1,83 @@
+import math
+import random
+
+# Synthetic statistics reports, in the shape ap_agent.py publishes.
+#
+# APs sit on a square grid spaced like topology_large.py. Stations are
+# placed uniformly over the area the grid covers and associate to the
+# strongest AP, like the 'ssf' association of the topologies. Each station
+# hears the APs in range with the logDistance exp=5.5 model the topologies
+# use, and sends UDP at a rate drawn like generate_traffic_large.py does.
+
+AP_SPACING = 20 # m
+AP_RANGE = 30 # m
+PATH_LOSS_EXPONENT = 5.5
+# RSSI at 1 m, fitted to results/: -64 dBm at 10 m, -72 at 14 m, -80 at 20 m
+REFERENCE_RSSI = -9 # dBm
+# iperf -b of generate_traffic_large.py
+MAX_RATE = 5 # Mbps
+SCAN_PERIOD = 60 # seconds
+
+
+# mininet-wifi truncates the path loss to whole dB
+def rssi(distance):
+    return REFERENCE_RSSI - int(10 * PATH_LOSS_EXPONENT * math.log10(max(distance, 0.1)))
+
+
+class Network:
+    def __init__(self, n_aps, n_stations, seed=2):
+        self.random = random.Random(seed)
+        self.side = int(math.ceil(math.sqrt(n_aps)))
+        self.aps = [((i % self.side) * AP_SPACING, (i // self.side) * AP_SPACING) for i in range(n_aps)]
+        self.grid = {}
+        for i in range(n_aps):
+            self.grid[(i % self.side, i // self.side)] = i
+
+        rows = (n_aps + self.side - 1) // self.side
+        width = (self.side - 1) * AP_SPACING
+        height = (rows - 1) * AP_SPACING
+        self.stations = []
+        while len(self.stations) < n_stations:
+            x = self.random.uniform(-AP_SPACING / 2, width + AP_SPACING / 2)
+            y = self.random.uniform(-AP_SPACING / 2, height + AP_SPACING / 2)
+            # the last grid row can be partly empty
+            if self.heard(x, y):
+                self.stations.append((x, y))
+        self.rates = [self.random.random() * MAX_RATE for _ in self.stations]
+
+    # {ap index: rssi} of the APs in range of a position
+    def heard(self, x, y):
+        cells = int(math.ceil(AP_RANGE / AP_SPACING))
+        col = int(round(x / AP_SPACING))
+        row = int(round(y / AP_SPACING))
+        aps = {}
+        for c in range(col - cells, col + cells + 1):
+            for r in range(row - cells, row + cells + 1):
+                i = self.grid.get((c, r))
+                if i is None:
+                    continue
+                distance = math.hypot(x - self.aps[i][0], y - self.aps[i][1])
+                if distance <= AP_RANGE:
+                    aps[i] = rssi(distance)
+        return aps
+
+    def report(self):
+        report = []
+        for i in range(len(self.aps)):
+            report.append({'name': 'ap%d' % (i + 1), 'dpid': i + 1,
+                           'if_name': 'ap%d-wlan1' % (i + 1), 'ssid': 'ssid-ap%d' % (i + 1),
+                           'stations_associated': {}})
+        for i, (x, y) in enumerate(self.stations):
+            heard = self.heard(x, y)
+            ap = max(heard, key=heard.get)
+            report[ap]['stations_associated']['sta%d' % (i + 1)] = {
+                'aps': {'ssid-ap%d' % (n + 1): '%.2f' % value for n, value in heard.items()},
+                'rssi_age': self.random.random() * SCAN_PERIOD,
+                'rx_rate': self.rates[i],
+                'tx_rate': self.random.choice((0.0, 4.8e-05)),
+            }
+        return report
+
+
+def make_report(n_stations, n_aps, seed=2):
+    return Network(n_aps, n_stations, seed).report()
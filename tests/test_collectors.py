@@ -0,0 +1,32 @@
+import os
+
+import ap_agent
+import nl80211
+
+# `iw dev ap1-wlan1 info` and `iw dev ap1-wlan1 station dump` output, and
+# the genetlink payloads of the nl80211 replies for the same AP, one reply
+# per line after the genetlink header
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def read_text(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+def read_replies(name):
+    return [bytes.fromhex(line) for line in read_text(name).split()]
+
+
+def test_backends_agree_on_the_ssid():
+    ssid = nl80211.parse_ssid(read_replies('nl80211-get-interface.hex'))
+    assert ssid == ap_agent.get_ssid(read_text('iw-info.txt')) == 'ssid-ap1'
+
+def test_backends_agree_on_the_stations():
+    stations = nl80211.parse_stations(read_replies('nl80211-get-station.hex'))
+    assert stations == ap_agent.get_stations(read_text('iw-station-dump.txt'))
+    assert stations['02:00:00:00:00:00'] == {'rx_bytes': 129532, 'tx_bytes': 2914, 'counter_bits': 64, 'signal': -64}
+
+def test_64_bit_counters_are_preferred():
+    stations = nl80211.parse_stations(read_replies('nl80211-get-station.hex'))
+    # past 2**32, the 32 bit attribute holds the wrapped value
+    assert stations['02:00:00:00:01:00']['rx_bytes'] == 5368709632
@@ -0,0 +1,47 @@
+import ap_agent
+
+
+def test_32_bit_counter_wraps():
+    assert ap_agent.counter_delta(2**32 - 1000, 500, False, 32) == 1500
+
+def test_64_bit_counter_going_back_is_a_reset():
+    assert ap_agent.counter_delta(3 * 10**9, 1000, False, 64) == 1000
+
+def test_32_bit_counter_going_back_a_little_is_a_reset():
+    assert ap_agent.counter_delta(10**6, 1000, False, 32) == 1000
+
+def test_reassociation_counts_from_zero():
+    assert ap_agent.counter_delta(500, 2000, True) == 2000
+
+
+def test_rate_over_the_elapsed_time():
+    tracker = ap_agent.CounterTracker()
+    # no rate from a single sample
+    assert tracker.update('sta1', 'ap1', 100.0, 0, 0) is None
+    # 1.25 MB in 2 s
+    assert tracker.update('sta1', 'ap1', 102.0, 1250000, 0) == (5.0, 0.0)
+
+def test_reset_on_the_same_ap_after_3_gb():
+    tracker = ap_agent.CounterTracker()
+    tracker.update('sta1', 'ap1', 100.0, 3 * 10**9, 0)
+    rx_rate, _ = tracker.update('sta1', 'ap1', 110.0, 1000, 0)
+    assert rx_rate == 1000 * 8 / 10 / 10**6
+
+def test_move_to_another_ap():
+    tracker = ap_agent.CounterTracker()
+    tracker.update('sta1', 'ap1', 100.0, 10**6, 0)
+    rx_rate, _ = tracker.update('sta1', 'ap2', 101.0, 10**6 + 125000, 0)
+    assert rx_rate == (10**6 + 125000) * 8 / 10**6
+
+def test_stations_that_left_are_forgotten():
+    tracker = ap_agent.CounterTracker()
+    tracker.update('sta1', 'ap1', 100.0, 0, 0)
+    tracker.update('sta2', 'ap1', 100.0, 0, 0)
+    tracker.retain('ap1', ['sta1', 'sta2'])
+    # sta2 moved to ap2, which was sampled first
+    tracker.update('sta2', 'ap2', 110.0, 0, 0)
+    tracker.retain('ap2', ['sta2'])
+    tracker.retain('ap1', [])
+    assert set(tracker.samples) == {'sta2'}
+    tracker.retain('ap2', [])
+    assert tracker.samples == {}
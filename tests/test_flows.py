@@ -0,0 +1,31 @@
+import flows
+
+
+# whether a cookie-masked delete of the station removes the flow
+def deleted(cookie, station_id, preinstalled=False):
+    return any(cookie & mask == match & mask
+               for match, mask in flows.station_matches(station_id, preinstalled))
+
+
+def test_both_ends_of_a_station_flow_are_tagged():
+    cookie = flows.flow_cookie(3, 7)
+    assert deleted(cookie, 3)
+    assert deleted(cookie, 7)
+    assert not deleted(cookie, 5)
+
+def test_flow_to_a_non_station():
+    cookie = flows.flow_cookie(3, 0)
+    assert deleted(cookie, 3)
+    assert not deleted(cookie, 0x300)
+
+def test_learned_and_preinstalled_flows_are_deleted_apart():
+    learned = flows.flow_cookie(3, 7)
+    preinstalled = flows.flow_cookie(3, 7, preinstalled=True)
+    assert not deleted(preinstalled, 3)
+    assert deleted(preinstalled, 3, preinstalled=True)
+    assert not deleted(learned, 3, preinstalled=True)
+
+def test_ids_do_not_overlap():
+    cookie = flows.flow_cookie(flows.ID_MASK, flows.ID_MASK)
+    assert cookie & flows.STATION_COOKIE_MASK == flows.STATION_COOKIE
+    assert not cookie & flows.PREINSTALLED
@@ -0,0 +1,49 @@
+import mac_table
+
+
+def test_learn_and_lookup():
+    table = mac_table.MacLearningTable()
+    table.learn(1, 'aa', 3, 10.0)
+    assert table.lookup(1, 'aa', 10.5) == 3
+    assert table.lookup(2, 'aa', 10.5) is None
+    table.learn(1, 'aa', 4, 11.0)
+    assert table.lookup(1, 'aa', 11.0) == 4
+
+def test_full_table_evicts_the_least_recently_seen():
+    table = mac_table.MacLearningTable(max_entries=32)
+    for i in range(32):
+        table.learn(1, 'mac%d' % i, 1, float(i))
+    # seen again, now the most recent
+    table.learn(1, 'mac0', 1, 40.0)
+    table.learn(1, 'new', 1, 41.0)
+    # a batch of the oldest goes at once
+    assert len(table) == 32 - table.evict_batch + 1
+    assert table.lookup(1, 'mac0', 41.0) == 1
+    assert table.lookup(1, 'mac1', 41.0) is None
+    assert table.lookup(1, 'new', 41.0) == 1
+
+def test_idle_entries_expire():
+    table = mac_table.MacLearningTable(idle_timeout=300)
+    table.learn(1, 'old', 1, 0.0)
+    table.learn(1, 'busy', 2, 0.0)
+    table.learn(1, 'busy', 2, 200.0)
+    assert table.lookup(1, 'old', 301.0) is None
+    # dropped from the front on the next second learned
+    table.learn(2, 'other', 1, 302.0)
+    assert table.expired == 1
+    assert len(table) == 2
+    assert table.lookup(1, 'busy', 302.0) == 2
+
+def test_invalidate_removes_the_mac_everywhere():
+    table = mac_table.MacLearningTable()
+    table.learn(1, 'aa', 1, 0.0)
+    table.learn(2, 'aa', 5, 0.0)
+    table.invalidate('aa')
+    assert table.lookup(1, 'aa', 0.0) is None
+    assert table.lookup(2, 'aa', 0.0) is None
+
+def test_entries_of_a_second_and_port_are_shared():
+    table = mac_table.MacLearningTable()
+    table.learn(1, 'aa', 1, 5.2)
+    table.learn(2, 'bb', 1, 5.7)
+    assert table.tables[1]['aa'] is table.tables[2]['bb']
@@ -0,0 +1,80 @@
+import queue
+import threading
+
+import ap_agent
+import transport
+
+
+class Recorder:
+    def __init__(self):
+        self.acks = queue.Queue()
+
+    def publish(self, channel, payload):
+        assert channel == 'sdn_ack'
+        self.acks.put(transport.unpack_message(payload))
+
+# runs no commands: every migration waits until the test releases it
+class Executor(ap_agent.MigrationExecutor):
+    def __init__(self, workers=2):
+        self.started = queue.Queue()
+        self.release = {}
+        ap_agent.MigrationExecutor.__init__(self, Recorder(), workers)
+
+    def migrate(self, data):
+        gate = self.release.setdefault(data['ssid'], threading.Event())
+        self.started.put((data['station_name'], data['ssid']))
+        assert gate.wait(5)
+
+    def let_run(self, ssid):
+        self.release.setdefault(ssid, threading.Event()).set()
+
+def ack(executor):
+    ack = executor.transport.acks.get(timeout=5)
+    return ack['station_name'], ack['ssid'], ack['ok'], ack['error']
+
+def instruction(station, ssid):
+    return {'station_name': station, 'ssid': ssid}
+
+
+def test_only_the_latest_waiting_instruction_runs():
+    executor = Executor()
+    executor.submit(instruction('sta1', 'ssid-ap1'))
+    assert executor.started.get(timeout=5) == ('sta1', 'ssid-ap1')
+
+    # both wait for the running one, the second replaces the first
+    executor.submit(instruction('sta1', 'ssid-ap2'))
+    executor.submit(instruction('sta1', 'ssid-ap3'))
+    assert ack(executor) == ('sta1', 'ssid-ap2', False, 'superseded by ssid-ap3')
+    assert executor.started.empty()
+
+    executor.let_run('ssid-ap1')
+    assert ack(executor) == ('sta1', 'ssid-ap1', True, None)
+    assert executor.started.get(timeout=5) == ('sta1', 'ssid-ap3')
+    executor.let_run('ssid-ap3')
+    assert ack(executor) == ('sta1', 'ssid-ap3', True, None)
+
+def test_stations_migrate_in_parallel():
+    executor = Executor()
+    executor.submit(instruction('sta1', 'ssid-ap1'))
+    executor.submit(instruction('sta2', 'ssid-ap2'))
+    started = {executor.started.get(timeout=5), executor.started.get(timeout=5)}
+    assert started == {('sta1', 'ssid-ap1'), ('sta2', 'ssid-ap2')}
+    executor.let_run('ssid-ap1')
+    executor.let_run('ssid-ap2')
+    assert {ack(executor)[0], ack(executor)[0]} == {'sta1', 'sta2'}
+
+def test_failed_migration_is_nacked_and_frees_the_station():
+    executor = Executor()
+    executor.migrate = lambda data: 1 / 0
+    executor.submit(instruction('sta1', 'ssid-ap1'))
+    station, ssid, ok, error = ack(executor)
+    assert (station, ok) == ('sta1', False) and error
+    executor.submit(instruction('sta1', 'ssid-ap2'))
+    assert ack(executor)[:3] == ('sta1', 'ssid-ap2', False)
+
+def test_acks_are_json():
+    executor = Executor()
+    executor.let_run('ssid-ap1')
+    executor.submit(instruction('sta1', 'ssid-ap1'))
+    assert [phase for phase, _ in executor.transport.acks.get(timeout=5)['phases']] == [
+        'received', 'started', 'acked']
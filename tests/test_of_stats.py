@@ -0,0 +1,70 @@
+import pytest
+
+import of_stats
+
+
+def test_flow_rate_is_the_byte_difference_between_polls():
+    tracker = of_stats.RateTracker()
+    tracker.update_flows(1, [(0, '10.0.0.1', '10.0.0.9', 1000, 10.0)], 100.0)
+    tracker.update_flows(1, [(0, '10.0.0.1', '10.0.0.9', 1000 + 125000, 10.5)], 100.5)
+    # 125 kB in 0.5 s
+    assert tracker.station_rates(1, '10.0.0.1') == pytest.approx((2.0, 0.0))
+    assert tracker.station_rates(1, '10.0.0.9') == pytest.approx((0.0, 2.0))
+
+def test_new_flow_rate_is_over_its_duration():
+    tracker = of_stats.RateTracker()
+    tracker.update_flows(1, [(0, '10.0.0.1', '10.0.0.9', 250000, 2.0)], 100.0)
+    assert tracker.station_rates(1, '10.0.0.1') == pytest.approx((1.0, 0.0))
+
+def test_reinstalled_flow_starts_over():
+    tracker = of_stats.RateTracker()
+    tracker.update_flows(1, [(0, '10.0.0.1', '10.0.0.9', 10 ** 6, 30.0)], 100.0)
+    tracker.update_flows(1, [(0, '10.0.0.1', '10.0.0.9', 125000, 1.0)], 100.5)
+    assert tracker.station_rates(1, '10.0.0.1') == pytest.approx((1.0, 0.0))
+
+def test_removed_flows_are_forgotten():
+    tracker = of_stats.RateTracker()
+    tracker.update_flows(1, [(0, '10.0.0.1', '10.0.0.9', 1000, 1.0)], 100.0)
+    tracker.update_flows(1, [], 100.5)
+    assert tracker.flows == {}
+    assert tracker.station_rates(1, '10.0.0.1') == (0.0, 0.0)
+
+def test_unpolled_datapath_has_no_rates():
+    assert of_stats.RateTracker().station_rates(1, '10.0.0.1') is None
+
+def test_port_rates():
+    tracker = of_stats.RateTracker()
+    tracker.update_ports(1, [(2, 0, 0)], 100.0)
+    tracker.update_ports(1, [(2, 125000, 250000)], 101.0)
+    assert tracker.port_rate(1, 2) == pytest.approx((1.0, 2.0))
+    assert tracker.port_rate(1, 3) is None
+
+
+def report():
+    return [{'ssid': 'ssid-ap1', 'dpid': 1, 'stations_associated': {
+                'sta1': {'rx_rate': 5.0, 'tx_rate': 0.0}, 'sta2': {'rx_rate': 1.0, 'tx_rate': 0.0}}},
+            {'ssid': 'ssid-ap2', 'dpid': 2, 'stations_associated': {
+                'sta3': {'rx_rate': 3.0, 'tx_rate': 0.0}}}]
+
+def test_with_openflow_rates():
+    tracker = of_stats.RateTracker()
+    tracker.update_flows(1, [(0, '10.0.0.1', '10.0.0.9', 250000, 1.0)], 100.0)
+    statistics = report()
+    ips = {'sta1': '10.0.0.1', 'sta2': '10.0.0.2', 'sta3': '10.0.0.3'}
+    merged = of_stats.with_openflow_rates(statistics, tracker, ips)
+
+    stations = merged[0]['stations_associated']
+    assert stations['sta1']['rx_rate'] == pytest.approx(2.0)
+    # polled AP without flows for the station
+    assert stations['sta2']['rx_rate'] == 0.0
+    # AP not polled yet keeps the agent's rates
+    assert merged[1]['stations_associated']['sta3']['rx_rate'] == 3.0
+    # the report itself is left alone
+    assert statistics[0]['stations_associated']['sta1']['rx_rate'] == 5.0
+
+def test_compare_rates():
+    tracker = of_stats.RateTracker()
+    tracker.update_flows(1, [(0, '10.0.0.1', '10.0.0.9', 250000, 1.0)], 100.0)
+    ips = {'sta1': '10.0.0.1', 'sta2': '10.0.0.2'}
+    mismatches = of_stats.compare_rates(report(), tracker, ips, 1.5)
+    assert [name for name, _, _ in mismatches] == ['sta1']
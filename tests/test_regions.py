@@ -0,0 +1,60 @@
+import pytest
+
+import load_model
+import regions
+import synthetic
+import transport
+
+
+@pytest.fixture
+def model(monkeypatch):
+    monkeypatch.setattr(regions, 'REGIONS', {'west': [1, 2], 'east': [3, 4]})
+    return load_model.LoadModel(synthetic.make_report(8, 4), False, lambda stat: (6,))
+
+def broker(region, sent):
+    return regions.HandoverBroker([region], lambda channel, payload: sent.append((channel, transport.unpack_message(payload))))
+
+def request(station='sta1', ssid='ssid-ap3'):
+    return {'type': 'request', 'id': 'r1', 'station': station, 'ssid': ssid, 'weight': (1.0,), 'from': 'west'}
+
+
+def test_accept_reserves_the_room(model):
+    sent = []
+    owner = broker('east', sent)
+    assert owner.on_request(request(), model, 0.0)
+    assert owner.reserved_load('ssid-ap3', 0.0) == 1.0
+    channel, reply = sent[-1]
+    assert channel == 'handover.west'
+    assert reply['ok'] and reply['region'] == 'east'
+
+def test_reply_in_time_migrates(model):
+    sent = []
+    owner = broker('east', sent)
+    requester = broker('west', sent)
+    requester.requests['r1'] = ('sta1', 'ssid-ap3', None, 0.0)
+    owner.on_request(request(), model, 0.0)
+    assert requester.on_reply(sent[-1][1], 1.0) == ('sta1', 'ssid-ap3')
+    assert len(sent) == 1
+
+def test_late_reply_releases_the_room(model):
+    sent = []
+    owner = broker('east', sent)
+    requester = broker('west', sent)
+    requester.requests['r1'] = ('sta1', 'ssid-ap3', None, 0.0)
+    owner.on_request(request(), model, 0.0)
+    assert requester.on_reply(sent[-1][1], regions.HANDSHAKE_TIMEOUT + 1) is None
+
+    channel, release = sent[-1]
+    assert channel == 'handover.east' and release['type'] == 'release'
+    owner.on_release(release)
+    assert owner.reserved_load('ssid-ap3', 0.0) == 0.0
+
+def test_summary_lists_the_room_left(model):
+    sent = []
+    broker('east', sent).publish_summary('east', model, 0.0)
+    channel, summary = sent[-1]
+    assert channel == regions.SUMMARY_CHANNEL and summary['region'] == 'east'
+    other = broker('west', [])
+    other.on_summary(summary, 0.0)
+    for ssid, (region, dpid, free) in other.foreign_aps(0.0).items():
+        assert region == 'east' and dpid in (3, 4) and (free > 0).all()
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+import load_model
+import smoothing
+
+
+def report(rate=None):
+    station = {'aps': {}}
+    if rate is not None:
+        station.update(rx_rate=rate, tx_rate=0.0)
+    return [{'ssid': 'ssid-ap1', 'dpid': 1, 'stations_associated': {'sta1': station}}]
+
+def model(rate=None):
+    return load_model.LoadModel(report(rate), True, lambda stat: (13, 13))
+
+
+def test_average_follows_the_samples():
+    smoother = smoothing.LoadSmoother()
+    assert smoother.smooth(model(4.0), 0.0).weight[0, 0] == 4.0
+    alpha = 1 - np.exp(-10 / smoothing.EWMA_TIME_CONSTANT)
+    assert smoother.smooth(model(8.0), 10.0).weight[0, 0] == pytest.approx(4.0 + alpha * 4.0)
+
+def test_station_without_a_rate_is_not_averaged_in():
+    smoother = smoothing.LoadSmoother()
+    unmeasured = model()
+    assert not unmeasured.measured[0]
+    assert unmeasured.load[0, 0] == 0.0
+    assert smoother.smooth(unmeasured, 0.0).weight[0, 0] == 0.0
+    # the first real rate is the average, not a step up from 0
+    smoothed = smoother.smooth(model(5.0), 10.0)
+    assert smoothed.weight[0, 0] == 5.0
+    assert smoothed.load[0, 0] == 5.0
@@ -0,0 +1,35 @@
+import synthetic
+
+
+def test_report_shape():
+    report = synthetic.make_report(50, 9)
+    assert [stat['dpid'] for stat in report] == list(range(1, 10))
+    for i, stat in enumerate(report):
+        assert stat['name'] == 'ap%d' % (i + 1)
+        assert stat['if_name'] == 'ap%d-wlan1' % (i + 1)
+        assert stat['ssid'] == 'ssid-ap%d' % (i + 1)
+
+    names = [name for stat in report for name in stat['stations_associated']]
+    assert sorted(names) == sorted('sta%d' % (i + 1) for i in range(50))
+    ssids = {stat['ssid'] for stat in report}
+    for stat in report:
+        for station in stat['stations_associated'].values():
+            assert set(station) == {'aps', 'rssi_age', 'rx_rate', 'tx_rate'}
+            assert set(station['aps']) <= ssids
+            assert 0 <= station['rx_rate'] <= synthetic.MAX_RATE
+            assert 0 <= station['rssi_age'] <= synthetic.SCAN_PERIOD
+
+def test_stations_associate_to_the_strongest_ap():
+    for stat in synthetic.make_report(50, 9):
+        for station in stat['stations_associated'].values():
+            heard = {ssid: float(value) for ssid, value in station['aps'].items()}
+            assert heard[stat['ssid']] == max(heard.values())
+
+def test_same_seed_same_report():
+    assert synthetic.make_report(20, 4) == synthetic.make_report(20, 4)
+    assert synthetic.make_report(20, 4) != synthetic.make_report(20, 4, seed=3)
+
+def test_rssi_falls_with_distance():
+    assert synthetic.rssi(10) == -64
+    assert synthetic.rssi(20) == -80
+    assert synthetic.rssi(10) > synthetic.rssi(14) > synthetic.rssi(20)
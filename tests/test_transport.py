@@ -0,0 +1,100 @@
+import fakeredis
+import pytest
+
+import ap_agent
+import transport
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(transport.redis, 'Redis', lambda host: fakeredis.FakeRedis(server=server))
+    return server
+
+def stream(group):
+    return transport.StreamTransport(group, block_ms=10)
+
+# the group exists from when the consumer starts, like listen() at startup
+def listen(group, channel):
+    consumer = stream(group)
+    consumer.create_group(channel)
+    return consumer, consumer.listen(channel)
+
+def take(messages, n):
+    return [next(messages) for _ in range(n)]
+
+
+def test_publish_and_listen(server):
+    consumer, messages = listen('controller', 'statistics')
+    producer = stream('agent')
+    producer.publish('statistics', b'one')
+    producer.publish_many('statistics', [b'two', b'three'])
+    assert take(messages, 3) == [b'one', b'two', b'three']
+
+def test_batch_is_acked_when_the_next_one_is_asked_for(server):
+    consumer, messages = listen('controller', 'statistics')
+    producer = stream('agent')
+    producer.publish_many('statistics', [b'one', b'two'])
+    assert take(messages, 2) == [b'one', b'two']
+    assert consumer.redis.xpending('statistics', 'controller')['pending'] == 2
+
+    producer.publish('statistics', b'three')
+    assert next(messages) == b'three'
+    assert consumer.redis.xpending('statistics', 'controller')['pending'] == 1
+
+def test_restart_resumes_after_the_last_ack(server):
+    _, messages = listen('agent', 'sdn')
+    producer = stream('controller')
+    producer.publish_many('sdn', [b'one', b'two'])
+    assert take(messages, 2) == [b'one', b'two']
+    producer.publish('sdn', b'three')
+    assert next(messages) == b'three'
+    # dies before processing three
+    messages.close()
+    producer.publish('sdn', b'four')
+
+    messages = stream('agent').listen('sdn')
+    assert take(messages, 2) == [b'three', b'four']
+
+def test_new_group_skips_old_messages(server):
+    producer = stream('controller')
+    producer.publish_many('sdn', [b'old', b'older'])
+    consumer = stream('agent')
+    consumer.create_group('sdn')
+    producer.publish('sdn', b'new')
+    assert next(consumer.listen('sdn')) == b'new'
+
+def test_replay_channels_start_from_the_beginning(server, monkeypatch):
+    monkeypatch.setattr(transport, 'REPLAY_CHANNELS', ('sdn',))
+    stream('controller').publish_many('sdn', [b'one', b'two'])
+    assert take(stream('agent').listen('sdn'), 2) == [b'one', b'two']
+
+
+def test_every_controller_gets_every_message(server):
+    first, first_messages = listen(transport.group_name('controller', 'host1/west'), 'sdn_ack')
+    second, second_messages = listen(transport.group_name('controller', 'host2/east'), 'sdn_ack')
+    stream('agent').publish_many('sdn_ack', [b'one', b'two', b'three'])
+    assert take(first_messages, 3) == [b'one', b'two', b'three']
+    assert take(second_messages, 3) == [b'one', b'two', b'three']
+
+def test_messages_are_json():
+    message = {'station_name': 'sta1', 'phases': [('received', 1.5)]}
+    assert transport.unpack_message(transport.pack_message(message)) == {
+        'station_name': 'sta1', 'phases': [['received', 1.5]]}
+    with pytest.raises(ValueError):
+        transport.unpack_message(b'\x80\x04K\x01.')
+
+def agent(monkeypatch, aps):
+    monkeypatch.setattr(ap_agent, 'per_ap_mode', True)
+    monkeypatch.setattr(ap_agent, 'aps', aps)
+    return listen(transport.group_name('agent', ap_agent.transport_instance()), 'sdn')
+
+def test_every_agent_gets_every_instruction(server, monkeypatch):
+    first, first_messages = agent(monkeypatch, ['ap1', 'ap2'])
+    second, second_messages = agent(monkeypatch, ['ap3'])
+    assert first.group != second.group
+    instructions = [transport.pack_message({'station_name': 'sta%d' % i, 'ap': 'ap%d' % i})
+                    for i in range(1, 5)]
+    stream('controller:host1').publish_many('sdn', instructions)
+    assert take(first_messages, 4) == instructions
+    assert take(second_messages, 4) == instructions
@@ -0,0 +1,101 @@
+import copy
+
+import pytest
+
+import synthetic
+import wire_format
+
+
+def roundtrip(report, encoder=None, decoder=None):
+    encoder = encoder or wire_format.Encoder()
+    decoder = decoder or wire_format.Decoder()
+    return decoder.decode(encoder.encode(report, 1, 1000.0))
+
+def stations(report):
+    return {name: (stat['ssid'], station['aps'], pytest.approx(station['rx_rate']))
+            for stat in report for name, station in stat['stations_associated'].items()}
+
+
+def test_keyframe_and_delta_roundtrip():
+    network = synthetic.Network(4, 20)
+    encoder = wire_format.Encoder()
+    decoder = wire_format.Decoder()
+    for _ in range(3):
+        report = network.report()
+        decoded = roundtrip(report, encoder, decoder)
+        assert [stat['ssid'] for stat in decoded] == [stat['ssid'] for stat in report]
+        assert stations(decoded).keys() == stations(report).keys()
+
+def test_missing_rssi_is_left_out():
+    report = synthetic.make_report(4, 2)
+    station = next(iter(report[0]['stations_associated'].values()))
+    station['aps'] = {'ssid-ap1': '-70.00', 'ssid-ap2': None}
+    decoded = roundtrip(report)
+    assert next(iter(decoded[0]['stations_associated'].values()))['aps'] == {'ssid-ap1': '-70.00'}
+
+def test_malformed_keyframe_leaves_the_decoder_alone():
+    encoder = wire_format.Encoder()
+    decoder = wire_format.Decoder()
+    report = synthetic.make_report(10, 4)
+    decoder.decode(encoder.encode(report, 1, 1000.0))
+
+    keyframe = copy.deepcopy(encoder).encode(synthetic.make_report(10, 4, seed=3), 2, 1010.0, delta=False)
+    with pytest.raises(ValueError):
+        decoder.decode(keyframe[:-3])
+    assert decoder.seq == 1
+    assert decoder.captured_at == 1000.0
+    # deltas against the last good keyframe still decode
+    assert stations(decoder.decode(encoder.encode(report, 3, 1020.0))) == stations(report)
+
+def test_foreign_ssids_count_towards_the_layout():
+    report = synthetic.make_report(300, 1)
+    # 300 stations hearing 255 APs each that are not in the report: the
+    # strings outgrow 16 bit indices though the report itself is small
+    for i, station in enumerate(report[0]['stations_associated'].values()):
+        station['aps'] = {'ssid-x%d-%d' % (i, n): '-80.00' for n in range(255)}
+    encoder = wire_format.Encoder()
+    decoder = wire_format.Decoder()
+    keyframe = encoder.encode(report, 1, 1000.0)
+    assert keyframe[3] == wire_format.KEYFRAME | wire_format.WIDE
+    assert stations(decoder.decode(keyframe)) == stations(report)
+
+    for station in report[0]['stations_associated'].values():
+        station['rx_rate'] += 1
+    delta = encoder.encode(report, 2, 1001.0)
+    assert delta[3] == wire_format.DELTA | wire_format.WIDE
+    assert stations(decoder.decode(delta)) == stations(report)
+
+def test_other_versions_are_rejected():
+    payload = bytearray(wire_format.Encoder().encode(synthetic.make_report(4, 2), 1, 1000.0))
+    payload[2] = wire_format.WIRE_VERSION - 1
+    with pytest.raises(ValueError):
+        wire_format.Decoder().decode(bytes(payload))
+
+def test_out_of_range_values_are_clamped_or_left_out():
+    report = synthetic.make_report(4, 2)
+    station = next(iter(report[0]['stations_associated'].values()))
+    long_ssid = 'ssid-' + 'x' * 300
+    station['aps'] = {'ssid-ap1': '-900.00', 'ssid-ap2': 'inf', long_ssid: '-70.00'}
+    station['rx_rate'] = float('nan')
+    station['tx_rate'] = 1e300
+    station['rssi_age'] = float('inf')
+    decoded = next(iter(roundtrip(report)[0]['stations_associated'].values()))
+    assert decoded['aps'] == {'ssid-ap1': '-327.68', long_ssid: '-70.00'}
+    assert 'rx_rate' not in decoded
+    assert decoded['tx_rate'] == pytest.approx(wire_format.FLOAT32_MAX)
+    assert decoded['rssi_age'] is None
+
+def test_rates_left_out_stay_out_until_measured():
+    report = synthetic.make_report(4, 2)
+    station = next(iter(report[0]['stations_associated'].values()))
+    del station['rx_rate'], station['tx_rate']
+    encoder = wire_format.Encoder()
+    decoder = wire_format.Decoder()
+    decoded = decoder.decode(encoder.encode(report, 1, 1000.0))
+    assert 'rx_rate' not in next(iter(decoded[0]['stations_associated'].values()))
+
+    station['rx_rate'] = 2.0
+    station['tx_rate'] = 0.0
+    delta = encoder.encode(report, 2, 1010.0)
+    assert delta[3] == wire_format.DELTA
+    assert next(iter(decoder.decode(delta)[0]['stations_associated'].values()))['rx_rate'] == 2.0
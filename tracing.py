@@ -0,0 +1,91 @@
+import collections
+import threading
+import uuid
+
+# Handover latency tracing.
+#
+# Every migration gets a trace id. The controller and the agent mark the
+# wall clock time each phase of the handover is reached, and the time
+# between consecutive phases goes into a histogram named "prev->phase".
+# Histograms use power-of-two millisecond buckets, so recording a value is
+# a couple of integer operations and a list increment.
+
+# bucket i holds latencies in [2**(i-1), 2**i) ms, bucket 0 anything under 1 ms
+BUCKETS = 24
+# traces that never finish are forgotten after this many newer ones
+MAX_OPEN_TRACES = 4096
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        self.counts[min(int(ms).bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    # upper bound of the bucket holding the given quantile, in ms
+    def quantile(self, q):
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= q * self.count:
+                return 2 ** i
+        return 0
+
+
+class PhaseTracer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.traces = collections.OrderedDict()
+        self.histograms = collections.OrderedDict()
+
+    def mark(self, trace_id, phase, timestamp):
+        with self.lock:
+            trace = self.traces.get(trace_id)
+            if trace is None:
+                trace = self.traces[trace_id] = []
+                if len(self.traces) > MAX_OPEN_TRACES:
+                    self.traces.popitem(last=False)
+            if trace:
+                prev_phase, prev_timestamp = trace[-1]
+                self.record(prev_phase + '->' + phase, timestamp - prev_timestamp)
+            trace.append((phase, timestamp))
+
+    def is_open(self, trace_id):
+        with self.lock:
+            return trace_id in self.traces
+
+    # records the whole trace and forgets it
+    def finish(self, trace_id):
+        with self.lock:
+            trace = self.traces.pop(trace_id, None)
+            if trace and len(trace) > 1:
+                self.record('total ' + trace[0][0] + '->' + trace[-1][0], trace[-1][1] - trace[0][1])
+
+    def record(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.record(max(0.0, seconds))
+
+    def dump(self):
+        lines = ['%-40s %7s %10s %8s %8s %10s' % ('phase', 'count', 'mean ms', 'p50 <', 'p99 <', 'max ms')]
+        with self.lock:
+            histograms = list(self.histograms.items())
+        for name, histogram in histograms:
+            lines.append('%-40s %7d %10.1f %8d %8d %10.1f' % (
+                name, histogram.count, histogram.total / histogram.count,
+                histogram.quantile(0.5), histogram.quantile(0.99), histogram.max))
+        return '\n'.join(lines)
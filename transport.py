@@ -0,0 +1,159 @@
+import json
+import queue
+import socket
+
+import redis
+
+# Messaging between ap_agent.py and the controller.
+#
+# 'pubsub' is the original fire-and-forget Redis pub/sub: whatever is
+# published while nobody listens is lost. 'streams' keeps every channel in a
+# capped Redis Stream read through a consumer group, so a restarted consumer
+# picks up from the last message it acknowledged. Like pubsub, every process
+# gets every message of the channels it listens to: each one reads through a
+# consumer group of its own, named after its role and what it runs for, so
+# the name is the same after a restart. A new group starts at the end of the
+# stream: a fresh agent must not run old migration instructions and a fresh
+# controller must not balance on old statistics. 'local' passes messages
+# between threads of one process, for simulator.py.
+
+TRANSPORT = 'pubsub'
+REDIS_HOST = '127.0.0.1'
+
+# approximate number of messages kept per stream
+STREAM_MAXLEN = 1000
+# messages fetched per XREADGROUP call
+STREAM_BATCH = 32
+STREAM_BLOCK_MS = 1000
+# channels a new consumer group reads from the start of the stream, up to
+# STREAM_MAXLEN old messages. None by default, see above.
+REPLAY_CHANNELS = ()
+
+# channel -> queues of the local subscribers
+local_bus = {}
+
+
+# migration instructions, acks and the messages between region controllers
+# are JSON: unpickling what arrives from Redis would run whatever any client
+# of the server sends
+def pack_message(message):
+    return json.dumps(message).encode('UTF-8')
+
+def unpack_message(payload):
+    try:
+        message = json.loads(payload)
+    except (ValueError, UnicodeDecodeError) as ex:
+        raise ValueError('malformed message: %s' % ex)
+    if not isinstance(message, dict):
+        raise ValueError('malformed message: %r' % (message,))
+    return message
+
+
+class PubSubTransport:
+    def __init__(self, host=REDIS_HOST):
+        self.redis = redis.Redis(host)
+
+    def publish(self, channel, payload):
+        self.redis.publish(channel, payload)
+
+    def publish_many(self, channel, payloads):
+        pipe = self.redis.pipeline(transaction=False)
+        for payload in payloads:
+            pipe.publish(channel, payload)
+        pipe.execute()
+
+    def listen(self, channel):
+        pubsub = self.redis.pubsub()
+        pubsub.subscribe([channel])
+        for item in pubsub.listen():
+            # ignore the subscribe confirmation
+            if item['type'] != 'message':
+                continue
+            yield item['data']
+
+
+class StreamTransport:
+    def __init__(self, group, consumer=None, host=REDIS_HOST,
+                 maxlen=STREAM_MAXLEN, batch=STREAM_BATCH, block_ms=STREAM_BLOCK_MS):
+        self.redis = redis.Redis(host)
+        self.group = group
+        self.consumer = consumer or group
+        self.maxlen = maxlen
+        self.batch = batch
+        self.block_ms = block_ms
+
+    def publish(self, channel, payload):
+        self.redis.xadd(channel, {'data': payload}, maxlen=self.maxlen, approximate=True)
+
+    def publish_many(self, channel, payloads):
+        pipe = self.redis.pipeline(transaction=False)
+        for payload in payloads:
+            pipe.xadd(channel, {'data': payload}, maxlen=self.maxlen, approximate=True)
+        pipe.execute()
+
+    def create_group(self, channel):
+        try:
+            start = '0' if channel in REPLAY_CHANNELS else '$'
+            self.redis.xgroup_create(channel, self.group, id=start, mkstream=True)
+        except redis.ResponseError as ex:
+            if 'BUSYGROUP' not in str(ex):
+                raise
+
+    # messages are acknowledged once the caller asks for the next batch,
+    # i.e. after it processed them. Messages delivered before a restart but
+    # never acknowledged are replayed first.
+    def listen(self, channel):
+        self.create_group(channel)
+        last_id = '0'
+        while 1:
+            reply = self.redis.xreadgroup(self.group, self.consumer, {channel: last_id},
+                                          count=self.batch, block=self.block_ms)
+            entries = reply[0][1] if reply else []
+            if last_id == '0' and not entries:
+                # no pending messages left, switch to new ones
+                last_id = '>'
+                continue
+
+            for entry_id, fields in entries:
+                if fields and b'data' in fields:
+                    yield fields[b'data']
+
+            # one XACK for the whole batch
+            if entries:
+                self.redis.xack(channel, self.group, *[entry_id for entry_id, _ in entries])
+
+
+# pub/sub semantics without Redis: every subscriber of a channel gets its
+# own queue, messages published before it subscribed are not delivered
+class LocalTransport:
+    def publish(self, channel, payload):
+        for subscriber in local_bus.get(channel, ()):
+            subscriber.put(payload)
+
+    def publish_many(self, channel, payloads):
+        for payload in payloads:
+            self.publish(channel, payload)
+
+    # the queue of a new subscriber, for callers that poll instead of listening
+    def subscribe(self, channel):
+        subscriber = queue.Queue()
+        local_bus.setdefault(channel, []).append(subscriber)
+        return subscriber
+
+    def listen(self, channel):
+        subscriber = self.subscribe(channel)
+        while 1:
+            yield subscriber.get()
+
+
+# consumer group of one process, e.g. controller:host1/west. Processes that
+# share a group split the messages between them instead of each getting all.
+def group_name(role, instance=None):
+    return '%s:%s' % (role, instance or socket.gethostname())
+
+def connect(role, instance=None):
+    if TRANSPORT == 'streams':
+        return StreamTransport(group_name(role, instance))
+    if TRANSPORT == 'local':
+        return LocalTransport()
+    return PubSubTransport()
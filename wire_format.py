@@ -0,0 +1,412 @@
+import math
+import struct
+import sys
+from array import array
+
+# Binary encoding of the `statistics` reports published by ap_agent.py.
+#
+# A report is the list of AP dicts built by measures_ap_metrics(). Every
+# message carries its own string table, so AP and station names, interfaces
+# and SSIDs are sent once and referenced by index. Keyframes carry the whole
+# report, deltas only carry the stations whose rates or association changed
+# since the last keyframe, so a lost delta never corrupts the next one.
+# Every message also carries the report sequence number and the wall clock
+# time it was captured, so the controller can tell how stale it is. Stations
+# carry the second their RSSI was scanned, which stays the same between
+# scans and is turned back into an age by the decoder.
+#
+# Tables are sent column by column, each column a packed array, so they are
+# packed and unpacked by the array module instead of one struct call per
+# field. String indices and counts are 16 bit, or 32 bit in messages flagged
+# WIDE when a report has more strings than that. Values that do not fit
+# their column are clamped or left out, never raised on in the agent.
+
+MAGIC = b'WL'
+# 5: the index width follows the size of the string table, version 4
+# senders could pick 16 bit indices for a table that needed 32
+# 6: columnar tables, strings without a length limit
+WIRE_VERSION = 6
+
+KEYFRAME = 0
+DELTA = 1
+# or'ed into the kind of messages using the wide layout
+WIDE = 0x80
+
+# a keyframe is forced every KEYFRAME_INTERVAL reports
+KEYFRAME_INTERVAL = 10
+# rate changes (Mbps) smaller than this are not sent in deltas
+RATE_EPSILON = 0.01
+
+HEADER = struct.Struct('<2sBBIId')
+# byte length of the string table, total number of RSSI values
+SIZE = struct.Struct('<I')
+
+# the columns are little endian on the wire
+BIG_ENDIAN = sys.byteorder == 'big'
+
+FLOAT32_MAX = 3.4028234663852886e38
+INT16_MIN = -2 ** 15
+INT16_MAX = 2 ** 15 - 1
+UINT32_MAX = 2 ** 32 - 1
+UINT64_MAX = 2 ** 64 - 1
+NAN = float('nan')
+
+
+# the array typecode of one index width, also used for counts and AP indices
+class Layout:
+    def __init__(self, index):
+        self.index = index
+        self.count = struct.Struct('<' + index)
+        self.limit = 2 ** (8 * self.count.size)
+
+NARROW_LAYOUT = Layout('H')
+WIDE_LAYOUT = Layout('I')
+
+
+def pack_column(typecode, values):
+    column = array(typecode, values)
+    if BIG_ENDIAN:
+        column.byteswap()
+    return column.tobytes()
+
+def unpack_column(data, offset, typecode, n):
+    column = array(typecode)
+    end = offset + n * column.itemsize
+    if end > len(data):
+        raise ValueError('malformed statistics payload: truncated %s column' % typecode)
+    column.frombytes(data[offset:end])
+    if BIG_ENDIAN:
+        column.byteswap()
+    return column.tolist(), end
+
+
+class StringTable:
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    # strings are sent NUL separated, a NUL inside one is dropped
+    def intern(self, value):
+        index = self.ids.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.ids[value] = index
+            self.strings.append('' if value is None else str(value).replace('\0', ''))
+        return index
+
+    def pack(self, layout):
+        data = '\0'.join(self.strings).encode('UTF-8')
+        return layout.count.pack(len(self.strings)) + SIZE.pack(len(data)) + data
+
+
+def unpack_strings(data, offset, layout):
+    count, = layout.count.unpack_from(data, offset)
+    offset += layout.count.size
+    size, = SIZE.unpack_from(data, offset)
+    offset += SIZE.size
+    if offset + size > len(data):
+        raise ValueError('malformed statistics payload: truncated string table')
+    strings = data[offset:offset + size].decode('UTF-8').split('\0') if count else []
+    if len(strings) != count:
+        raise ValueError('malformed statistics payload: %d strings for %d' % (len(strings), count))
+    return strings, offset + size
+
+# hundredths of dBm clamped to 16 bit, None for an RSSI the scan did not give
+def rssi_value(value):
+    try:
+        value = int(round(float(value) * 100))
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return max(INT16_MIN, min(INT16_MAX, value))
+
+# rssi_value() of the valid values seen so far, the agent only reports a
+# few hundred different ones
+rssi_values = {}
+RSSI_CACHE_SIZE = 4096
+
+def parse_rssi(aps):
+    rssi = []
+    for ssid, value in aps.items():
+        parsed = rssi_value(value)
+        if parsed is None:
+            continue
+        rssi.append((ssid, parsed))
+        if len(rssi_values) < RSSI_CACHE_SIZE:
+            rssi_values[value] = parsed
+    return tuple(rssi)
+
+# Mbps as a float32. NaN stands for a rate the agent left out, it had no
+# earlier sample of the station, and for a rate that is not a number.
+def rate_value(value):
+    # NaN fails the comparison too
+    if type(value) is float and -FLOAT32_MAX <= value <= FLOAT32_MAX:
+        return value
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return NAN
+    if math.isnan(value):
+        return NAN
+    return max(-FLOAT32_MAX, min(FLOAT32_MAX, value))
+
+# RSSI values travel as hundredths of dBm, the agent reports them as '-80.00'.
+# APs the scan listed without a signal are left out. The scan time is a
+# whole second, 0 when the station was never scanned.
+def station_state(ap_index, station, captured_at):
+    aps = station.get('aps') or {}
+    try:
+        rssi = tuple([(ssid, rssi_values[value]) for ssid, value in aps.items()])
+    # a value not seen yet, missing or not hashable
+    except (KeyError, TypeError):
+        rssi = parse_rssi(aps)
+    scanned_at = 0
+    rssi_age = station.get('rssi_age')
+    if rssi_age is not None:
+        try:
+            scanned_at = max(1, min(UINT32_MAX, int(round(captured_at - rssi_age))))
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return (ap_index, rate_value(station.get('rx_rate')),
+            rate_value(station.get('tx_rate')), rssi, scanned_at)
+
+def dpid_value(dpid):
+    try:
+        dpid = int(dpid)
+    except (TypeError, ValueError):
+        return 0
+    return dpid if 0 <= dpid <= UINT64_MAX else 0
+
+# the columns of a list of (name, state), whose strings are in the table
+def pack_stations(table, stations, layout):
+    ids = table.ids
+    names = [ids[name] for name, _ in stations]
+    states = [state for _, state in stations]
+    ap_indices, rx_rates, tx_rates, rssis, scanned = zip(*states) if states else ((),) * 5
+    ssids = [ids[ssid] for rssi in rssis for ssid, _ in rssi]
+    values = [value for rssi in rssis for _, value in rssi]
+    index = layout.index
+    return b''.join([layout.count.pack(len(names)),
+                     pack_column(index, names), pack_column(index, ap_indices),
+                     pack_column('f', rx_rates), pack_column('f', tx_rates),
+                     pack_column('I', scanned), pack_column(index, map(len, rssis)),
+                     SIZE.pack(len(values)), pack_column(index, ssids), pack_column('h', values)])
+
+# {name: (ap index, rx rate, tx rate, {ssid: rssi}, scanned at)} of the stations
+# columns
+def unpack_stations(data, offset, strings, layout):
+    index = layout.index
+    n, = layout.count.unpack_from(data, offset)
+    offset += layout.count.size
+    names, offset = unpack_column(data, offset, index, n)
+    ap_indices, offset = unpack_column(data, offset, index, n)
+    rx_rates, offset = unpack_column(data, offset, 'f', n)
+    tx_rates, offset = unpack_column(data, offset, 'f', n)
+    scanned, offset = unpack_column(data, offset, 'I', n)
+    counts, offset = unpack_column(data, offset, index, n)
+    m, = SIZE.unpack_from(data, offset)
+    offset += SIZE.size
+    if sum(counts) != m:
+        raise ValueError('malformed statistics payload: %d RSSI values for %d' % (m, sum(counts)))
+    ssids, offset = unpack_column(data, offset, index, m)
+    values, offset = unpack_column(data, offset, 'h', m)
+
+    ssids = [strings[ssid] for ssid in ssids]
+    texts = [rssi_texts.get(value) or rssi_text(value) for value in values]
+    stations = {}
+    start = 0
+    for name, ap_index, rx_rate, tx_rate, scanned_at, count in zip(
+            names, ap_indices, rx_rates, tx_rates, scanned, counts):
+        end = start + count
+        stations[strings[name]] = (ap_index, rx_rate, tx_rate,
+                                   dict(zip(ssids[start:end], texts[start:end])), scanned_at)
+        start = end
+    return stations, offset
+
+# the layout for a message holding at most n strings or items
+def layout_for(n):
+    if n < NARROW_LAYOUT.limit:
+        return NARROW_LAYOUT
+    return WIDE_LAYOUT
+
+# NaN, a rate left out, only equals NaN
+def rate_changed(old, new):
+    if old != old or new != new:
+        return (old != old) != (new != new)
+    return abs(old - new) > RATE_EPSILON
+
+def changed(old, new):
+    return (old[0] != new[0] or old[3] != new[3] or old[4] != new[4]
+            or rate_changed(old[1], new[1]) or rate_changed(old[2], new[2]))
+
+# the strings a list of (name, state) puts in the table
+def intern_stations(table, stations):
+    ids = table.ids
+    for name, state in stations:
+        if name not in ids:
+            table.intern(name)
+        for ssid, _ in state[3]:
+            if ssid not in ids:
+                table.intern(ssid)
+
+
+class Encoder:
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.keyframe_id = 0
+        self.since_keyframe = 0
+        self.base_aps = None
+        self.base_stations = {}
+
+    def encode(self, report, seq=0, captured_at=0.0, delta=True):
+        aps = tuple((ap['name'], ap['if_name'], ap['ssid'], dpid_value(ap['dpid'])) for ap in report)
+        stations = {}
+        for ap_index, ap in enumerate(report):
+            for name, station in ap['stations_associated'].items():
+                stations[name] = station_state(ap_index, station, captured_at)
+
+        if (not delta or aps != self.base_aps
+                or self.since_keyframe >= self.keyframe_interval):
+            kind, body = self.encode_keyframe(aps, stations)
+        else:
+            self.since_keyframe += 1
+            kind, body = self.encode_delta(stations)
+        return HEADER.pack(MAGIC, WIRE_VERSION, kind, self.keyframe_id, seq & 0xffffffff, captured_at) + body
+
+    def encode_keyframe(self, aps, stations):
+        self.keyframe_id = (self.keyframe_id + 1) & 0xffffffff
+        self.since_keyframe = 1
+        self.base_aps = aps
+        self.base_stations = stations
+
+        # the layout is sized by the strings actually sent, which include
+        # the ssids of APs heard but not in the report
+        table = StringTable()
+        for name, if_name, ssid, _ in aps:
+            table.intern(name)
+            table.intern(if_name)
+            table.intern(ssid)
+        intern_stations(table, stations.items())
+        layout = layout_for(max(len(table.strings), len(aps)))
+
+        body = [layout.count.pack(len(aps)),
+                pack_column(layout.index, [table.intern(ap[0]) for ap in aps]),
+                pack_column(layout.index, [table.intern(ap[1]) for ap in aps]),
+                pack_column(layout.index, [table.intern(ap[2]) for ap in aps]),
+                pack_column('Q', [ap[3] for ap in aps]),
+                pack_stations(table, stations.items(), layout)]
+        kind = KEYFRAME if layout is NARROW_LAYOUT else KEYFRAME | WIDE
+        return kind, table.pack(layout) + b''.join(body)
+
+    def encode_delta(self, stations):
+        updated = []
+        for name, state in stations.items():
+            old = self.base_stations.get(name)
+            if old is None or changed(old, state):
+                updated.append((name, state))
+        removed = [name for name in self.base_stations if name not in stations]
+
+        # updated and removed stations plus the ssids they hear, and the
+        # AP indices sent with the updates
+        table = StringTable()
+        intern_stations(table, updated)
+        for name in removed:
+            table.intern(name)
+        layout = layout_for(max(len(table.strings), len(self.base_aps)))
+
+        body = [pack_stations(table, updated, layout), layout.count.pack(len(removed)),
+                pack_column(layout.index, [table.intern(name) for name in removed])]
+        kind = DELTA if layout is NARROW_LAYOUT else DELTA | WIDE
+        return kind, table.pack(layout) + b''.join(body)
+
+
+class Decoder:
+    def __init__(self):
+        self.keyframe_id = None
+        self.base_aps = []
+        self.base_stations = {}
+        # sequence number and capture time of the last decoded message
+        self.seq = None
+        self.captured_at = None
+
+    # returns the report in the same shape ap_agent.py builds it, or None
+    # when a delta arrives for a keyframe this decoder has not seen. The
+    # decoder state only changes once a message decoded in full.
+    def decode(self, payload):
+        try:
+            magic, version, kind, keyframe_id, seq, captured_at = HEADER.unpack_from(payload)
+            if magic != MAGIC or version != WIRE_VERSION:
+                raise ValueError('unsupported statistics payload (version %s)' % version)
+            layout = WIDE_LAYOUT if kind & WIDE else NARROW_LAYOUT
+            kind &= ~WIDE
+            if kind == DELTA and keyframe_id != self.keyframe_id:
+                return None
+            strings, offset = unpack_strings(payload, HEADER.size, layout)
+            if kind == KEYFRAME:
+                aps, stations = self.decode_keyframe(payload, offset, strings, layout)
+            elif kind == DELTA:
+                aps = self.base_aps
+                stations = self.decode_delta(payload, offset, strings, layout)
+            else:
+                raise ValueError('unknown statistics message kind %d' % kind)
+            report = build_report(aps, stations, captured_at)
+        except (struct.error, IndexError, UnicodeDecodeError) as ex:
+            raise ValueError('malformed statistics payload: %s' % ex)
+
+        if kind == KEYFRAME:
+            self.keyframe_id = keyframe_id
+            self.base_aps = aps
+            self.base_stations = stations
+        self.seq = seq
+        self.captured_at = captured_at
+        return report
+
+    def decode_keyframe(self, data, offset, strings, layout):
+        count, = layout.count.unpack_from(data, offset)
+        offset += layout.count.size
+        names, offset = unpack_column(data, offset, layout.index, count)
+        if_names, offset = unpack_column(data, offset, layout.index, count)
+        ssids, offset = unpack_column(data, offset, layout.index, count)
+        dpids, offset = unpack_column(data, offset, 'Q', count)
+        aps = [(strings[name], strings[if_name], strings[ssid], dpid)
+               for name, if_name, ssid, dpid in zip(names, if_names, ssids, dpids)]
+        stations, offset = unpack_stations(data, offset, strings, layout)
+        return aps, stations
+
+    def decode_delta(self, data, offset, strings, layout):
+        stations = dict(self.base_stations)
+        updated, offset = unpack_stations(data, offset, strings, layout)
+        stations.update(updated)
+        count, = layout.count.unpack_from(data, offset)
+        offset += layout.count.size
+        removed, offset = unpack_column(data, offset, layout.index, count)
+        for index in removed:
+            stations.pop(strings[index], None)
+        return stations
+
+
+# '%.2f' dBm of the RSSI values seen so far, there are only a few hundred
+rssi_texts = {}
+
+def rssi_text(value):
+    text = rssi_texts.get(value)
+    if text is None:
+        text = rssi_texts[value] = '%.2f' % (value / 100)
+    return text
+
+def build_report(aps, stations, captured_at):
+    report = []
+    for name, if_name, ssid, dpid in aps:
+        report.append({'name': name, 'dpid': dpid, 'if_name': if_name,
+                       'ssid': ssid, 'stations_associated': {}})
+    associated = [ap['stations_associated'] for ap in report]
+    for name, (ap_index, rx_rate, tx_rate, rssi, scanned_at) in stations.items():
+        station = associated[ap_index][name] = {
+            'aps': dict(rssi),
+            'rssi_age': max(0.0, captured_at - scanned_at) if scanned_at else None,
+        }
+        # rates the agent left out stay out
+        if rx_rate == rx_rate:
+            station['rx_rate'] = rx_rate
+        if tx_rate == tx_rate:
+            station['tx_rate'] = tx_rate
+    return report